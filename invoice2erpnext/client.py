@@ -0,0 +1,222 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Defaults used when the settings leave the connection fields empty
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_POOL_SIZE = 10
+
+# Responses that are worth retrying after a backoff
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Responses to an upload after which the file was certainly not extracted (and charged);
+# a 500, 502 or 504 may come after the extraction went through
+UPLOAD_RETRY_STATUS_CODES = (429, 503)
+
+# Bytes read from disk at a time when streaming uploads
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(max_retries=DEFAULT_MAX_RETRIES, pool_size=DEFAULT_POOL_SIZE, retry_status_codes=RETRY_STATUS_CODES):
+    """
+    Get the shared keep-alive session of this process for a retry policy
+
+    Args:
+        max_retries: Number of retries on connection errors and retryable status codes
+        pool_size: Maximum number of pooled connections per host
+        retry_status_codes: Status codes retried after a backoff, or the Retry-After the server asks for
+
+    Returns:
+        requests.Session: Session with connection pooling and retry with backoff
+    """
+    key = (max_retries, pool_size, tuple(retry_status_codes))
+    session = _sessions.get(key)
+    if session:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if not session:
+            retry = Retry(
+                total=max_retries,
+                connect=max_retries,
+                read=0,  # Never resend a request the server may already have processed
+                status=max_retries,
+                backoff_factor=0.5,
+                status_forcelist=retry_status_codes,
+                allowed_methods=frozenset(["GET", "POST"]),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[key] = session
+
+    return session
+
+
+def get_auth_headers(settings):
+    """Build the token authorization header from Invoice2Erpnext Settings"""
+    api_key = settings.get_password('api_key')
+    api_secret = settings.get_password('api_secret')
+    return {
+        "Authorization": f"token {api_key}:{api_secret}"
+    }
+
+
+def post(settings, endpoint, headers=None, retry_status_codes=RETRY_STATUS_CODES, **kwargs):
+    """
+    POST to the kainotomo.com API using the shared session
+
+    Args:
+        settings: Invoice2Erpnext Settings providing base URL, credentials and connection options;
+            base_url overrides the BASE_URL of the hosted API when set
+        endpoint: API path, e.g. "/api/method/..."
+        headers: Extra headers merged over the authorization header
+        retry_status_codes: Status codes after which the request is sent again; requests the
+            server may have acted on (e.g. charged uploads) should use UPLOAD_RETRY_STATUS_CODES
+        **kwargs: Passed on to requests (json, data, files, ...)
+
+    Returns:
+        requests.Response: The final response after any retries
+    """
+    request_headers = get_auth_headers(settings)
+    request_headers.update(headers or {})
+
+    timeout = (
+        settings.connect_timeout or DEFAULT_CONNECT_TIMEOUT,
+        settings.read_timeout or DEFAULT_READ_TIMEOUT
+    )
+    max_retries = int(settings.max_retries or DEFAULT_MAX_RETRIES)
+    pool_size = max(DEFAULT_POOL_SIZE, settings.batch_concurrency or 0)
+
+    session = get_session(max_retries, pool_size, retry_status_codes)
+    return session.post(
+        urljoin(settings.base_url or settings.BASE_URL, endpoint),
+        headers=request_headers,
+        timeout=timeout,
+        **kwargs
+    )
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data request body that streams a file from disk in chunks
+
+    The body is exposed as a seekable file-like object with a known length, so
+    requests sends it with a Content-Length header while reading the file piece
+    by piece, and urllib3 can rewind it when a request is retried.
+
+    finished_at holds the time.perf_counter() value at which the last byte was
+    read, i.e. when the upload completed and the wait for the response began.
+    """
+
+    def __init__(self, file_path, file_name, content_type, fields=None, field_name="file"):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        head = []
+        for name, value in (fields or {}).items():
+            head.append(
+                f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        file_name = file_name.replace('"', "%22")
+        head.append(
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        )
+
+        self._head = "".join(head).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._file = open(file_path, "rb")
+        self._file_size = os.fstat(self._file.fileno()).st_size
+        self._length = len(self._head) + self._file_size + len(self._tail)
+        self._position = 0
+        self.finished_at = None
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        """Read up to size bytes of the body, crossing part boundaries as needed"""
+        if size is None or size < 0:
+            size = self._length - self._position
+
+        chunks = []
+        while size > 0 and self._position < self._length:
+            chunk = self._read_part(size)
+            if not chunk:
+                raise IOError("File changed on disk while it was being uploaded")
+            chunks.append(chunk)
+            size -= len(chunk)
+            self._position += len(chunk)
+
+        if chunks and self._position >= self._length:
+            self.finished_at = time.perf_counter()
+
+        return b"".join(chunks)
+
+    def _read_part(self, size):
+        """Read from the part of the body the current position falls in"""
+        head_end = len(self._head)
+        file_end = head_end + self._file_size
+
+        if self._position < head_end:
+            return self._head[self._position:self._position + size]
+        if self._position < file_end:
+            return self._file.read(min(size, file_end - self._position))
+
+        offset = self._position - file_end
+        return self._tail[offset:offset + size]
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to a position in the body, keeping the file pointer in step"""
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._length
+
+        self._position = max(0, min(offset, self._length))
+        if self._position < self._length:
+            self.finished_at = None  # Rewound for a retry, the body is sent again
+        self._file.seek(max(0, min(self._position - len(self._head), self._file_size)))
+        return self._position
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,117 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Normalization of extracted invoice dates to YYYY-MM-DD
+
+Dates are matched against a few precompiled patterns by shape (year first,
+day and month numbers, month names) and checked by building a date, instead
+of trying strptime formats one after the other. Numeric dates such as
+03/04/2025 are ambiguous; they are read in the order given by the caller,
+typically the order learned from earlier unambiguous dates of the supplier.
+"""
+
+import re
+from datetime import date
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# Orders of the date parts
+DAY_FIRST = "DMY"
+MONTH_FIRST = "MDY"
+YEAR_FIRST = "YMD"
+
+# English month names and abbreviations
+MONTHS = {
+    "jan": 1, "january": 1,
+    "feb": 2, "february": 2,
+    "mar": 3, "march": 3,
+    "apr": 4, "april": 4,
+    "may": 5,
+    "jun": 6, "june": 6,
+    "jul": 7, "july": 7,
+    "aug": 8, "august": 8,
+    "sep": 9, "sept": 9, "september": 9,
+    "oct": 10, "october": 10,
+    "nov": 11, "november": 11,
+    "dec": 12, "december": 12,
+}
+
+# 2025-03-14, 2025/3/14, 2025.03.14
+YEAR_FIRST_PATTERN = re.compile(r"(\d{4})([-/.])(\d{1,2})\2(\d{1,2})")
+
+# 14/03/2025, 03-14-2025, 14.3.2025
+NUMERIC_PATTERN = re.compile(r"(\d{1,2})([-/.])(\d{1,2})\2(\d{4})")
+
+# 14 Mar 2025, 14 March, 2025
+DAY_MONTH_NAME_PATTERN = re.compile(r"(\d{1,2})\s+([a-z]+)\.?,?\s+(\d{4})")
+
+# Mar 14 2025, March 14, 2025
+MONTH_NAME_DAY_PATTERN = re.compile(r"([a-z]+)\.?\s+(\d{1,2}),?\s+(\d{4})")
+
+
+class ParsedDate(NamedTuple):
+    """A recognized date and how it was read"""
+
+    date: date
+    order: str  # Order of the parts in the original string
+    ambiguous: bool  # Whether day and month could have been read the other way round
+    numeric: bool  # Whether the month was written as a number
+
+
+@lru_cache(maxsize=4096)
+def parse_date(value: str, order: str = DAY_FIRST) -> Optional[ParsedDate]:
+    """
+    Recognize a date written in one of the common invoice formats
+
+    Results are cached, as the same dates repeat across the invoices of a period.
+
+    Args:
+        value: The date as extracted
+        order: DAY_FIRST or MONTH_FIRST, used to read ambiguous numeric dates
+
+    Returns:
+        ParsedDate: The date, or None if the string isn't a valid date
+    """
+    value = value.strip().lower()
+
+    match = YEAR_FIRST_PATTERN.fullmatch(value)
+    if match:
+        year, _, month, day = match.groups()
+        return _build(year, month, day, YEAR_FIRST, False, True)
+
+    match = NUMERIC_PATTERN.fullmatch(value)
+    if match:
+        first, _, second, year = match.groups()
+        first, second = int(first), int(second)
+        if first > 12:
+            return _build(year, second, first, DAY_FIRST, False, True)
+        if second > 12:
+            return _build(year, first, second, MONTH_FIRST, False, True)
+
+        # Both parts could be the month
+        if order == MONTH_FIRST:
+            return _build(year, first, second, MONTH_FIRST, True, True)
+        return _build(year, second, first, DAY_FIRST, True, True)
+
+    match = DAY_MONTH_NAME_PATTERN.fullmatch(value)
+    if match:
+        day, month_name, year = match.groups()
+        return _build(year, MONTHS.get(month_name), day, DAY_FIRST, False, False)
+
+    match = MONTH_NAME_DAY_PATTERN.fullmatch(value)
+    if match:
+        month_name, day, year = match.groups()
+        return _build(year, MONTHS.get(month_name), day, MONTH_FIRST, False, False)
+
+    return None
+
+
+def _build(year, month, day, order, ambiguous, numeric):
+    """Build the ParsedDate, or None if the parts don't make a valid date"""
+    if not month:
+        return None
+    try:
+        return ParsedDate(date(int(year), int(month), int(day)), order, ambiguous, numeric)
+    except ValueError:
+        return None
@@ -0,0 +1,157 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Typed model of the document extracted by doc2sys
+
+The extracted document is a nested structure of fields such as
+{"InvoiceTotal": {"valueCurrency": {"amount": 12.5, "currencyCode": "EUR"}, "confidence": 0.9}}.
+ExtractedInvoice.parse walks it once, validates its shape and returns immutable
+slotted objects, so the rest of the pipeline reads plain attributes.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from invoice2erpnext import money
+
+
+def round_amount(amount) -> float:
+    """Standardize decimal precision for monetary values, rounding half to even like Frappe"""
+    return float(money.round_money(amount))
+
+
+def _object(value) -> Dict[str, Any]:
+    """Return value if it is an object, otherwise an empty one"""
+    return value if isinstance(value, dict) else {}
+
+
+def _string(field: Dict[str, Any], key: str = "valueString") -> str:
+    """Read a string value of a field, treating missing or non-string values as empty"""
+    value = field.get(key)
+    return value if isinstance(value, str) else ""
+
+
+@dataclass(frozen=True, slots=True)
+class Amount:
+    """Monetary field with its extraction confidence"""
+
+    amount: float = 0
+    currency_code: Optional[str] = None
+    confidence: float = 0
+
+    @classmethod
+    def parse(cls, field: Dict[str, Any]) -> "Amount":
+        field = _object(field)
+        value_currency = _object(field.get("valueCurrency"))
+        currency_code = value_currency.get("currencyCode")
+        return cls(
+            amount=round_amount(value_currency.get("amount", 0)),
+            currency_code=currency_code if isinstance(currency_code, str) else None,
+            confidence=field.get("confidence") or 0
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class Address:
+    """Vendor address, with None for parts that were not extracted"""
+
+    street_address: Optional[str] = None
+    city: Optional[str] = None
+    postal_code: Optional[str] = None
+    country_region: Optional[str] = None
+
+    @classmethod
+    def parse(cls, field: Dict[str, Any]) -> "Address":
+        value = _object(_object(field).get("valueAddress"))
+        return cls(
+            street_address=value.get("streetAddress"),
+            city=value.get("city"),
+            postal_code=value.get("postalCode"),
+            country_region=value.get("countryRegion")
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class LineItem:
+    """Single invoice line"""
+
+    description: str = ""
+    product_code: str = ""
+    quantity: float = 1
+    unit_price: float = 0
+    amount: float = 0
+    currency_code: Optional[str] = None
+
+    @classmethod
+    def parse(cls, item: Dict[str, Any]) -> "LineItem":
+        if not isinstance(item, dict):
+            raise ValueError("Invoice item must be an object")
+
+        data = _object(item.get("valueObject"))
+        amount = Amount.parse(data.get("Amount"))
+        return cls(
+            description=_string(_object(data.get("Description"))),
+            product_code=_string(_object(data.get("ProductCode"))),
+            quantity=_object(data.get("Quantity")).get("valueNumber", 1) or 1,  # Ensure quantity is never zero
+            unit_price=Amount.parse(data.get("UnitPrice")).amount,
+            amount=amount.amount,
+            currency_code=amount.currency_code
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ExtractedInvoice:
+    """Invoice header, amounts and line items of an extracted document"""
+
+    invoice_id: str = ""
+    vendor_name: str = ""
+    vendor_address: Address = Address()
+    vendor_tax_id: str = ""
+    invoice_date: str = ""
+    payment_term: str = ""
+    invoice_total: Amount = Amount()
+    subtotal: Amount = Amount()
+    total_tax: Amount = Amount()
+    total_discount: Amount = Amount()
+    items: Tuple[LineItem, ...] = ()
+
+    @property
+    def currency(self) -> str:
+        """Invoice currency, defaulting to EUR when it was not extracted"""
+        return self.invoice_total.currency_code or "EUR"
+
+    @classmethod
+    def parse(cls, extracted_doc: Dict[str, Any]) -> "ExtractedInvoice":
+        """
+        Parse and validate an extracted document in a single pass
+
+        Args:
+            extracted_doc: The extracted document as returned by doc2sys
+
+        Returns:
+            ExtractedInvoice: The parsed invoice
+
+        Raises:
+            ValueError: If the document does not have the expected structure
+        """
+        if not isinstance(extracted_doc, dict):
+            raise ValueError("Extracted document must be an object")
+
+        items = _object(extracted_doc.get("Items")).get("valueArray") or []
+        if not isinstance(items, list):
+            raise ValueError("Invoice items must be a list")
+
+        return cls(
+            invoice_id=_string(_object(extracted_doc.get("InvoiceId"))),
+            vendor_name=_string(_object(extracted_doc.get("VendorName"))).replace("\n", " ").strip(),
+            vendor_address=Address.parse(extracted_doc.get("VendorAddress")),
+            vendor_tax_id=_string(_object(extracted_doc.get("VendorTaxId"))),
+            invoice_date=_string(_object(extracted_doc.get("InvoiceDate")), "valueDate"),
+            payment_term=_string(_object(extracted_doc.get("PaymentTerm"))),
+            invoice_total=Amount.parse(extracted_doc.get("InvoiceTotal")),
+            subtotal=Amount.parse(extracted_doc.get("SubTotal")),
+            total_tax=Amount.parse(extracted_doc.get("TotalTax")),
+            total_discount=Amount.parse(extracted_doc.get("TotalDiscount")),
+            items=tuple(LineItem.parse(item) for item in items)
+        )
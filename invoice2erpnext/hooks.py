@@ -64,7 +64,8 @@ doctype_list_js = {"Purchase Invoice" : "public/js/purchase_invoice_list.js"}
 # ------------
 
 # before_install = "invoice2erpnext.install.before_install"
-# after_install = "invoice2erpnext.install.after_install"
+after_install = "invoice2erpnext.install.after_install"
+after_migrate = "invoice2erpnext.install.after_migrate"
 
 # Uninstallation
 # ------------
@@ -124,6 +125,17 @@ doctype_list_js = {"Purchase Invoice" : "public/js/purchase_invoice_list.js"}
 #	}
 #}
 
+doc_events = {
+	"System Settings": {
+		"on_update": "invoice2erpnext.utils.clear_currency_formatter"
+	},
+	"Supplier": {
+		"on_update": "invoice2erpnext.supplier_index.on_supplier_update",
+		"after_rename": "invoice2erpnext.supplier_index.on_supplier_rename",
+		"on_trash": "invoice2erpnext.supplier_index.on_supplier_trash"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
@@ -0,0 +1,16 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import frappe
+
+def after_install():
+    create_indexes()
+
+def after_migrate():
+    create_indexes()
+
+def create_indexes():
+    """Add the database indexes used by invoice processing, if they don't exist yet"""
+    # Duplicate bill detection looks up Purchase Invoices by supplier and bill number. The bill
+    # date is left out on purpose: extractions of the same bill may read its date differently
+    frappe.db.add_index("Purchase Invoice", ["supplier", "bill_no"], "supplier_bill_no_index")
@@ -3,28 +3,146 @@
 
 import frappe
 from frappe.model.document import Document
-import requests
+import hashlib
 import json
 import os
 import mimetypes
-from urllib.parse import urljoin
-from frappe.utils import get_files_path, get_site_path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from frappe.utils import flt, get_files_path, get_site_path
 from typing import Dict, Any, List
-from invoice2erpnext.utils import format_currency_value  # Import the utility function
+from invoice2erpnext import client, metrics, supplier_index, transform
+from invoice2erpnext.extraction import ExtractedInvoice
+from invoice2erpnext.utils import compress_text, decompress_text, log_error_throttled
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_settings.invoice2erpnext_settings import (
+    deduct_cached_credits,
+    get_settings_snapshot
+)
+
+# Statuses after which a log is no longer being processed
+FINAL_STATUSES = ("Success", "Error", "Duplicate")
+
+# Master data created in auto mode, with the field that holds its name
+MASTER_DATA_KEY_FIELDS = {
+    "Supplier": "supplier_name",
+    "Item": "item_code"
+}
+
+# Timing fields of the stages that turn an extraction into a Purchase Invoice
+INVOICE_TIMING_FIELDS = ("transform_time", "master_data_time", "invoice_insert_time", "file_link_time")
+
+# Timing fields of all stages of processing a file
+TIMING_FIELDS = ("upload_time", "remote_time", "parse_time") + INVOICE_TIMING_FIELDS + ("total_time",)
+
+# Day/month order of numeric dates learned per supplier, shared by all workers
+DATE_ORDER_CACHE_KEY = "invoice2erpnext:supplier_date_order"
+
+# Diagnostics kept per log, further ones are dropped
+MAX_DIAGNOSTICS = 100
+
+# Existing master data names per running batch, shared by the batch threads
+_batch_master_data = {}
+
+# Locks of the supplier bills per running batch, and those the current thread holds until it commits
+_batch_bill_locks = {}
+_held_bill_locks = threading.local()
+
+# Savepoint around the documents created for a log
+UNIT_OF_WORK_SAVEPOINT = "invoice2erpnext_unit_of_work"
+
+# Savepoint around the insert of a single Item, within the unit of work
+ITEM_INSERT_SAVEPOINT = "invoice2erpnext_item_insert"
+
+
+class FrappeLookups(transform.Lookups):
+    """Transformation lookups backed by the site database, keeping diagnostics on a log"""
+
+    def __init__(self, log=None):
+        super().__init__()
+        self.log = log
+
+    def exists(self, doctype, name):
+        return bool(frappe.db.exists(doctype, name))
+
+    def log_error(self, message):
+        log_error_throttled(message, "transform")
+
+    def add_diagnostic(self, code, message, **details):
+        if self.log:
+            self.log.add_diagnostic(code, message, **details)
+        else:
+            super().add_diagnostic(code, message, **details)
+
+    def today(self):
+        return frappe.utils.today()
+
+    def find_supplier(self, tax_id, supplier_name):
+        return supplier_index.find_supplier(tax_id, supplier_name)
+
+    def get_date_order(self, supplier):
+        return frappe.cache().hget(DATE_ORDER_CACHE_KEY, supplier)
+
+    def set_date_order(self, supplier, order):
+        frappe.cache().hset(DATE_ORDER_CACHE_KEY, supplier, order)
 
 
 class Invoice2ErpnextLog(Document):
     @frappe.whitelist()
     def create_purchase_invoice(self):
         """Main entry point for purchase invoice creation - routes to appropriate method based on mode"""
+        reset_timings(self, INVOICE_TIMING_FIELDS)
+        self.clear_diagnostics()
+        return self.process_purchase_invoice(get_settings_snapshot())
+    
+    def validate(self):
+        # Store the diagnostics buffered while processing with this save
+        if getattr(self, "_diagnostics", None) is not None:
+            self.diagnostics = json.dumps(self._diagnostics, indent=1, ensure_ascii=False) if self._diagnostics else None
+    
+    def add_diagnostic(self, code, message, **details):
+        """
+        Buffer a finding about the processed document, such as a fixed date or
+        a low extraction score. Diagnostics are written to the log with its next
+        save instead of creating an Error Log each.
+        
+        Args:
+            code: Stable identifier of the kind of finding, e.g. "date_fixed"
+            message: Human readable description
+            **details: Values behind the finding
+        """
+        diagnostics = self.get_diagnostics()
+        if len(diagnostics) < MAX_DIAGNOSTICS:
+            diagnostics.append({"code": code, "message": message, **details})
+    
+    def get_diagnostics(self):
+        """Diagnostics of the log, including those not saved yet"""
+        if getattr(self, "_diagnostics", None) is None:
+            self._diagnostics = json.loads(self.diagnostics) if self.diagnostics else []
+        return self._diagnostics
+    
+    def clear_diagnostics(self):
+        """Drop diagnostics before the log is processed again"""
+        self._diagnostics = []
+    
+    def process_purchase_invoice(self, settings):
+        """Route to the manual or automatic mode using an already loaded settings snapshot; both commit before their duplicate check"""
         # Check if we're in manual mode with a specified supplier and item
         if hasattr(self, 'manual_mode') and self.manual_mode == 1:
-            return self.create_purchase_invoice_manual()
+            return self.create_purchase_invoice_manual(settings)
         else:
-            return self.create_purchase_invoice_auto()
+            return self.create_purchase_invoice_auto(settings)
             
-    def create_purchase_invoice_manual(self):
-        """Create a purchase invoice using manually selected supplier and item"""
+    def create_purchase_invoice_manual(self, settings=None):
+        """
+        Create a purchase invoice using manually selected supplier and item
+        
+        Commits the current transaction before checking for a duplicate bill, so
+        the check sees invoices committed meanwhile by other workers or batch
+        threads (see lock_bill). The invoice is then created in a unit of work.
+        """
+        settings = settings or get_settings_snapshot()
         try:
             # Get specified supplier and item
             supplier = self.manual_supplier
@@ -60,6 +178,15 @@ class Invoice2ErpnextLog(Document):
             total_amount = invoice_details.get('total_amount', 0)
             total_tax = invoice_details.get('total_tax', 0)
             
+            # Don't create a second invoice for a bill that was already processed,
+            # checking in a new transaction that sees invoices committed meanwhile
+            lock_bill(self.batch_id, supplier, bill_no)
+            frappe.db.commit()
+            existing_invoice = find_duplicate_invoice(supplier, bill_no)
+            if existing_invoice:
+                self._mark_duplicate(existing_invoice, supplier, bill_no)
+                return False
+            
             # Calculate net amount
             net_amount = total_amount - total_tax if total_tax else total_amount
             
@@ -84,7 +211,7 @@ class Invoice2ErpnextLog(Document):
             
             # Add tax if available
             if total_tax:
-                vat_account = self._get_vat_account()
+                vat_account = self._get_vat_account(settings)
                 tax = purchase_invoice.append("taxes", {})
                 tax.charge_type = "Actual"
                 tax.account_head = vat_account
@@ -92,26 +219,35 @@ class Invoice2ErpnextLog(Document):
                 tax.tax_amount = total_tax
                 tax.included_in_print_rate = 0
             
-            # Save the document
-            purchase_invoice.insert(ignore_permissions=True)
-            
-            # Update the log and link the file
-            self._update_log_and_link_file(purchase_invoice.name)
+            # Save the document and link the file as one unit
+            with unit_of_work():
+                with stage_timer(self, "invoice_insert_time"):
+                    purchase_invoice.insert(ignore_permissions=True)
+                
+                # Update the log and link the file
+                self._update_log_and_link_file(purchase_invoice.name)
             
             return True
             
         except Exception as e:
-            frappe.log_error(f"Error in manual purchase invoice creation: {str(e)}")
+            log_error_throttled(f"Error in manual purchase invoice creation: {str(e)}", "manual_mode")
             self.status = "Error"
             self.message = f"Manual mode error: {str(e)}"
             self.save()
             return False
     
-    def create_purchase_invoice_auto(self):
-        """Create purchase invoice using fully automatic extraction"""
+    def create_purchase_invoice_auto(self, settings=None):
+        """
+        Create purchase invoice using fully automatic extraction
+        
+        Commits the current transaction before checking for a duplicate bill, as
+        create_purchase_invoice_manual does. The master data and the invoice are
+        then created in a unit of work.
+        """
+        settings = settings or get_settings_snapshot()
         try:
             # Check if the message field contains a valid JSON string
-            response_data = json.loads(self.response)
+            response_data = self.get_response_data()
             
             # Validate response structure
             if not isinstance(response_data, dict) or "message" not in response_data:
@@ -130,11 +266,12 @@ class Invoice2ErpnextLog(Document):
             
             self.cost = message["cost"]
 
-            if not isinstance(message, dict) or "extracted_doc" not in message:
+            invoice = self.get_extracted_invoice()
+            if invoice is None:
                 frappe.throw("Invalid message structure in extracted_doc field.")
                 
-            extracted_doc = json.loads(message["extracted_doc"])
-            result = self._transform_extracted_doc_auto(extracted_doc)
+            with stage_timer(self, "transform_time"):
+                result = self._transform_extracted_doc_auto(invoice, settings)
             
             if not result.get("success"):
                 frappe.throw("Transformation failed.")
@@ -143,51 +280,25 @@ class Invoice2ErpnextLog(Document):
             if not erpnext_docs:
                 frappe.throw("No documents to create.")
             
-            # Create each document in ERPNext
-            new_doc = None
+            # Don't create a second invoice (or its master data) for a bill that was already processed,
+            # checking in a new transaction that sees invoices committed meanwhile
             for doc in erpnext_docs:
-                doc_type = doc.get("doctype")
-                if doc_type:
-                    # Check if Supplier or Item already exists
-                    if doc_type == "Supplier" and frappe.db.exists("Supplier", doc.get("supplier_name")):
-                        continue  # Skip creation as supplier already exists
-                    elif doc_type == "Item" and frappe.db.exists("Item", doc.get("item_code")):
-                        continue  # Skip creation as item already exists
-
-                    # Create the document in ERPNext
-                    new_doc = frappe.new_doc(doc_type)
-                    for field, value in doc.items():
-                        if field != "doctype":
-                            new_doc.set(field, value)
-                    # Save the document
-                    new_doc.insert(ignore_permissions=True)
-            
-            # Update the log with the created document names
-            if new_doc:
-                created_docs = []
-                created_purchase_invoices = []
-                for doc in erpnext_docs:
-                    doc_type = doc.get("doctype")
-                    if doc_type == "Purchase Invoice":
-                        # Get the name of the created Purchase Invoice
-                        invoice_name = new_doc.name
-                        created_docs.append(doc.get("title"))
-                        created_purchase_invoices.append(invoice_name)
-            
-                if created_docs:
-                    self.created_docs = ", ".join(created_docs)
-                
-                # Modify the original file to link it to the Purchase Invoice
-                if created_purchase_invoices and self.file:
-                    try:
-                        file_doc = frappe.get_doc("File", self.file)
-                        if file_doc:
-                            # Update the file to be attached to the Purchase Invoice
-                            file_doc.attached_to_doctype = "Purchase Invoice"
-                            file_doc.attached_to_name = created_purchase_invoices[0]  # Attach to the first invoice
-                            file_doc.save(ignore_permissions=True)
-                    except Exception as e:
-                        frappe.log_error(f"Error attaching file to Purchase Invoice: {str(e)}")
+                if doc.get("doctype") == "Purchase Invoice":
+                    lock_bill(self.batch_id, doc.get("supplier"), doc.get("bill_no"))
+                    frappe.db.commit()
+                    existing_invoice = find_duplicate_invoice(doc.get("supplier"), doc.get("bill_no"))
+                    if existing_invoice:
+                        self._mark_duplicate(existing_invoice, doc.get("supplier"), doc.get("bill_no"))
+                        return False
+            
+            # Resolve all existing Suppliers and Items up front, sharing what is known within a batch
+            with stage_timer(self, "master_data_time"):
+                existing = get_existing_master_data(erpnext_docs, _batch_master_data.get(self.batch_id))
+            
+            # Create the master data and the invoice as one unit, so a failure leaves no orphaned Suppliers or Items
+            with unit_of_work():
+                new_doc = self._create_erpnext_docs(erpnext_docs, existing)
+                self._link_created_invoice(erpnext_docs, new_doc)
 
             # Update the status to "Completed"
             self.status = "Success"
@@ -195,138 +306,206 @@ class Invoice2ErpnextLog(Document):
             return True
             
         except Exception as e:
-            frappe.log_error(f"Error in automatic purchase invoice creation: {str(e)}")
+            log_error_throttled(f"Error in automatic purchase invoice creation: {str(e)}", "auto_mode")
             self.status = "Error"
             self.message = f"Auto mode error: {str(e)}"
             self.save()
             return False
 
-    def _transform_extracted_doc_auto(self, extracted_doc: Dict[str, Any]) -> Dict[str, Any]:
-        """Full transformation of extracted document for automatic mode"""
-        # Define constants
-        ROUNDING_TOLERANCE = 0.05
+    def _create_erpnext_docs(self, erpnext_docs, existing):
+        """
+        Insert the documents of a transformation that don't exist yet
         
-        # Initialize result structure
-        result = {
-            "success": True,
-            "erpnext_docs": []
-        }
+        New Items are inserted before the Purchase Invoice that links them.
         
-        try:
-            # Document quality score tracking
-            document_score = 0
-            
-            # Extract basic invoice information
-            bill_no, document_score = self._extract_bill_number(extracted_doc, document_score)
-            
-            # Get vendor information
-            vendor_info = self._extract_vendor_info(extracted_doc, document_score)
-            document_score = vendor_info.get('document_score', document_score)
-            vendor_name = vendor_info.get('vendor_name', '')
-            
-            if not vendor_name:
-                frappe.throw("Vendor name not found in extracted document")
-            
-            # 1. Create Supplier document
-            supplier_doc = self._create_supplier_doc(vendor_info)
-            result["erpnext_docs"].append(supplier_doc)
-            
-            # 2. Process items
-            items_result = self._process_items(extracted_doc, bill_no, document_score)
-            document_score = items_result.get('document_score', document_score)
-            invoice_items = items_result.get('invoice_items', [])
-            result["erpnext_docs"].extend(items_result.get('item_docs', []))
-            
-            # 3. Extract date and currency
-            date_currency = self._extract_date_currency(extracted_doc, bill_no, document_score)
-            document_score = date_currency.get('document_score', document_score)
-            invoice_date = date_currency.get('invoice_date', '')
-            currency = date_currency.get('currency', 'EUR')
-            
-            # 4. Extract payment terms
-            payment_terms = extracted_doc.get("PaymentTerm", {}).get("valueString", "")
-            
-            # 5. Create Purchase Invoice structure
-            purchase_invoice = {
-                "doctype": "Purchase Invoice",
-                "title": vendor_name,
-                "supplier": vendor_name,
-                "bill_no": bill_no,
-                "bill_date": invoice_date,
-                "posting_date": invoice_date,
-                "currency": currency,
-                "conversion_rate": 1,
-                "set_posting_time": 1,
-                "items": invoice_items,
-                "payment_terms_template": payment_terms if frappe.db.exists("Payment Terms Template", payment_terms) else "",
-            }
+        Args:
+            erpnext_docs: Document structures produced by the transformation
+            existing: doctype -> set of lowercased names that already exist
+            
+        Returns:
+            Document: The last document inserted, the Purchase Invoice
+        """
+        # Names created for this invoice only; later invoices find them through the IN query of get_existing_master_data
+        created = {doctype: set() for doctype in MASTER_DATA_KEY_FIELDS}
+        new_items = []
+        new_doc = None
+        
+        for doc in erpnext_docs:
+            doc_type = doc.get("doctype")
+            if not doc_type:
+                continue
             
-            # 6. Process amounts and adjust items if needed
-            amounts_result = self._process_amounts(extracted_doc, invoice_items, bill_no)
-            purchase_invoice["discount_amount"] = amounts_result.get('total_discount', 0)
+            # Check if Supplier or Item already exists
+            key_field = MASTER_DATA_KEY_FIELDS.get(doc_type)
+            if key_field:
+                name = (doc.get(key_field) or "").lower()
+                if name in existing[doc_type] or name in created[doc_type]:
+                    continue  # Skip creation as supplier or item already exists
+                created[doc_type].add(name)
             
-            # Make sure to update the purchase_invoice with the final invoice_items list
-            purchase_invoice["items"] = amounts_result.get('adjusted_items', invoice_items)
+            if doc_type == "Item":
+                new_items.append(doc)
+                continue
+            
+            if doc_type == "Purchase Invoice" and new_items:
+                with stage_timer(self, "master_data_time"):
+                    insert_new_items(new_items)
+                new_items = []
+            
+            # Create the document in ERPNext
+            timing_field = "invoice_insert_time" if doc_type == "Purchase Invoice" else "master_data_time"
+            with stage_timer(self, timing_field):
+                new_doc = frappe.new_doc(doc_type)
+                for field, value in doc.items():
+                    if field != "doctype":
+                        new_doc.set(field, value)
+                # Save the document
+                new_doc.insert(ignore_permissions=True)
+        
+        if new_items:
+            with stage_timer(self, "master_data_time"):
+                insert_new_items(new_items)
+        
+        return new_doc
 
-            # 7. Add taxes
-            total_tax = amounts_result.get('total_tax', 0)
-            if total_tax:
-                vat_account = self._get_vat_account()
-                purchase_invoice["taxes"] = [{
-                    "charge_type": "Actual",
-                    "account_head": vat_account,
-                    "description": "VAT",
-                    "tax_amount": total_tax,
-                    "included_in_print_rate": 0  # Tax is NOT included (since we extracted it)
-                }]
-            
-            result["erpnext_docs"].append(purchase_invoice)
-            
-            # Log document quality score
-            if document_score < 80:
-                frappe.log_error(f"Low-quality document extraction (score: {document_score}/100) for invoice {bill_no}")
-            
-            return result
+    def _link_created_invoice(self, erpnext_docs, new_doc):
+        """Record the created Purchase Invoice on the log and attach the file to it"""
+        # Update the log with the created document names
+        if new_doc:
+            created_docs = []
+            created_purchase_invoices = []
+            for doc in erpnext_docs:
+                doc_type = doc.get("doctype")
+                if doc_type == "Purchase Invoice":
+                    # Get the name of the created Purchase Invoice
+                    invoice_name = new_doc.name
+                    created_docs.append(doc.get("title"))
+                    created_purchase_invoices.append(invoice_name)
         
-        except Exception as e:
-            frappe.log_error(f"Error transforming extracted document: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            if created_docs:
+                self.created_docs = ", ".join(created_docs)
+            
+            # Modify the original file to link it to the Purchase Invoice
+            if created_purchase_invoices and self.file:
+                with stage_timer(self, "file_link_time"):
+                    try:
+                        file_doc = frappe.get_doc("File", self.file)
+                        if file_doc:
+                            # Update the file to be attached to the Purchase Invoice
+                            file_doc.attached_to_doctype = "Purchase Invoice"
+                            file_doc.attached_to_name = created_purchase_invoices[0]  # Attach to the first invoice
+                            file_doc.save(ignore_permissions=True)
+                    except Exception as e:
+                        log_error_throttled(f"Error attaching file to Purchase Invoice: {str(e)}", "file_link")
+
+    def _transform_extracted_doc_auto(self, invoice: ExtractedInvoice, settings) -> Dict[str, Any]:
+        """Full transformation of extracted document for automatic mode"""
+        return transform.transform_invoice(invoice, settings, FrappeLookups(self))
 
     # ======= Helper Methods for Both Auto and Manual Modes =======
+    
+    def set_response_data(self, response_data, extracted_doc_gz=None):
+        """
+        Store an extraction response on the log, keeping its parsed form
+        
+        The extracted document is taken out of the response and stored once,
+        compressed, in extracted_doc_gz. The parsed response and document are
+        kept on the instance so the rest of the pipeline doesn't parse them again.
+        
+        Args:
+            response_data: Parsed API response
+            extracted_doc_gz: Already compressed extracted document, used when
+                the response no longer carries it (e.g. a reused extraction)
+        """
+        extracted_doc = None
+        message = response_data.get("message", {})
+        if isinstance(message, dict) and message.get("extracted_doc"):
+            extracted_doc_text = message.pop("extracted_doc")
+            extracted_doc = json.loads(extracted_doc_text)
+            extracted_doc_gz = compress_text(extracted_doc_text)
+        
+        self.extracted_doc_gz = extracted_doc_gz
+        self.response = json.dumps(response_data)
+        
+        self._parsed_response = (self.response, response_data)
+        if extracted_doc is not None:
+            self._parsed_extracted_doc = (self.extracted_doc_gz, extracted_doc)
+    
+    def get_response_data(self):
+        """Get the parsed response, parsing the stored JSON only once per value"""
+        parsed = getattr(self, "_parsed_response", None)
+        if not parsed or parsed[0] is not self.response:
+            parsed = (self.response, json.loads(self.response))
+            self._parsed_response = parsed
+        return parsed[1]
+    
+    def get_extracted_doc(self):
+        """
+        Decode the extracted document of the log on demand
+        
+        The document is stored gzip-compressed in extracted_doc_gz. Logs that were
+        not migrated yet still carry it as a JSON string inside the response.
+        The decoded document is cached until the stored value changes.
+        
+        Returns:
+            dict: The extracted document, or None if the log has none
+        """
+        parsed = getattr(self, "_parsed_extracted_doc", None)
+        if parsed and parsed[0] is self.extracted_doc_gz and self.extracted_doc_gz:
+            return parsed[1]
+        
+        extracted_doc = None
+        if self.extracted_doc_gz:
+            extracted_doc = json.loads(decompress_text(self.extracted_doc_gz))
+        elif self.response:
+            message = self.get_response_data().get("message", {})
+            if isinstance(message, dict) and message.get("extracted_doc"):
+                extracted_doc = json.loads(message["extracted_doc"])
+        
+        self._parsed_extracted_doc = (self.extracted_doc_gz, extracted_doc)
+        return extracted_doc
+    
+    def get_extracted_invoice(self):
+        """
+        Get the extracted document parsed into the typed ExtractedInvoice model
+        
+        Returns:
+            ExtractedInvoice: The parsed invoice, or None if the log has no extracted document
+        """
+        with stage_timer(self, "parse_time"):
+            extracted_doc = self.get_extracted_doc()
+            if extracted_doc is None:
+                return None
+            
+            parsed = getattr(self, "_parsed_invoice", None)
+            if not parsed or parsed[0] is not extracted_doc:
+                parsed = (extracted_doc, ExtractedInvoice.parse(extracted_doc))
+                self._parsed_invoice = parsed
+            return parsed[1]
             
     def _extract_invoice_details(self) -> Dict[str, Any]:
         """Extract basic invoice details from API response for manual mode"""
         try:
-            response_data = json.loads(self.response)
-            message = response_data.get("message", {})
-            
-            if not isinstance(message, dict) or not message.get("extracted_doc"):
+            invoice = self.get_extracted_invoice()
+            if invoice is None:
                 return {}
-                
-            extracted_doc = json.loads(message.get("extracted_doc"))
             
             # Extract bill number
-            bill_no = extracted_doc.get("InvoiceId", {}).get("valueString", "")
+            bill_no = invoice.invoice_id
             
             # Extract date
-            invoice_date_str = extracted_doc.get("InvoiceDate", {}).get("valueDate", "")
-            invoice_date = validate_and_fix_date(invoice_date_str, bill_no) if invoice_date_str else frappe.utils.today()
+            invoice_date = validate_and_fix_date(invoice.invoice_date, bill_no, self, invoice.vendor_name) if invoice.invoice_date else frappe.utils.today()
             
             # Extract currency
-            currency = extracted_doc.get("InvoiceTotal", {}).get("valueCurrency", {}).get("currencyCode", "EUR")
+            currency = invoice.currency
             
             # Extract amount fields
-            total_amount = self._round_amount(extracted_doc.get("InvoiceTotal", {}).get("valueCurrency", {}).get("amount", 0))
-            total_tax = self._round_amount(extracted_doc.get("TotalTax", {}).get("valueCurrency", {}).get("amount", 0))
+            total_amount = invoice.invoice_total.amount
+            total_tax = invoice.total_tax.amount
             
             # If no total amount found, try calculating from subtotal and tax
             if not total_amount:
-                subtotal = self._round_amount(extracted_doc.get("SubTotal", {}).get("valueCurrency", {}).get("amount", 0))
-                total_discount = self._round_amount(extracted_doc.get("TotalDiscount", {}).get("valueCurrency", {}).get("amount", 0))
-                total_amount = subtotal + total_tax - total_discount
+                total_amount = invoice.subtotal.amount + total_tax - invoice.total_discount.amount
                 
             return {
                 'bill_no': bill_no,
@@ -336,365 +515,16 @@ class Invoice2ErpnextLog(Document):
                 'total_tax': total_tax
             }
         except Exception as e:
-            frappe.log_error(f"Error extracting invoice details: {str(e)}")
+            log_error_throttled(f"Error extracting invoice details: {str(e)}", "invoice_details")
             return {}
             
-    def _extract_bill_number(self, extracted_doc, document_score):
-        """Extract bill number from document"""
-        bill_no = extracted_doc.get("InvoiceId", {}).get("valueString", "")
-        if bill_no:
-            document_score += 20
-        return bill_no, document_score
-            
-    def _extract_vendor_info(self, extracted_doc, document_score):
-        """Extract vendor information from document"""
-        vendor_name = extracted_doc.get("VendorName", {}).get("valueString", "").replace("\n", " ").strip()
-        if vendor_name:
-            document_score += 20
-            
-        vendor_address = extracted_doc.get("VendorAddress", {}).get("valueAddress", {})
-        vendor_tax_id = extracted_doc.get("VendorTaxId", {}).get("valueString", "")
-        
-        return {
-            'vendor_name': vendor_name,
-            'vendor_address': vendor_address,
-            'vendor_tax_id': vendor_tax_id,
-            'document_score': document_score
-        }
-        
-    def _create_supplier_doc(self, vendor_info):
-        """Create supplier document structure"""
-        # Get supplier group from settings
-        try:
-            settings = frappe.get_doc("Invoice2Erpnext Settings")
-            supplier_group = settings.supplier_group or "All Supplier Groups"
-        except Exception as e:
-            frappe.log_error(f"Error fetching settings: {str(e)}")
-            supplier_group = "All Supplier Groups"  # Fallback to default
-            
-        vendor_name = vendor_info.get('vendor_name', '')
-        vendor_address = vendor_info.get('vendor_address', {})
-        vendor_tax_id = vendor_info.get('vendor_tax_id', '')
-        
-        return {
-            "doctype": "Supplier",
-            "supplier_name": vendor_name,
-            "supplier_group": supplier_group,
-            "supplier_type": "Company",  # Default value
-            "country": vendor_address.get("countryRegion", "Cyprus"),
-            "address_line1": vendor_address.get("streetAddress", ""),
-            "city": vendor_address.get("city", "Larnaka"),
-            "pincode": vendor_address.get("postalCode", ""),
-            "tax_id": vendor_tax_id
-        }
-        
-    def _extract_date_currency(self, extracted_doc, bill_no, document_score):
-        """Extract date and currency information"""
-        invoice_date = extracted_doc.get("InvoiceDate", {}).get("valueDate", "")
-        invoice_date = validate_and_fix_date(invoice_date, bill_no)
-        if invoice_date:
-            document_score += 20
-            
-        currency = extracted_doc.get("InvoiceTotal", {}).get("valueCurrency", {}).get("currencyCode", "EUR")
-        
-        return {
-            'invoice_date': invoice_date,
-            'currency': currency,
-            'document_score': document_score
-        }
-        
-    def _process_items(self, extracted_doc, bill_no, document_score):
-        """Process items from extracted document"""
-        # Get settings
-        try:
-            settings = frappe.get_doc("Invoice2Erpnext Settings")
-            one_item_invoice = settings.one_item_invoice or 0
-            settings_item = settings.item if one_item_invoice else None
-            item_group = settings.item_group or "All Item Groups"
-        except Exception as e:
-            frappe.log_error(f"Error fetching settings: {str(e)}")
-            one_item_invoice = 0
-            settings_item = None
-            item_group = "All Item Groups"
-            
-        items = extracted_doc.get("Items", {}).get("valueArray", [])
-        if items:
-            document_score += 20
-            
-        invoice_items = []
-        item_docs = []
-        
-        # Check for currency consistency among items
-        invoice_currency = extracted_doc.get("InvoiceTotal", {}).get("valueCurrency", {}).get("currencyCode", "EUR")
-        item_currencies = set()
-        for item in items:
-            item_currency = item.get("valueObject", {}).get("Amount", {}).get("valueCurrency", {}).get("currencyCode")
-            if item_currency:
-                item_currencies.add(item_currency)
-        
-        if item_currencies and any(curr != invoice_currency for curr in item_currencies):
-            frappe.log_error(f"Currency mismatch: Invoice is {invoice_currency} but items have {item_currencies} in invoice {bill_no}")
-        
-        # Process items based on the one_item_invoice setting
-        if one_item_invoice and settings_item and frappe.db.exists("Item", settings_item):
-            # Single item mode
-            result = self._process_single_item(items, settings_item, bill_no)
-            invoice_items = result.get('invoice_items', [])
-        else:
-            # Multi-item mode
-            result = self._process_multiple_items(items, item_group)
-            invoice_items = result.get('invoice_items', [])
-            item_docs = result.get('item_docs', [])
-            
-        return {
-            'invoice_items': invoice_items,
-            'item_docs': item_docs,
-            'document_score': document_score
-        }
-        
-    def _process_single_item(self, items, settings_item, bill_no):
-        """Process all items as a single combined item"""
-        # Calculate the total amount for all items
-        total_amount = 0
-        combined_description = []
-        
-        # Process each item to calculate totals but don't create separate items
-        for idx, item in enumerate(items):
-            item_data = item.get("valueObject", {})
-            description = item_data.get("Description", {}).get("valueString", "")
-            if description:
-                combined_description.append(f"{idx+1}. {description}")
-            
-            amount = self._round_amount(item_data.get("Amount", {}).get("valueCurrency", {}).get("amount", 0))
-            total_amount += amount
-        
-        # Create a single invoice item with quantity=1 and rate=total_amount
-        invoice_item = {
-            "item_code": settings_item,
-            "qty": 1,  # Always use quantity of 1 for one_item_invoice
-            "rate": total_amount,  # Rate equals total amount since qty=1
-            "amount": total_amount,
-            "description": "\n".join(combined_description) if combined_description else f"Combined invoice items for {bill_no}",
-            "uom": "Nos"
-        }
-        
-        return {
-            'invoice_items': [invoice_item]
-        }
-        
-    def _process_multiple_items(self, items, item_group):
-        """Process multiple items individually"""
-        invoice_items = []
-        item_docs = []
-        
-        for idx, item in enumerate(items):
-            item_data = item.get("valueObject", {})
-            description = item_data.get("Description", {}).get("valueString", "")
-            
-            # Get product code if available, otherwise generate one
-            product_code = item_data.get("ProductCode", {}).get("valueString", "")
-            if product_code:
-                item_code = f"{product_code}"
-            else:
-                # Generate item code based on description with hash for uniqueness
-                import hashlib
-                desc_hash = hashlib.md5(description.encode()).hexdigest()[:8] if description else ""
-                item_code = f"I2E-{desc_hash}"
-            
-            # Get item details with standardized precision
-            amount = self._round_amount(item_data.get("Amount", {}).get("valueCurrency", {}).get("amount", 0))
-            unit_price = self._round_amount(item_data.get("UnitPrice", {}).get("valueCurrency", {}).get("amount", 0))
-            quantity = item_data.get("Quantity", {}).get("valueNumber", 1) or 1  # Ensure quantity is never zero
-            
-            # Create Item document
-            item_doc = {
-                "doctype": "Item",
-                "item_code": item_code,
-                "item_name": description.split("\n")[0][:140] if description else f"Item {idx+1}",
-                "description": description,
-                "item_group": item_group,
-                "stock_uom": "Nos",
-                "is_stock_item": 0,  # Assuming service item
-                "is_purchase_item": 1
-            }
-            item_docs.append(item_doc)
-            
-            # Handle negative amounts (credits/refunds)
-            is_credit = amount < 0
-            
-            # Create invoice item
-            invoice_item = self._create_invoice_item(item_code, quantity, unit_price, amount, description, is_credit)
-            invoice_items.append(invoice_item)
-            
-        return {
-            'invoice_items': invoice_items,
-            'item_docs': item_docs
-        }
-        
-    def _create_invoice_item(self, item_code, quantity, unit_price, amount, description, is_credit):
-        """Create an invoice item based on extracted data"""
-        ROUNDING_TOLERANCE = 0.05
-        
-        if unit_price and quantity and amount:
-            calculated_amount = self._round_amount(unit_price * quantity)
-            
-            # Handle both discount and markup scenarios
-            if abs(calculated_amount - amount) > ROUNDING_TOLERANCE:
-                # Use the final amount to determine the effective rate
-                return {
-                    "item_code": item_code,
-                    "qty": abs(quantity),  # Always positive quantity
-                    "rate": amount / quantity if quantity else amount,  # Add division by zero protection
-                    "amount": amount,
-                    "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
-                    "uom": "Nos"
-                }
-            else:
-                # No discount/markup - use unit price as is
-                return {
-                    "item_code": item_code,
-                    "qty": abs(quantity),  # Always positive quantity
-                    "rate": unit_price * (-1 if is_credit else 1),
-                    "amount": amount,
-                    "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
-                    "uom": "Nos"
-                }
-        elif unit_price and quantity:
-            # We have unit price and quantity but no amount
-            calculated_amount = self._round_amount(unit_price * quantity)
-            return {
-                "item_code": item_code,
-                "qty": abs(quantity),
-                "rate": unit_price * (-1 if is_credit else 1),
-                "amount": calculated_amount * (-1 if is_credit else 1),
-                "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
-                "uom": "Nos"
-            }
-        elif amount:
-            # We only have the amount
-            return {
-                "item_code": item_code,
-                "qty": abs(quantity),
-                "rate": amount / quantity if quantity else amount,  # Add division by zero protection
-                "amount": amount,
-                "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
-                "uom": "Nos"
-            }
-        else:
-            # Fallback if no pricing details at all
-            return {
-                "item_code": item_code,
-                "qty": abs(quantity),
-                "rate": 0,
-                "amount": 0,
-                "description": description,
-                "uom": "Nos"
-            }
-        
-    def _process_amounts(self, extracted_doc, invoice_items, bill_no):
+    def _process_amounts(self, invoice, invoice_items, bill_no):
         """Process and reconcile amount fields"""
-        ROUNDING_TOLERANCE = 0.05
-        
-        # Extract amount fields with confidence scores
-        subtotal = self._round_amount(extracted_doc.get("SubTotal", {}).get("valueCurrency", {}).get("amount", 0))
-        subtotal_confidence = extracted_doc.get("SubTotal", {}).get("confidence", 0)
-
-        invoice_total = self._round_amount(extracted_doc.get("InvoiceTotal", {}).get("valueCurrency", {}).get("amount", 0))
-        invoice_total_confidence = extracted_doc.get("InvoiceTotal", {}).get("confidence", 0)
-
-        total_tax = self._round_amount(extracted_doc.get("TotalTax", {}).get("valueCurrency", {}).get("amount", 0))
-        total_tax_confidence = extracted_doc.get("TotalTax", {}).get("confidence", 0)
-
-        total_discount = self._round_amount(extracted_doc.get("TotalDiscount", {}).get("valueCurrency", {}).get("amount", 0))
-        total_discount_confidence = extracted_doc.get("TotalDiscount", {}).get("confidence", 0)
-
-        # Calculate expected invoice total and validate against extracted total
-        expected_total = self._round_amount(subtotal + total_tax - total_discount)
-        
-        # Reconcile inconsistencies in amount fields
-        if invoice_total > 0:
-            if abs(expected_total - invoice_total) > ROUNDING_TOLERANCE:
-                # Find the field with lowest confidence
-                confidences = {
-                    "invoice_total": invoice_total_confidence,
-                    "subtotal": subtotal_confidence,
-                    "total_tax": total_tax_confidence,
-                    "total_discount": total_discount_confidence
-                }
-                
-                lowest_confidence_field = min(confidences, key=confidences.get)
-                
-                # Calculate the field with lowest confidence using other values
-                if lowest_confidence_field == "invoice_total":
-                    invoice_total = expected_total
-                elif lowest_confidence_field == "subtotal":
-                    subtotal = self._round_amount(invoice_total - total_tax + total_discount)
-                elif lowest_confidence_field == "total_tax":
-                    total_tax = self._round_amount(invoice_total - subtotal + total_discount)
-                else:  # total_discount has lowest confidence
-                    total_discount = self._round_amount(subtotal + total_tax - invoice_total)
-        elif expected_total > 0:
-            # If no invoice total was extracted but we can calculate it
-            invoice_total = expected_total
-
-        # Adjust item prices if needed
-        calculated_line_total = self._round_amount(sum(item.get("qty", 0) * item.get("rate", 0) for item in invoice_items))
-        adjusted_items = invoice_items.copy()
-        
-        if subtotal > 0 and abs(calculated_line_total - subtotal) > ROUNDING_TOLERANCE:
-            adjusted_items = self._adjust_item_prices(invoice_items, subtotal, calculated_line_total, bill_no)
-                
-        return {
-            'subtotal': subtotal,
-            'invoice_total': invoice_total,
-            'total_tax': total_tax,
-            'total_discount': total_discount,
-            'adjusted_items': adjusted_items
-        }
+        return transform.process_amounts(invoice, invoice_items, bill_no)
         
     def _adjust_item_prices(self, invoice_items, subtotal, calculated_line_total, bill_no):
         """Adjust item prices to match the extracted subtotal"""
-        ROUNDING_TOLERANCE = 0.05
-        adjusted_items = invoice_items.copy()
-        
-        # Check if there's a huge disparity (likely decimal point issues)
-        if calculated_line_total > subtotal * 10:
-            # Simply divide by 100 for suspected decimal point issues
-            for item in adjusted_items:
-                item["rate"] = self._round_amount(item["rate"] / 100)
-                item["amount"] = self._round_amount(item["qty"] * item["rate"])
-            
-            # Recalculate the total
-            calculated_line_total = self._round_amount(sum(item.get("qty", 0) * item.get("rate", 0) for item in adjusted_items))
-        
-        # Apply proportional adjustment to any remaining discrepancy
-        if abs(calculated_line_total - subtotal) > ROUNDING_TOLERANCE and calculated_line_total != 0:
-            adjustment_factor = subtotal / calculated_line_total
-            
-            # Apply adjustment factor to ALL items' rates first
-            for item in adjusted_items:
-                original_rate = item.get("rate", 0)
-                adjusted_rate = self._round_amount(original_rate * adjustment_factor)
-                item["rate"] = adjusted_rate
-                item["amount"] = self._round_amount(adjusted_rate * item.get("qty", 1))
-            
-            # Check if we still have a discrepancy after adjustment
-            final_total = self._round_amount(sum(item.get("qty", 0) * item.get("rate", 0) for item in adjusted_items))
-            if abs(final_total - subtotal) > 0:
-                # Find the largest item to absorb the difference
-                largest_item_idx = max(range(len(adjusted_items)), 
-                                      key=lambda i: abs(adjusted_items[i].get("amount", 0)))
-                
-                # Adjust the amount directly for the largest item
-                final_total_difference = subtotal - final_total
-                largest_item = adjusted_items[largest_item_idx]
-                largest_item["amount"] = self._round_amount(largest_item["amount"] + final_total_difference)
-                
-                # Recalculate rate based on the adjusted amount
-                if largest_item.get("qty", 0):
-                    largest_item["rate"] = self._round_amount(largest_item["amount"] / largest_item["qty"])
-                
-        return adjusted_items
+        return transform.adjust_item_prices(invoice_items, subtotal, calculated_line_total, bill_no)
     
     def _update_log_and_link_file(self, invoice_name):
         """Update the log document and link the file to the invoice"""
@@ -702,71 +532,227 @@ class Invoice2ErpnextLog(Document):
         
         # Modify the original file to link it to the Purchase Invoice
         if self.file:
-            try:
-                file_doc = frappe.get_doc("File", self.file)
-                if file_doc:
-                    # Update the file to be attached to the Purchase Invoice
-                    file_doc.attached_to_doctype = "Purchase Invoice"
-                    file_doc.attached_to_name = invoice_name
-                    file_doc.save(ignore_permissions=True)
-            except Exception as e:
-                frappe.log_error(f"Error attaching file to Purchase Invoice: {str(e)}")
+            with stage_timer(self, "file_link_time"):
+                try:
+                    file_doc = frappe.get_doc("File", self.file)
+                    if file_doc:
+                        # Update the file to be attached to the Purchase Invoice
+                        file_doc.attached_to_doctype = "Purchase Invoice"
+                        file_doc.attached_to_name = invoice_name
+                        file_doc.save(ignore_permissions=True)
+                except Exception as e:
+                    log_error_throttled(f"Error attaching file to Purchase Invoice: {str(e)}", "file_link")
                 
         # Update the status to "Completed"
         self.status = "Success"
         self.save()
     
-    def _get_vat_account(self):
-        """Get VAT account from settings"""
-        try:
-            settings = frappe.get_doc("Invoice2Erpnext Settings")
-            vat_account = settings.vat_account or "VAT - TC"
-            return vat_account
-        except Exception as e:
-            frappe.log_error(f"Error fetching Invoice2Erpnext Settings: {str(e)}")
-            return "VAT - TC"  # Default fallback
+    def _mark_duplicate(self, invoice_name, supplier, bill_no):
+        """Link the log to an existing Purchase Invoice for the same bill instead of creating one"""
+        self.status = "Duplicate"
+        self.created_docs = invoice_name
+        self.message = f"Purchase Invoice {invoice_name} already exists for supplier {supplier} and bill no {bill_no}"
+        self.save()
     
-    def _round_amount(self, amount):
-        """Standardize decimal precision for monetary values"""
-        if amount is None:
-            return 0
-        try:
-            return round(float(amount), 2)
-        except (ValueError, TypeError):
-            return 0
+    def _get_vat_account(self, settings):
+        """Get VAT account from settings"""
+        return transform.get_vat_account(settings)
 
 @frappe.whitelist()
 def create_purchase_invoice_from_file(file_doc_name, mode='auto', supplier=None, item=None):
     """Create a Purchase Invoice from an existing File document"""
 
-    file_doc = frappe.get_doc("File", file_doc_name)
-    if not file_doc:
-        frappe.throw("File not found")
+    # Get settings for API connection
+    settings = get_settings_snapshot()
+    
+    if settings.background_processing:
+        # Hand the log over to a background worker and return immediately
+        doc = _insert_log(file_doc_name, mode, supplier, item, status="Queued")
+        enqueue_log(doc.name, settings)
+        return doc.name
+    
+    doc = _insert_log(file_doc_name, mode, supplier, item)
+    frappe.db.commit()
+    
+    process_log(doc, settings)
+    return doc.name
+
+@frappe.whitelist()
+def create_purchase_invoices_from_files(file_doc_names, mode='auto', supplier=None, item=None):
+    """
+    Process a batch of File documents and return the batch id
+    
+    With background processing enabled, the batch is enqueued; otherwise it is
+    processed during this request. Either way up to batch_concurrency files are
+    processed in parallel, and get_batch_progress reports on them.
+    """
+    file_doc_names = frappe.parse_json(file_doc_names)
+    if not file_doc_names:
+        frappe.throw("No files to process")
+    
+    settings = get_settings_snapshot()
+    
+    batch_id = frappe.generate_hash(length=10)
+    for file_doc_name in file_doc_names:
+        _insert_log(file_doc_name, mode, supplier, item, status="Queued", batch_id=batch_id)
+    
+    if not settings.background_processing:
+        # The batch threads read the logs over their own connections
+        frappe.db.commit()
+        process_batch(batch_id, settings)
+        return batch_id
+    
+    # Allow enough time for all files to go through the thread pool
+    concurrency = settings.batch_concurrency
+    rounds = -(-len(file_doc_names) // concurrency)
+    
+    frappe.enqueue(
+        process_batch,
+        queue=settings.background_queue,
+        timeout=max(1500, rounds * 300),
+        job_id=f"invoice2erpnext::batch::{batch_id}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        batch_id=batch_id
+    )
+    
+    return batch_id
+
+@frappe.whitelist()
+def get_batch_progress(batch_id):
+    """Return aggregate processing progress for a batch of logs"""
+    rows = frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters={"batch_id": batch_id},
+        fields=["status", "count(name) as count"],
+        group_by="status"
+    )
+    
+    statuses = {row.status: row.count for row in rows}
+    total = sum(statuses.values())
+    processed = sum(statuses.get(status, 0) for status in FINAL_STATUSES)
+    
+    return {
+        "batch_id": batch_id,
+        "total": total,
+        "processed": processed,
+        "statuses": statuses,
+        "done": total > 0 and processed == total
+    }
+
+def process_batch(batch_id, settings=None):
+    """Process all queued logs of a batch over a bounded thread pool, as a background job or in the request"""
+    log_names = frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters={"batch_id": batch_id, "status": "Queued"},
+        pluck="name",
+        order_by="creation asc"
+    )
+    if not log_names:
+        return
+    
+    # One settings snapshot is shared by all files of the batch
+    settings = settings or get_settings_snapshot()
+    
+    # Each thread needs its own site connection
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+    user = frappe.session.user
+    
+    _batch_master_data[batch_id] = {}
+    _batch_bill_locks[batch_id] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=min(settings.batch_concurrency, len(log_names))) as executor:
+            for log_name in log_names:
+                executor.submit(_process_log_in_thread, site, sites_path, user, log_name, settings)
+    finally:
+        _batch_master_data.pop(batch_id, None)
+        _batch_bill_locks.pop(batch_id, None)
+
+def _process_log_in_thread(site, sites_path, user, log_name, settings):
+    """Process a single queued log inside a worker thread with its own site connection"""
+    frappe.init(site=site, sites_path=sites_path)
+    try:
+        frappe.connect()
+        frappe.set_user(user)
+        process_queued_log(log_name, settings)
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        log_error_throttled(f"Error processing log {log_name} in batch: {str(e)}", "batch")
+        # The rollback also undid the status change, so record the failure for the batch to finish
+        frappe.db.set_value("Invoice2Erpnext Log", log_name, {
+            "status": "Error",
+            "message": f"Batch processing error: {str(e)}"
+        })
+        frappe.db.commit()
+    finally:
+        release_bill_locks()
+        frappe.destroy()
+
+def _insert_log(file_doc_name, mode='auto', supplier=None, item=None, status=None, batch_id=None):
+    """Insert a new Invoice2Erpnext Log for a File document"""
+    if not frappe.db.exists("File", file_doc_name):
+        frappe.throw(f"File {file_doc_name} not found")
     
     # Create new Invoice2Erpnext Log
     doc = frappe.new_doc("Invoice2Erpnext Log")
     doc.file = file_doc_name
+    doc.batch_id = batch_id
+    
+    # For manual mode, store the supplier and item selection
+    if mode == 'manual' and supplier and item:
+        doc.manual_mode = 1  # Flag to indicate manual processing
+        doc.manual_supplier = supplier
+        doc.manual_item = item
+    
+    if status == "Queued":
+        doc.status = "Queued"
+        doc.message = "Queued for background processing."
+    
     doc.insert()
+    return doc
+
+def enqueue_log(log_name, settings=None):
+    """Enqueue processing of a queued Invoice2Erpnext Log on the configured RQ queue"""
+    settings = settings or get_settings_snapshot()
+    
+    frappe.enqueue(
+        process_queued_log,
+        queue=settings.background_queue,
+        job_id=f"invoice2erpnext::{log_name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        log_name=log_name
+    )
+
+def process_queued_log(log_name, settings=None):
+    """Background job entry point for a queued Invoice2Erpnext Log"""
+    # Lock the log while claiming it, so a second worker picking it up waits for the claim and then skips it
+    doc = frappe.get_doc("Invoice2Erpnext Log", log_name, for_update=True)
+    
+    # Skip logs that were already picked up by another worker
+    if doc.status != "Queued":
+        return
+    
+    doc.status = "Pending"
+    doc.save()
+    # Release the lock before the file is uploaded
     frappe.db.commit()
+    
+    process_log(doc, settings)
 
-    # Get settings for API connection
-    settings = frappe.get_doc("Invoice2Erpnext Settings")
-    if not settings:
-        frappe.throw("Invoice2Erpnext Settings not found")
-    
-    # Get base URL, API key and API secret
-    base_url = settings.BASE_URL
-    api_key = settings.get('api_key')
-    api_secret = settings.get_password('api_secret')
-    
-    # Set up API headers with authentication
-    headers = {
-        "Authorization": f"token {api_key}:{api_secret}"
-    }
+def process_log(doc, settings=None):
+    """Upload the file of a log to the extraction API and create the Purchase Invoice"""
+    settings = settings or get_settings_snapshot()
+    started_at = time.perf_counter()
+    reset_timings(doc, TIMING_FIELDS)
+    doc.clear_diagnostics()
+    
+    file_doc = frappe.get_doc("File", doc.file)
     
     # Prepare the API endpoint
     endpoint = "/api/method/doc2sys.doc2sys.doctype.doc2sys_item.doc2sys_item.upload_and_create_item"
-    api_url = urljoin(base_url, endpoint)
 
     try:
         # Get the file from the filesystem
@@ -785,122 +771,282 @@ def create_purchase_invoice_from_file(file_doc_name, mode='auto', supplier=None,
         if not content_type:
             content_type = 'application/octet-stream'  # Default content type
         
-        # Open the file in binary mode and create the files object for multipart/form-data
-        with open(file_path, 'rb') as file_content:
-            files = {
-                'file': (file_name, file_content, content_type)
-            }
-            
-            # Prepare form data
-            form_data = {
-                "is_private": "1"
-            }
-            
-            # Make the API call with multipart/form-data
-            response = requests.post(
-                api_url,
-                headers=headers,
-                files=files,
-                data=form_data
-            )
+        # Reuse a previous extraction of identical content unless re-extraction is forced
+        doc.file_hash = get_file_hash(file_path)
+        reusable = None if settings.force_reextraction else find_reusable_extraction(doc.file_hash, doc.name)
         
-        # Check if the request was successful
-        if response.status_code == 200:
-            response_data = response.json()
-            doc.response = json.dumps(response_data)
-            
-            # Check if the response has a success message in the expected format
-            message = response_data.get("message", {})
-            if isinstance(message, dict) and message.get("success"):
-                doc.status = "Retrieved"
-                
-                # For manual mode, store the supplier and item selection
-                if mode == 'manual' and supplier and item:
-                    doc.message = "Manual selection mode - using specified supplier and item"
-                    doc.manual_mode = 1  # Flag to indicate manual processing
-                    doc.manual_supplier = supplier
-                    doc.manual_item = item
-                else:
-                    doc.message = "Response retrieved successfully."
+        if reusable:
+            log_name, response_data, extracted_doc_gz = reusable
+            doc.reused_from = log_name
+            _handle_response_data(doc, response_data, settings, extracted_doc_gz)
+        else:
+            # Refuse files above the configured size before reading them
+            max_file_size = settings.max_file_size * 1024 * 1024
+            file_size = os.path.getsize(file_path)
+            if max_file_size and file_size > max_file_size:
+                frappe.throw(f"File is {file_size / 1024 / 1024:.1f} MB, larger than the maximum of {settings.max_file_size} MB")
+            
+            # Stream the file from disk as multipart/form-data instead of buffering it in memory
+            with client.MultipartFileStream(file_path, file_name, content_type, fields={"is_private": "1"}) as body:
+                # Make the API call with multipart/form-data
+                request_started_at = time.perf_counter()
+                response = client.post(
+                    settings,
+                    endpoint,
+                    headers={"Content-Type": body.content_type},
+                    retry_status_codes=client.UPLOAD_RETRY_STATUS_CODES,
+                    data=body
+                )
                 
-                doc.save()
-                frappe.db.commit()
-                doc.reload()
-                doc.create_purchase_invoice()
+                # Split the request into sending the file and waiting for the extraction
+                request_time = time.perf_counter() - request_started_at
+                doc.upload_time = (body.finished_at - request_started_at) if body.finished_at else request_time
+                doc.remote_time = max(0, request_time - doc.upload_time)
+            
+            metrics.observe("invoice2erpnext_api_request_seconds", request_time)
+            metrics.inc("invoice2erpnext_api_requests_total", status_code=response.status_code)
+            metrics.inc("invoice2erpnext_api_retries_total", metrics.get_retries(response))
+            
+            # Check if the request was successful
+            if response.status_code == 200:
+                with stage_timer(doc, "parse_time"):
+                    response_data = response.json()
+                _handle_response_data(doc, response_data, settings)
             else:
-                # Handle error response with proper structure
-                error_msg = message.get("message") if isinstance(message, dict) else str(message)
                 doc.status = "Error"
-                doc.message = f"API Error: {error_msg}"
-                frappe.msgprint(f"Error: {error_msg}<br>See <a href='/app/invoice2erpnext-log/{doc.name}'>Log #{doc.name}</a> for details")
-        else:
-            doc.status = "Error"
-            doc.message = f"HTTP Error: {response.status_code} - {response.text}"
-            frappe.msgprint(f"Error: {response.status_code} - {response.text}<br>See <a href='/app/invoice2erpnext-log/{doc.name}'>Log #{doc.name}</a> for details")
+                doc.message = f"HTTP Error: {response.status_code} - {response.text}"
+                frappe.msgprint(f"Error: {response.status_code} - {response.text}<br>See <a href='/app/invoice2erpnext-log/{doc.name}'>Log #{doc.name}</a> for details")
     
     except Exception as e:
         doc.status = "Error"
         doc.message = f"Connection Error: {str(e)}"
         frappe.msgprint(f"Error: {str(e)}<br>See <a href='/app/invoice2erpnext-log/{doc.name}'>Log #{doc.name}</a> for details")
     
+    doc.total_time = time.perf_counter() - started_at
     doc.save()
-    return doc.name
+    
+    metrics.inc("invoice2erpnext_files_processed_total", status=doc.status)
+    metrics.observe("invoice2erpnext_processing_seconds", doc.total_time)
+
+def _handle_response_data(doc, response_data, settings, extracted_doc_gz=None):
+    """Store an extraction response on the log and create the Purchase Invoice on success"""
+    with stage_timer(doc, "parse_time"):
+        doc.set_response_data(response_data, extracted_doc_gz)
+    
+    # Check if the response has a success message in the expected format
+    message = response_data.get("message", {})
+    if isinstance(message, dict) and message.get("success"):
+        doc.status = "Retrieved"
+        
+        if doc.reused_from:
+            doc.message = f"Response reused from Log #{doc.reused_from}."
+        else:
+            # Keep the cached credits balance in step with what was charged
+            deduct_cached_credits(message.get("cost"))
+            metrics.inc("invoice2erpnext_credits_spent_total", flt(message.get("cost")))
+            
+            if doc.manual_mode:
+                doc.message = "Manual selection mode - using specified supplier and item"
+            else:
+                doc.message = "Response retrieved successfully."
+        
+        doc.save()
+        # Keep the paid extraction even if the request or job is killed while the invoice is created
+        frappe.db.commit()
+        doc.process_purchase_invoice(settings)
+    else:
+        # Handle error response with proper structure
+        error_msg = message.get("message") if isinstance(message, dict) else str(message)
+        doc.status = "Error"
+        doc.message = f"API Error: {error_msg}"
+        frappe.msgprint(f"Error: {error_msg}<br>See <a href='/app/invoice2erpnext-log/{doc.name}'>Log #{doc.name}</a> for details")
 
-def validate_and_fix_date(date_string, reference_id=""):
+@contextmanager
+def stage_timer(doc, fieldname):
+    """Add the seconds spent in the block to a timing field of the log"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        doc.set(fieldname, flt(doc.get(fieldname)) + time.perf_counter() - started_at)
+
+def reset_timings(doc, fieldnames):
+    """Clear timing fields before the stages they measure run again"""
+    for fieldname in fieldnames:
+        doc.set(fieldname, 0)
+
+@contextmanager
+def unit_of_work():
     """
-    Validates and fixes a date string to YYYY-MM-DD format.
-    If validation fails, returns today's date.
+    Run a block in a savepoint, undoing all of its writes if it raises
+    
+    Changes to the log made before the block are kept, so a failed invoice
+    leaves no master data behind but still records its error on the log.
+    """
+    frappe.db.savepoint(UNIT_OF_WORK_SAVEPOINT)
+    try:
+        yield
+    except Exception:
+        frappe.db.rollback(save_point=UNIT_OF_WORK_SAVEPOINT)
+        raise
+    frappe.db.release_savepoint(UNIT_OF_WORK_SAVEPOINT)
+
+def get_file_hash(file_path):
+    """Compute the SHA-256 of a file, reading it from disk in chunks"""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(client.UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def find_reusable_extraction(file_hash, exclude_log=None):
+    """
+    Find a previous successful extraction of a file with the same content
     
     Args:
-        date_string: The date string to validate/fix
-        reference_id: Optional reference ID for logging (e.g., invoice number)
+        file_hash: SHA-256 of the file content
+        exclude_log: Name of the log being processed
         
     Returns:
-        string: YYYY-MM-DD formatted date
+        tuple: (log name, response data with the cost set to 0, compressed extracted document), or None
     """
-    if not date_string:
-        frappe.log_error(f"Date missing in document {reference_id}, using today's date")
-        return frappe.utils.today()
+    logs = frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters={
+            "file_hash": file_hash,
+            "name": ["!=", exclude_log or ""],
+            "extracted_doc_gz": ["is", "set"]
+        },
+        fields=["name", "response"],
+        order_by="creation desc",
+        limit=5
+    )
     
-    # Check if it's already in expected YYYY-MM-DD format
-    if len(date_string.split('-')) == 3:
+    for log in logs:
         try:
-            # Verify it's actually a valid date
-            from datetime import datetime
-            datetime.strptime(date_string, '%Y-%m-%d')
-            return date_string
+            response_data = json.loads(log.response)
         except ValueError:
-            pass  # Fall through to the parsing logic below
-    
-    # Try to parse and fix common date formats
-    try:
-        from datetime import datetime
-        
-        # Try different date formats (day/month/year, month/day/year, etc.)
-        possible_formats = [
-            '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d',
-            '%d-%m-%Y', '%m-%d-%Y', '%Y-%m-%d',
-            '%d.%m.%Y', '%m.%d.%Y', '%Y.%m.%d',
-            '%d %b %Y', '%b %d %Y', '%d %B %Y', '%B %d %Y'
-        ]
+            continue
         
-        parsed_date = None
-        for date_format in possible_formats:
-            try:
-                parsed_date = datetime.strptime(date_string, date_format)
-                break
-            except ValueError:
-                continue
+        message = response_data.get("message") if isinstance(response_data, dict) else None
+        if isinstance(message, dict) and message.get("success"):
+            # Nothing is charged for a reused extraction
+            message["cost"] = 0
+            extracted_doc_gz = frappe.db.get_value("Invoice2Erpnext Log", log.name, "extracted_doc_gz")
+            return log.name, response_data, extracted_doc_gz
+    
+    return None
+
+def find_duplicate_invoice(supplier, bill_no):
+    """
+    Find a Purchase Invoice that was already created for the same supplier bill
+    
+    The lookup is served by the composite (supplier, bill_no) index added on install/migrate.
+    
+    Returns:
+        str: Name of the existing, not cancelled Purchase Invoice, or None
+    """
+    if not supplier or not bill_no:
+        return None
+    
+    return frappe.db.get_value(
+        "Purchase Invoice",
+        {"supplier": supplier, "bill_no": bill_no, "docstatus": ["<", 2]},
+        "name"
+    )
+
+def lock_bill(batch_id, supplier, bill_no):
+    """
+    Serialize the invoices of a batch for the same supplier bill
+    
+    find_duplicate_invoice only sees committed invoices, so two threads of a
+    batch processing the same bill would both pass it. The lock is held until
+    the thread has committed its log (release_bill_locks). Logs processed
+    outside a batch are not locked.
+    
+    The caller commits after taking the lock, before the duplicate check: under
+    REPEATABLE READ, only a new transaction sees an invoice committed while the
+    thread waited.
+    """
+    locks = _batch_bill_locks.get(batch_id)
+    if locks is None or not supplier or not bill_no:
+        return
+    
+    lock = locks.setdefault((supplier.lower(), bill_no.lower()), threading.Lock())
+    lock.acquire()
+    if not hasattr(_held_bill_locks, "locks"):
+        _held_bill_locks.locks = []
+    _held_bill_locks.locks.append(lock)
+
+def release_bill_locks():
+    """Release the bill locks the current thread took"""
+    locks = getattr(_held_bill_locks, "locks", [])
+    while locks:
+        locks.pop().release()
+
+def get_existing_master_data(erpnext_docs, known=None):
+    """
+    Resolve which Suppliers and Items of a transformation already exist
+    
+    Args:
+        erpnext_docs: Document structures produced by the transformation
+        known: Optional dict of doctype -> set of names already known to exist,
+            shared across the invoices of a batch and updated in place
+            
+    Returns:
+        dict: doctype -> set of lowercased existing names (names compare
+            case-insensitively, like the database)
+    """
+    known = {} if known is None else known
+    
+    for doctype, key_field in MASTER_DATA_KEY_FIELDS.items():
+        existing = known.setdefault(doctype, set())
+        names = {
+            doc.get(key_field) for doc in erpnext_docs
+            if doc.get("doctype") == doctype and doc.get(key_field)
+        }
         
-        if parsed_date:
-            # Convert to YYYY-MM-DD format
-            fixed_date = parsed_date.strftime('%Y-%m-%d')
-            frappe.log_error(f"Fixed invalid date format in document {reference_id}: {date_string} → {fixed_date}")
-            return fixed_date
+        # Only ask the database about names not already known, in a single IN query
+        unknown = [name for name in names if name.lower() not in existing]
+        if unknown:
+            found = frappe.get_all(doctype, filters={"name": ["in", unknown]}, pluck="name")
+            existing.update(name.lower() for name in found)
+    
+    return known
+
+def insert_new_items(item_docs):
+    """
+    Insert new Items, leaving alone those another batch thread inserted meanwhile
+    
+    Each Item goes through Item.insert, so its validation, its stock UOM
+    conversion row and the hooks other apps attach to it all run. An Item whose
+    code was inserted concurrently raises DuplicateEntryError; only that insert
+    is undone, to a savepoint, and the existing Item is linked instead.
+    
+    Args:
+        item_docs: Item structures produced by the transformation
+    """
+    for doc in item_docs:
+        frappe.db.savepoint(ITEM_INSERT_SAVEPOINT)
+        try:
+            frappe.get_doc(doc).insert(ignore_permissions=True)
+        except frappe.DuplicateEntryError:
+            frappe.db.rollback(save_point=ITEM_INSERT_SAVEPOINT)
         else:
-            # If we couldn't parse the date, use today's date as fallback
-            frappe.log_error(f"Couldn't parse date in document {reference_id}: {date_string}, using today's date instead")
-            return frappe.utils.today()
-    except Exception as e:
-        frappe.log_error(f"Error processing date in document {reference_id}: {str(e)}, using today's date")
-        return frappe.utils.today()
+            frappe.db.release_savepoint(ITEM_INSERT_SAVEPOINT)
+
+def validate_and_fix_date(date_string, reference_id="", log=None, supplier=None):
+    """
+    Validates and fixes a date string to YYYY-MM-DD format.
+    If validation fails, returns today's date.
+    
+    Args:
+        date_string: The date string to validate/fix
+        reference_id: Optional reference ID for logging (e.g., invoice number)
+        log: Invoice2Erpnext Log to record fixes on as diagnostics
+        supplier: Optional supplier name, to read ambiguous dates in its usual order
+        
+    Returns:
+        string: YYYY-MM-DD formatted date
+    """
+    return transform.validate_and_fix_date(date_string, reference_id, FrappeLookups(log), supplier)
@@ -1,9 +1,705 @@
 # Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
 # See license.txt
 
-# import frappe
+import json
+import os
+import threading
+import time
+from dataclasses import replace
+from datetime import datetime
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from invoice2erpnext import client, dates, reconcile, supplier_index, transform
+from invoice2erpnext.extraction import ExtractedInvoice
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log import invoice2erpnext_log
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log.invoice2erpnext_log import (
+	Invoice2ErpnextLog,
+	create_purchase_invoice_from_file,
+	create_purchase_invoices_from_files,
+	get_batch_progress,
+)
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_settings.invoice2erpnext_settings import (
+	SettingsSnapshot,
+)
+from invoice2erpnext.patches.v2_4 import compress_extracted_docs
+from invoice2erpnext.tests.fixtures import (
+	ITEM_COUNTS,
+	RECONCILIATION_CASES,
+	make_date_strings,
+	make_extracted_doc,
+)
+from invoice2erpnext.tests.mock_doc2sys import MockDoc2sysServer
+
+# Runs of the in-memory stages; the fastest one is reported
+REPEAT = 5
+
+# Set this environment variable to print the per-stage latency and query table after the benchmark
+BENCHMARK_REPORT_ENV = "INVOICE2ERPNEXT_BENCHMARK"
+
+# Item counts the full pipeline runs with, as it inserts real documents
+PIPELINE_ITEM_COUNTS = (1, 10, 100)
+
+# Formats validate_and_fix_date tried one after the other before dates.parse_date
+LEGACY_DATE_FORMATS = (
+	"%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d",
+	"%d-%m-%Y", "%m-%d-%Y", "%Y-%m-%d",
+	"%d.%m.%Y", "%m.%d.%Y", "%Y.%m.%d",
+	"%d %b %Y", "%b %d %Y", "%d %B %Y", "%B %d %Y",
+)
+
+
+def legacy_fix_date(date_string):
+	"""The strptime loop dates.parse_date replaced, as the benchmark baseline"""
+	for date_format in LEGACY_DATE_FORMATS:
+		try:
+			return datetime.strptime(date_string, date_format).strftime("%Y-%m-%d")
+		except ValueError:
+			continue
+	return None
+
+
+class QueryCounter:
+	"""Count the queries sent through frappe.db.sql while active"""
+
+	def __init__(self):
+		self.count = 0
+
+	def __enter__(self):
+		sql = frappe.db.sql
+
+		def counting_sql(*args, **kwargs):
+			self.count += 1
+			return sql(*args, **kwargs)
+
+		self._patch = patch.object(frappe.db, "sql", counting_sql)
+		self._patch.start()
+		return self
+
+	def __exit__(self, *args):
+		self._patch.stop()
+
+
+class PipelineTestCase(FrappeTestCase):
+	"""Helpers to run files through the pipeline against a local stand-in of the extraction API"""
+
+	def _start_mock_server(self):
+		"""
+		Start a local stand-in of the extraction API, returning it and settings that upload to it
+
+		The pipeline commits as it goes; for the rest of the test those commits are
+		skipped, and everything it writes is rolled back afterwards.
+		"""
+		companies = frappe.get_all("Company", pluck="name", limit=1) if "erpnext" in frappe.get_installed_apps() else []
+		if not companies:
+			self.skipTest("The full pipeline needs ERPNext with a company")
+
+		company = frappe.defaults.get_user_default("Company") or companies[0]
+		vat_account = frappe.db.get_value("Account", {"company": company, "account_type": "Tax", "is_group": 0})
+
+		server = MockDoc2sysServer(("127.0.0.1", 0))
+		settings = SettingsSnapshot(
+			enabled=1,
+			force_reextraction=1,
+			vat_account=vat_account or "",
+			base_url=server.start(),
+			api_key="benchmark",
+			api_secret="benchmark",
+		)
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		self._roll_back_writes()
+		return server, settings
+
+	def _roll_back_writes(self):
+		"""Skip commits until the end of the test, then roll back the Logs, Suppliers, Items and invoices written"""
+		commit = patch.object(frappe.db, "commit")
+		commit.start()
+		self.addCleanup(commit.stop)
+		# Suppliers inserted by the test were added to the index in Redis
+		self.addCleanup(supplier_index.clear_index)
+		self.addCleanup(frappe.db.rollback)
+
+	def _make_file(self, content=None):
+		"""Insert a private File with unique content, so each upload gets its own invoice"""
+		file_name = f"bench-{frappe.generate_hash(length=10)}.pdf"
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": file_name,
+			"content": content or f"%PDF-1.4 {file_name}".encode(),
+			"is_private": 1,
+		}).insert(ignore_permissions=True)
+		self.addCleanup(self._delete_file, file_doc)
+		return file_doc
+
+	def _delete_file(self, file_doc):
+		"""Delete a File and its content on disk, which a rollback leaves behind"""
+		path = file_doc.get_full_path()
+		if frappe.db.exists("File", file_doc.name):
+			frappe.delete_doc("File", file_doc.name, force=True, ignore_permissions=True)
+		if os.path.exists(path):
+			os.remove(path)
+
+
+class TestInvoice2ErpnextLogBenchmark(PipelineTestCase):
+	"""
+	Benchmarks of the extraction-to-invoice pipeline, reporting latency and query counts per stage
+
+	The report is printed when the class finishes if INVOICE2ERPNEXT_BENCHMARK is set.
+	"""
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.results = []
+		cls.settings = SettingsSnapshot(enabled=1, force_reextraction=1)
+
+	@classmethod
+	def tearDownClass(cls):
+		if os.environ.get(BENCHMARK_REPORT_ENV):
+			print("\nInvoice2Erpnext pipeline benchmark")
+			print(f"{'stage':<30}{'case':<18}{'items':>7}{'ms':>12}{'queries':>9}")
+			for result in cls.results:
+				print(
+					f"{result['stage']:<30}{result['case']:<18}{result['items']:>7}"
+					f"{result['seconds'] * 1000:>12.2f}{result['queries']:>9}"
+				)
+		super().tearDownClass()
+
+	def run_stage(self, stage, function, setup=None, case="consistent", items=0, repeat=REPEAT):
+		"""
+		Time a stage and count its queries, keeping the fastest of repeated runs
+
+		Args:
+			stage: Name of the stage in the report
+			function: Callable running the stage, given the return value of setup
+			setup: Optional callable preparing fresh arguments for each run, not timed
+			case: Reconciliation case for the report
+			items: Number of line items for the report
+			repeat: Number of runs
+
+		Returns:
+			dict: The report entry, with the stage's return value under "result"
+		"""
+		entry = {"stage": stage, "case": case, "items": items, "seconds": None, "queries": 0}
+		for _ in range(repeat):
+			args = setup() if setup else ()
+			with QueryCounter() as queries:
+				start = time.perf_counter()
+				entry["result"] = function(*args)
+				seconds = time.perf_counter() - start
+
+			entry["queries"] = max(entry["queries"], queries.count)
+			if entry["seconds"] is None or seconds < entry["seconds"]:
+				entry["seconds"] = seconds
+
+		self.results.append(entry)
+		return entry
+
+	def test_transform_extracted_doc_auto(self):
+		log = frappe.new_doc("Invoice2Erpnext Log")
+		queries = {}
+
+		for item_count in ITEM_COUNTS:
+			invoice = ExtractedInvoice.parse(make_extracted_doc(item_count))
+			entry = self.run_stage(
+				"_transform_extracted_doc_auto",
+				lambda: log._transform_extracted_doc_auto(invoice, self.settings),
+				items=item_count,
+			)
+
+			self.assertTrue(entry["result"]["success"])
+			purchase_invoice = entry["result"]["erpnext_docs"][-1]
+			self.assertEqual(len(purchase_invoice["items"]), item_count)
+			queries[item_count] = entry["queries"]
+
+		# Lookups don't depend on the number of items
+		self.assertLessEqual(max(queries.values()), 2)
+		self.assertEqual(queries[ITEM_COUNTS[0]], queries[ITEM_COUNTS[-1]])
+
+	def test_process_amounts(self):
+		log = frappe.new_doc("Invoice2Erpnext Log")
+
+		for case in RECONCILIATION_CASES:
+			for item_count in ITEM_COUNTS:
+				invoice = ExtractedInvoice.parse(make_extracted_doc(item_count, case))
+				invoice_items = self._get_invoice_items(invoice)
+
+				entry = self.run_stage(
+					"_process_amounts",
+					lambda items: log._process_amounts(invoice, items, invoice.invoice_id),
+					setup=lambda: ([dict(item) for item in invoice_items],),
+					case=case,
+					items=item_count,
+				)
+
+				amounts = entry["result"]
+				line_total = sum(item["amount"] for item in amounts["adjusted_items"])
+				self.assertAlmostEqual(line_total, amounts["subtotal"], delta=0.05)
+				self.assertEqual(entry["queries"], 0)
+
+	def test_adjust_item_prices(self):
+		log = frappe.new_doc("Invoice2Erpnext Log")
+
+		for case in ("subtotal_drift", "decimal_shift"):
+			for item_count in ITEM_COUNTS:
+				invoice = ExtractedInvoice.parse(make_extracted_doc(item_count, case))
+				invoice_items = self._get_invoice_items(invoice)
+				subtotal = invoice.subtotal.amount
+				line_total = round(sum(item["qty"] * item["rate"] for item in invoice_items), 2)
+
+				entry = self.run_stage(
+					"_adjust_item_prices",
+					lambda items: log._adjust_item_prices(items, subtotal, line_total, invoice.invoice_id),
+					setup=lambda: ([dict(item) for item in invoice_items],),
+					case=case,
+					items=item_count,
+				)
+
+				adjusted_total = sum(item["amount"] for item in entry["result"])
+				self.assertAlmostEqual(adjusted_total, subtotal, delta=0.05)
+				self.assertEqual(entry["queries"], 0)
+
+	def test_adjust_item_prices_array_path(self):
+		for case in ("subtotal_drift", "decimal_shift"):
+			invoice = ExtractedInvoice.parse(make_extracted_doc(ITEM_COUNTS[-1], case))
+			invoice_items = self._get_invoice_items(invoice)
+			subtotal = invoice.subtotal.amount
+			line_total = round(sum(item["qty"] * item["rate"] for item in invoice_items), 2)
+
+			with patch.object(reconcile, "ARRAY_MIN_ITEMS", len(invoice_items) + 1):
+				per_item = self.run_stage(
+					"adjust_item_prices (per item)",
+					lambda items: transform.adjust_item_prices(items, subtotal, line_total, invoice.invoice_id),
+					setup=lambda: ([dict(item) for item in invoice_items],),
+					case=case,
+					items=len(invoice_items),
+				)
+			entry = self.run_stage(
+				"adjust_item_prices (arrays)",
+				lambda items: transform.adjust_item_prices(items, subtotal, line_total, invoice.invoice_id),
+				setup=lambda: ([dict(item) for item in invoice_items],),
+				case=case,
+				items=len(invoice_items),
+			)
+
+			# Rates are what ERPNext multiplies out again on insert
+			invoiced_total = round(sum(item["qty"] * item["rate"] for item in entry["result"]), 2)
+			self.assertAlmostEqual(invoiced_total, subtotal, delta=0.05)
+			self.assertAlmostEqual(sum(item["amount"] for item in entry["result"]), subtotal, delta=0.005)
+			# Both paths round half to even and spread the residual the same way
+			self.assertEqual(entry["result"], per_item["result"])
+
+	def test_validate_and_fix_date(self):
+		date_strings = make_date_strings(1000)
+		lookups = transform.Lookups()
+
+		legacy = self.run_stage(
+			"strptime loop",
+			lambda: [legacy_fix_date(value) for value in date_strings],
+			case="dates",
+			items=len(date_strings),
+		)
+		cold = self.run_stage(
+			"validate_and_fix_date (cold)",
+			lambda: [transform.validate_and_fix_date(value, lookups=lookups) for value in date_strings],
+			setup=lambda: dates.parse_date.cache_clear() or (),
+			case="dates",
+			items=len(date_strings),
+		)
+		warm = self.run_stage(
+			"validate_and_fix_date (warm)",
+			lambda: [transform.validate_and_fix_date(value, lookups=lookups) for value in date_strings],
+			case="dates",
+			items=len(date_strings),
+		)
+
+		self.assertEqual(cold["result"], legacy["result"])
+		self.assertEqual(warm["result"], legacy["result"])
+
+	def test_create_purchase_invoice_auto(self):
+		server, settings = self._start_mock_server()
+
+		for item_count in PIPELINE_ITEM_COUNTS:
+			server.item_count = item_count
+			file_doc = self._make_file()
+
+			auto_stage = {}
+			create_auto = Invoice2ErpnextLog.create_purchase_invoice_auto
+
+			def timed_create_auto(log, *args, **kwargs):
+				with QueryCounter() as queries:
+					start = time.perf_counter()
+					result = create_auto(log, *args, **kwargs)
+					auto_stage.update(seconds=time.perf_counter() - start, queries=queries.count)
+				return result
+
+			with (
+				patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+				patch.object(Invoice2ErpnextLog, "create_purchase_invoice_auto", timed_create_auto),
+			):
+				entry = self.run_stage(
+					"create_purchase_invoice_from_file",
+					lambda: create_purchase_invoice_from_file(file_doc.name),
+					items=item_count,
+					repeat=1,
+				)
+
+			self.results.append({"stage": "create_purchase_invoice_auto", "case": "consistent", "items": item_count, **auto_stage})
+
+			log = frappe.get_doc("Invoice2Erpnext Log", entry["result"])
+			self.assertEqual(log.status, "Success", log.message)
+			invoice_name = frappe.db.get_value("File", file_doc.name, "attached_to_name")
+			self.assertTrue(invoice_name)
+			self.assertEqual(frappe.db.count("Purchase Invoice Item", {"parent": invoice_name}), item_count)
+
+	def _get_invoice_items(self, invoice):
+		"""Build the invoice rows of an extracted invoice as the transformation does before reconciling"""
+		return transform.process_multiple_items(invoice.items, "All Item Groups")["invoice_items"]
+
+
+class TestInvoice2ErpnextLog(PipelineTestCase):
+	"""Behavior of processing files into Purchase Invoices"""
+
+	def test_find_supplier(self):
+		supplier = frappe.get_doc({
+			"doctype": "Supplier",
+			"supplier_name": "I2E Index Test Ltd.",
+			"supplier_group": frappe.db.get_value("Supplier Group", {"is_group": 0}),
+			"tax_id": "CY99999999Z",
+		}).insert(ignore_permissions=True)
+		self.addCleanup(frappe.delete_doc, "Supplier", supplier.name, force=True)
+		supplier_index.clear_index()
+
+		lookups = invoice2erpnext_log.FrappeLookups()
+		settings = SettingsSnapshot(supplier_group="All Supplier Groups")
+
+		# Matched by name, then by tax ID under a different name
+		supplier_doc = transform.create_supplier_doc({"vendor_name": "I2E INDEX TEST LTD"}, settings, lookups)
+		self.assertEqual(supplier_doc["supplier_name"], supplier.name)
+		self.assertEqual(lookups.diagnostics[-1]["code"], "supplier_matched")
+
+		supplier_doc = transform.create_supplier_doc(
+			{"vendor_name": "Other", "vendor_tax_id": "cy 99999999 z"}, settings, lookups
+		)
+		self.assertEqual(supplier_doc["supplier_name"], supplier.name)
+
+		# Renamed suppliers are found under their new name once the index is current
+		supplier.supplier_name = "I2E Renamed Test"
+		supplier.save(ignore_permissions=True)
+		self.assertEqual(supplier_index.find_supplier(supplier_name="I2E Renamed Test"), supplier.name)
+		self.assertIsNone(supplier_index.find_supplier(supplier_name="I2E Index Test"))
+
+	def test_duplicate_invoice(self):
+		server, settings = self._start_mock_server()
+		# The extraction of the first upload is reused, so every upload of the file is the same bill
+		settings = replace(settings, force_reextraction=0)
+		file_doc = self._make_file()
+
+		with patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings):
+			log = frappe.get_doc("Invoice2Erpnext Log", create_purchase_invoice_from_file(file_doc.name))
+		self.assertEqual(log.status, "Success", log.message)
+
+		invoice = frappe.get_doc("Purchase Invoice", frappe.db.get_value("File", file_doc.name, "attached_to_name"))
+		uploads = {
+			"auto": {},
+			"manual": {"mode": "manual", "supplier": invoice.supplier, "item": invoice.items[0].item_code},
+		}
+		counts = {doctype: frappe.db.count(doctype) for doctype in ("Supplier", "Item", "Purchase Invoice")}
+
+		for mode, args in uploads.items():
+			with patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings):
+				log = frappe.get_doc("Invoice2Erpnext Log", create_purchase_invoice_from_file(file_doc.name, **args))
+
+			self.assertEqual(log.status, "Duplicate", f"{mode}: {log.message}")
+			self.assertEqual(log.created_docs, invoice.name)
+			for doctype, count in counts.items():
+				self.assertEqual(frappe.db.count(doctype), count, f"{mode}: {doctype}")
+
+		# Cancelled invoices don't count as the bill being processed
+		cancelled = invoice.name
+		for mode, args in uploads.items():
+			frappe.db.set_value("Purchase Invoice", cancelled, "docstatus", 2)
+			with patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings):
+				log = frappe.get_doc("Invoice2Erpnext Log", create_purchase_invoice_from_file(file_doc.name, **args))
+
+			self.assertEqual(log.status, "Success", f"{mode}: {log.message}")
+			cancelled = frappe.db.get_value("File", file_doc.name, "attached_to_name")
+			self.assertNotEqual(cancelled, invoice.name)
+
+	def test_reuse_extraction(self):
+		server, settings = self._start_mock_server()
+		reuse_settings = replace(settings, force_reextraction=0)
+		file_doc = self._make_file()
+
+		def upload(settings):
+			with patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings):
+				return frappe.get_doc("Invoice2Erpnext Log", create_purchase_invoice_from_file(file_doc.name))
+
+		# A failed extraction is never reused
+		server.api_error_rate = 1
+		self.assertEqual(upload(reuse_settings).status, "Error")
+		server.api_error_rate = 0
+
+		first = upload(reuse_settings)
+		self.assertFalse(first.reused_from)
+		self.assertEqual(first.cost, server.cost)
+		self.assertEqual(server.requests, 2)
+
+		# Identical content is served from the earlier extraction, at no cost
+		reused = upload(reuse_settings)
+		self.assertEqual(reused.reused_from, first.name)
+		self.assertEqual(reused.cost, 0)
+		self.assertEqual(reused.get_extracted_doc(), first.get_extracted_doc())
+		self.assertEqual(server.requests, 2)
+
+		# Unless re-extraction is forced
+		forced = upload(settings)
+		self.assertFalse(forced.reused_from)
+		self.assertEqual(server.requests, 3)
+
+	def test_get_extracted_doc_not_migrated(self):
+		extracted_doc = make_extracted_doc(5)
+		response_data = {"message": {"success": True, "extracted_doc": json.dumps(extracted_doc)}}
+
+		# Logs from before extracted_doc_gz still carry the document in the response
+		log = frappe.get_doc({"doctype": "Invoice2Erpnext Log", "response": json.dumps(response_data)})
+		self.assertEqual(log.get_extracted_doc(), extracted_doc)
+
+		log.set_response_data(response_data)
+		self.assertNotIn("extracted_doc", log.get_response_data()["message"])
+		self.assertEqual(log.get_extracted_doc(), extracted_doc)
+
+	def test_compress_extracted_docs_patch(self):
+		self._roll_back_writes()
+		extracted_doc = json.dumps(make_extracted_doc(5))
+		response = json.dumps({"message": {"success": True, "cost": 1, "extracted_doc": extracted_doc}})
+		log = frappe.get_doc({
+			"doctype": "Invoice2Erpnext Log",
+			"file": self._make_file().name,
+			"status": "Success",
+			"response": response,
+		}).insert(ignore_permissions=True)
+		modified = log.modified
+
+		compress_extracted_docs.execute()
+		log.reload()
+		self.assertEqual(json.loads(log.response), {"message": {"success": True, "cost": 1}})
+		self.assertEqual(log.get_extracted_doc(), json.loads(extracted_doc))
+		self.assertEqual(log.modified, modified)
+
+		# Running the patch again leaves migrated logs alone
+		migrated = (log.response, log.extracted_doc_gz)
+		compress_extracted_docs.execute()
+		log.reload()
+		self.assertEqual((log.response, log.extracted_doc_gz), migrated)
+
+	def test_diagnostics_limit(self):
+		log = frappe.new_doc("Invoice2Erpnext Log")
+		for i in range(invoice2erpnext_log.MAX_DIAGNOSTICS + 20):
+			log.add_diagnostic("date_fixed", f"Date {i} fixed", value=i)
+
+		# Diagnostics beyond the limit are dropped, the first ones are kept and saved
+		diagnostics = log.get_diagnostics()
+		self.assertEqual(len(diagnostics), invoice2erpnext_log.MAX_DIAGNOSTICS)
+		self.assertEqual(diagnostics[-1], {"code": "date_fixed", "message": "Date 99 fixed", "value": 99})
+
+		log.validate()
+		self.assertEqual(json.loads(log.diagnostics), diagnostics)
+
+	def test_max_file_size(self):
+		self._roll_back_writes()
+		file_doc = self._make_file(b"%PDF-1.4 " + os.urandom(1024 * 1024))
+		settings = SettingsSnapshot(max_file_size=1, force_reextraction=1)
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(client, "post") as post,
+		):
+			log = frappe.get_doc("Invoice2Erpnext Log", create_purchase_invoice_from_file(file_doc.name))
+
+		# Files above the limit are refused before anything is uploaded
+		post.assert_not_called()
+		self.assertEqual(log.status, "Error")
+		self.assertIn("larger than the maximum of 1 MB", log.message)
+
+	def test_create_purchase_invoice_auto_rolls_back(self):
+		from erpnext.accounts.doctype.purchase_invoice.purchase_invoice import PurchaseInvoice
+
+		server, settings = self._start_mock_server()
+		server.item_count = 10
+		file_doc = self._make_file()
+		counts = {doctype: frappe.db.count(doctype) for doctype in ("Supplier", "Item", "UOM Conversion Detail")}
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(PurchaseInvoice, "validate", side_effect=frappe.ValidationError("Rejected")),
+		):
+			log_name = create_purchase_invoice_from_file(file_doc.name)
+
+		# The extraction is kept on the log, the master data created for the invoice is not
+		log = frappe.get_doc("Invoice2Erpnext Log", log_name)
+		self.assertEqual(log.status, "Error")
+		self.assertIn("Rejected", log.message)
+		self.assertIsNotNone(log.get_extracted_invoice())
+		for doctype, count in counts.items():
+			self.assertEqual(frappe.db.count(doctype), count, doctype)
+
+	def test_create_purchase_invoice_from_file_in_background(self):
+		self._roll_back_writes()
+		file_doc = self._make_file()
+		settings = SettingsSnapshot(background_processing=1, background_queue="short")
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(frappe, "enqueue") as enqueue,
+			patch.object(invoice2erpnext_log, "process_log") as process_log,
+		):
+			log_name = create_purchase_invoice_from_file(file_doc.name)
+
+		# The log is handed to a worker on the configured queue, nothing is extracted in the request
+		process_log.assert_not_called()
+		enqueue.assert_called_once_with(
+			invoice2erpnext_log.process_queued_log,
+			queue="short",
+			job_id=f"invoice2erpnext::{log_name}",
+			deduplicate=True,
+			enqueue_after_commit=True,
+			log_name=log_name,
+		)
+		self.assertEqual(frappe.db.get_value("Invoice2Erpnext Log", log_name, "status"), "Queued")
+
+	def test_process_queued_log_claimed_once(self):
+		# The second worker reads the log over its own connection, so it is committed
+		self.addCleanup(frappe.db.commit)
+		file_doc = self._make_file()
+		settings = SettingsSnapshot(background_processing=1)
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(frappe, "enqueue"),
+		):
+			log_name = create_purchase_invoice_from_file(file_doc.name)
+		self.addCleanup(frappe.db.delete, "Invoice2Erpnext Log", {"name": log_name})
+		frappe.db.commit()
+
+		processed = []
+		with patch.object(invoice2erpnext_log, "process_log", side_effect=lambda doc, settings: processed.append(doc.name)):
+			# This worker locks the log first, the same job running twice has to wait for its claim
+			frappe.get_doc("Invoice2Erpnext Log", log_name, for_update=True)
+			worker = threading.Thread(
+				target=invoice2erpnext_log._process_log_in_thread,
+				args=(frappe.local.site, frappe.local.sites_path, frappe.session.user, log_name, settings),
+			)
+			worker.start()
+			worker.join(0.5)
+
+			invoice2erpnext_log.process_queued_log(log_name, settings)
+			worker.join()
+
+		# Only the worker that claimed the log processed it, the other one skipped it
+		self.assertEqual(processed, [log_name])
+		self.assertEqual(frappe.db.get_value("Invoice2Erpnext Log", log_name, "status"), "Pending")
+
+	def test_create_purchase_invoices_from_files(self):
+		self._roll_back_writes()
+		file_names = [self._make_file().name for _ in range(3)]
+		settings = SettingsSnapshot(background_processing=1, background_queue="short")
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(frappe, "enqueue") as enqueue,
+		):
+			batch_id = create_purchase_invoices_from_files(file_names)
+
+		# In the background, the whole batch is one job on the configured queue
+		enqueue.assert_called_once()
+		self.assertIs(enqueue.call_args.args[0], invoice2erpnext_log.process_batch)
+		self.assertEqual(enqueue.call_args.kwargs["queue"], "short")
+		self.assertEqual(enqueue.call_args.kwargs["batch_id"], batch_id)
+
+		logs = frappe.get_all("Invoice2Erpnext Log", filters={"batch_id": batch_id}, fields=["name", "file", "status"])
+		self.assertEqual(sorted(log.file for log in logs), sorted(file_names))
+		self.assertEqual({log.status for log in logs}, {"Queued"})
+
+		# Progress counts the logs that reached a final status
+		progress = get_batch_progress(batch_id)
+		self.assertEqual((progress["total"], progress["processed"], progress["done"]), (3, 0, False))
+		for log, status in zip(logs, ("Success", "Duplicate", "Error")):
+			frappe.db.set_value("Invoice2Erpnext Log", log.name, "status", status)
+			progress = get_batch_progress(batch_id)
+		self.assertEqual((progress["processed"], progress["done"]), (3, True))
+		self.assertEqual(progress["statuses"], {"Success": 1, "Duplicate": 1, "Error": 1})
+
+		# Otherwise the batch is processed during the request
+		settings = replace(settings, background_processing=0)
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(frappe, "enqueue") as enqueue,
+			patch.object(invoice2erpnext_log, "process_batch") as process_batch,
+		):
+			batch_id = create_purchase_invoices_from_files(file_names[:1])
+
+		enqueue.assert_not_called()
+		process_batch.assert_called_once_with(batch_id, settings)
+		self.assertRaises(frappe.ValidationError, create_purchase_invoices_from_files, "[]")
+
+	def test_process_batch(self):
+		# The batch threads read the logs over their own connections, so they are committed
+		self.addCleanup(frappe.db.commit)
+		file_names = [self._make_file().name for _ in range(5)]
+		settings = SettingsSnapshot(background_processing=1, batch_concurrency=2)
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(frappe, "enqueue"),
+		):
+			batch_id = create_purchase_invoices_from_files(file_names)
+		self.addCleanup(frappe.db.delete, "Invoice2Erpnext Log", {"batch_id": batch_id})
+		frappe.db.commit()
+
+		failing = frappe.db.get_value("Invoice2Erpnext Log", {"batch_id": batch_id, "file": file_names[2]})
+		lock = threading.Lock()
+		running = []
+		concurrency = []
+		connections = {}
+
+		def process_queued_log(log_name, settings):
+			with lock:
+				running.append(log_name)
+				concurrency.append(len(running))
+				connections[log_name] = (threading.get_ident(), frappe.local.db)
+			time.sleep(0.2)
+			with lock:
+				running.remove(log_name)
+
+			if log_name == failing:
+				raise frappe.ValidationError("Extraction failed")
+			frappe.db.set_value("Invoice2Erpnext Log", log_name, "status", "Success")
+
+		with (
+			patch.object(invoice2erpnext_log, "get_settings_snapshot", return_value=settings),
+			patch.object(invoice2erpnext_log, "process_queued_log", process_queued_log),
+			patch.object(invoice2erpnext_log, "log_error_throttled") as log_error,
+			patch.object(frappe, "connect", wraps=frappe.connect) as connect,
+			patch.object(frappe, "destroy", wraps=frappe.destroy) as destroy,
+		):
+			invoice2erpnext_log.process_batch(batch_id)
+
+		# At most batch_concurrency files at a time, each log over a connection of its own
+		self.assertEqual(max(concurrency), 2)
+		self.assertLessEqual(len({thread for thread, db in connections.values()}), 2)
+		self.assertEqual(len({id(db) for thread, db in connections.values()} - {id(frappe.local.db)}), 5)
+		self.assertEqual((connect.call_count, destroy.call_count), (5, 5))
+		self.assertNotIn(batch_id, invoice2erpnext_log._batch_master_data)
+		self.assertNotIn(batch_id, invoice2erpnext_log._batch_bill_locks)
 
-class TestInvoice2ErpnextLog(FrappeTestCase):
-	pass
+		# A failing file is recorded on its log and doesn't stop the others
+		frappe.db.commit()
+		logs = frappe.get_all("Invoice2Erpnext Log", filters={"batch_id": batch_id}, fields=["name", "status", "message"])
+		self.assertEqual({log.name: log.status for log in logs}, {log.name: "Error" if log.name == failing else "Success" for log in logs})
+		self.assertIn("Batch processing error: Extraction failed", next(log.message for log in logs if log.name == failing))
+		log_error.assert_called_once()
+		self.assertEqual(get_batch_progress(batch_id)["statuses"], {"Success": 4, "Error": 1})
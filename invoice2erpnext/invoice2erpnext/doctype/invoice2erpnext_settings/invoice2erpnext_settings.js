@@ -36,9 +36,10 @@ frappe.ui.form.on('Invoice2Erpnext Settings', {
                     // Get credits value
                     let credits = r.message.value;
                     
-                    // Format manually without using frappe.format for currency
+                    // Use the server's formatting in the system number format when available
                     let currencySymbol = frappe.boot.sysdefaults.currency_symbol || '€';
-                    let formattedValue = parseFloat(credits).toFixed(2).toString().replace(/\B(?=(\d{3})+(?!\d))/g, ",");
+                    let formattedValue = r.message.formatted_value ||
+                        parseFloat(credits).toFixed(2).toString().replace(/\B(?=(\d{3})+(?!\d))/g, ",");
                     let formattedCredits = currencySymbol + ' ' + formattedValue;
                     
                     // Create a clean, simple HTML structure
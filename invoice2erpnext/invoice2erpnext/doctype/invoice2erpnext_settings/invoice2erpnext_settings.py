@@ -2,16 +2,39 @@
 # For license information, please see license.txt
 
 import frappe
+from dataclasses import dataclass, field
+from typing import ClassVar
 from frappe.model.document import Document
-import requests
+from frappe.utils import cint, flt
+from invoice2erpnext import client
 from invoice2erpnext.utils import format_currency_value
 
+# Cache key and default lifetime of the remote credits balance
+CREDITS_CACHE_KEY = "invoice2erpnext:credits_balance"
+DEFAULT_CREDITS_CACHE_TTL = 300
+
+# Cache key and lifetime of a failed credits request, so dashboards don't retry it on every view
+CREDITS_FAILURE_CACHE_KEY = "invoice2erpnext:credits_failure"
+CREDITS_FAILURE_CACHE_TTL = 30
+
+# Adds to the cached balance only while it exists, so an expired balance isn't recreated without a lifetime
+DEDUCT_CREDITS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrbyfloat', KEYS[1], ARGV[1])
+end
+return false
+"""
+
 class Invoice2ErpnextSettings(Document):
     """Settings for Invoice2ERPNext integration"""
     
     # Define as class variable - available to all instances and methods
     BASE_URL = "https://kainotomo.com"
     
+    def on_update(self):
+        """Drop the cached credits, credentials or cache lifetime may have changed"""
+        clear_cached_credits()
+    
     @frappe.whitelist()
     def get_credits(self):
         """Test connection to ERPNext API and fetch user credits"""
@@ -24,27 +47,19 @@ class Invoice2ErpnextSettings(Document):
             }
         
         try:
-            api_key = self.get_password('api_key')
-            api_secret = self.get_password('api_secret') if hasattr(self, 'get_password') else self.api_secret
-            
-            # Prepare API request headers with decrypted credentials
-            headers = {
-                "Authorization": f"token {api_key}:{api_secret}",
-                "Content-Type": "application/json"
-            }
-            
             # Make request to the get_user_credits endpoint
-            endpoint = f"{self.BASE_URL}/api/method/doc2sys.doc2sys.doctype.doc2sys_user_settings.doc2sys_user_settings.get_user_credits"
+            endpoint = "/api/method/doc2sys.doc2sys.doctype.doc2sys_user_settings.doc2sys_user_settings.get_user_credits"
             
             # You might need to pass specific user information if required
             data = {}
             if hasattr(self, 'erpnext_user') and self.erpnext_user:
                 data = {"user": self.erpnext_user}
             
-            # Make the API request
-            response = requests.post(
+            # Make the API request over the shared session
+            response = client.post(
+                self,
                 endpoint,
-                headers=headers,
+                headers={"Content-Type": "application/json"},
                 json=data
             )
             
@@ -56,6 +71,7 @@ class Invoice2ErpnextSettings(Document):
                 if result.get("message") and result["message"].get("success"):
                     # Extract credits from response
                     credits = result["message"].get("credits", 0)
+                    set_cached_credits(credits, self.credits_cache_ttl)
                     
                     # Use the utility function to format credits
                     formatted_credits = format_currency_value(credits)
@@ -63,6 +79,7 @@ class Invoice2ErpnextSettings(Document):
                     return {
                         "success": True,
                         "credits": formatted_credits,
+                        "credits_value": flt(credits),
                         "message": "Successfully connected to ERPNext API"
                     }
                 else:
@@ -100,11 +117,92 @@ class Invoice2ErpnextSettings(Document):
         return result
 
 
+
+@dataclass(frozen=True, slots=True)
+class SettingsSnapshot:
+    """Immutable copy of Invoice2Erpnext Settings loaded once per invoice or batch"""
+    
+    BASE_URL: ClassVar[str] = Invoice2ErpnextSettings.BASE_URL
+    
+    enabled: int = 0
+    vat_account: str = "VAT - TC"
+    supplier_group: str = "All Supplier Groups"
+    item_group: str = "All Item Groups"
+    one_item_invoice: int = 0
+    item: str = ""
+    background_processing: int = 0
+    background_queue: str = "long"
+    batch_concurrency: int = 4
+    connect_timeout: float = 0
+    read_timeout: float = 0
+    max_retries: int = client.DEFAULT_MAX_RETRIES
+    credits_cache_ttl: int = DEFAULT_CREDITS_CACHE_TTL
+    max_file_size: int = 0
+    force_reextraction: int = 0
+    base_url: str = ""
+    api_key: str = field(default="", repr=False)
+    api_secret: str = field(default="", repr=False)
+    
+    @classmethod
+    def from_doc(cls, doc):
+        """Build a snapshot from an Invoice2Erpnext Settings document"""
+        return cls(
+            enabled=cint(doc.enabled),
+            vat_account=doc.vat_account or "VAT - TC",
+            supplier_group=doc.supplier_group or "All Supplier Groups",
+            item_group=doc.item_group or "All Item Groups",
+            one_item_invoice=cint(doc.one_item_invoice),
+            item=doc.item or "",
+            background_processing=cint(doc.background_processing),
+            background_queue=doc.background_queue or "long",
+            batch_concurrency=cint(doc.batch_concurrency) or 4,
+            connect_timeout=flt(doc.connect_timeout),
+            read_timeout=flt(doc.read_timeout),
+            # Single doctypes don't get new defaults on upgrade, so an unset field means the default
+            max_retries=cint(doc.max_retries) or client.DEFAULT_MAX_RETRIES,
+            credits_cache_ttl=cint(doc.credits_cache_ttl),
+            max_file_size=cint(doc.max_file_size),
+            force_reextraction=cint(doc.force_reextraction),
+            base_url=(doc.base_url or "").strip(),
+            api_key=doc.get_password('api_key', raise_exception=False) or "",
+            api_secret=doc.get_password('api_secret', raise_exception=False) or ""
+        )
+    
+    def get_password(self, fieldname):
+        """Return a credential, mirroring Document.get_password for the API client"""
+        return getattr(self, fieldname)
+
+def get_settings_snapshot():
+    """
+    Load an immutable snapshot of Invoice2Erpnext Settings
+    
+    The settings document is read through the document cache, which Frappe
+    invalidates whenever the settings are saved.
+    """
+    return SettingsSnapshot.from_doc(frappe.get_cached_doc("Invoice2Erpnext Settings"))
+
 # Add a global function that doesn't require document permissions
 @frappe.whitelist(allow_guest=False)
 def get_available_credits():
     """Get available credits - accessible to all authenticated users"""
     try:
+        # Serve from cache so dashboards don't call the remote API on every page view
+        credits = get_cached_credits()
+        if credits is not None:
+            return {
+                "value": credits,
+                "formatted_value": format_currency_value(credits),
+                "fieldtype": "Currency",
+            }
+        
+        # Nor while it keeps failing
+        if frappe.cache().get_value(CREDITS_FAILURE_CACHE_KEY):
+            return {
+                "value": 0,
+                "formatted_value": format_currency_value(0),
+                "fieldtype": "Currency",
+            }
+        
         # Check if settings exists - don't need document permissions for this check
         if not frappe.db.exists("Invoice2Erpnext Settings", "Invoice2Erpnext Settings"):
             return {
@@ -117,21 +215,63 @@ def get_available_credits():
         settings.flags.ignore_permissions = True
         
         # Get credits using the instance method which handles credentials properly
+        # and refreshes the cache on success
         result = settings.get_credits()
         
         # Extract credits from result if successful
         credits = 0
-        if result.get("success") and "credits" in result:
-            credits = result["credits"]
+        if result.get("success") and "credits_value" in result:
+            credits = result["credits_value"]
+        else:
+            set_credits_failure()
         
-        # Return formatted response for number card
+        # Return the number for number cards, and the text formatted in the system number format
         return {
             "value": credits,
+            "formatted_value": format_currency_value(credits),
             "fieldtype": "Currency",
         }
     except Exception as e:
         frappe.log_error(f"Error fetching credits for all users: {str(e)}", "Invoice2Erpnext Credits")
+        set_credits_failure()
         return {
             "value": 0,
             "fieldtype": "Currency",
-        }
\ No newline at end of file
+        }
+
+def get_cached_credits():
+    """Get the cached credits balance, or None if it is not cached"""
+    credits = frappe.cache().get(frappe.cache().make_key(CREDITS_CACHE_KEY))
+    return None if credits is None else flt(credits.decode())
+
+def set_cached_credits(credits, ttl=None):
+    """
+    Cache the credits balance for ttl seconds (0 disables caching)
+    
+    The balance is stored as a plain number rather than pickled, so that
+    deduct_cached_credits can change it atomically in Redis.
+    """
+    ttl = DEFAULT_CREDITS_CACHE_TTL if ttl is None else cint(ttl)
+    if ttl > 0:
+        frappe.cache().set(frappe.cache().make_key(CREDITS_CACHE_KEY), flt(credits), ex=ttl)
+        frappe.cache().delete_value(CREDITS_FAILURE_CACHE_KEY)
+
+def deduct_cached_credits(cost):
+    """
+    Refresh the cached credits balance after an extraction charged `cost`
+    
+    The balance is decremented in Redis, so parallel batch threads don't
+    overwrite each other's deductions. It keeps its remaining lifetime.
+    """
+    if not flt(cost):
+        return
+    
+    frappe.cache().eval(DEDUCT_CREDITS_SCRIPT, 1, frappe.cache().make_key(CREDITS_CACHE_KEY), -flt(cost))
+
+def set_credits_failure():
+    """Remember for a short while that the credits could not be fetched"""
+    frappe.cache().set_value(CREDITS_FAILURE_CACHE_KEY, 1, expires_in_sec=CREDITS_FAILURE_CACHE_TTL)
+
+def clear_cached_credits():
+    """Remove the cached credits balance and any cached failure"""
+    frappe.cache().delete_value([CREDITS_CACHE_KEY, CREDITS_FAILURE_CACHE_KEY])
@@ -1,9 +1,91 @@
 # Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from invoice2erpnext import client
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_settings.invoice2erpnext_settings import (
+	Invoice2ErpnextSettings,
+	SettingsSnapshot,
+	clear_cached_credits,
+	deduct_cached_credits,
+	get_available_credits,
+	get_cached_credits,
+	set_cached_credits,
+)
+from invoice2erpnext.utils import CurrencyFormatter, clear_currency_formatter, format_currency_value
+
 
 class TestInvoice2ErpnextSettings(FrappeTestCase):
-	pass
+	def test_currency_formatter_number_formats(self):
+		expected = {
+			"#,###.##": "-1,234,567.89",
+			"#.###,##": "-1.234.567,89",
+			"# ###.##": "-1 234 567.89",
+			"# ###,##": "-1 234 567,89",
+			"#'###.##": "-1'234'567.89",
+			"#, ###.##": "-1, 234, 567.89",
+			"#,##,###.##": "-12,34,567.89",
+			"#,###.###": "-1,234,567.891",
+			"#.###": "-1.234.568",
+			"#,###": "-1,234,568",
+			"#.########": "-1234567.89100000",
+		}
+		for number_format, formatted in expected.items():
+			self.assertEqual(CurrencyFormatter(number_format).format(-1234567.891), formatted)
+
+	def test_currency_formatter_values(self):
+		formatter = CurrencyFormatter("#.###,##")
+		self.assertEqual(formatter.format_many([0, "12,5", "7.25", 999.999]), ["0,00", "12,50", "7,25", "1.000,00"])
+		self.assertEqual(CurrencyFormatter("#,###.##", precision=0).format(1234.4), "1,234")
+
+	def test_format_currency_value_follows_system_settings(self):
+		number_format = frappe.db.get_single_value("System Settings", "number_format")
+		self.addCleanup(clear_currency_formatter)
+		self.addCleanup(frappe.db.set_single_value, "System Settings", "number_format", number_format)
+
+		system_settings = frappe.get_doc("System Settings")
+		system_settings.number_format = "# ###,##"
+		system_settings.save()
+		self.assertTrue(format_currency_value(1234.5).startswith("1 234,5"))
+
+	def test_available_credits_failure_is_cached(self):
+		clear_cached_credits()
+		self.addCleanup(clear_cached_credits)
+
+		failure = {"success": False, "message": "HTTP Error: 502"}
+		with patch.object(Invoice2ErpnextSettings, "get_credits", return_value=failure) as get_credits:
+			for _ in range(3):
+				self.assertEqual(get_available_credits()["value"], 0)
+		self.assertEqual(get_credits.call_count, 1)
+
+		# A balance fetched later replaces the failure
+		set_cached_credits(10, ttl=60)
+		self.assertEqual(get_available_credits()["value"], 10)
+
+	def test_deduct_cached_credits(self):
+		clear_cached_credits()
+		self.addCleanup(clear_cached_credits)
+
+		set_cached_credits(100, ttl=60)
+		for cost in (2.5, 0.5, 0, None):
+			deduct_cached_credits(cost)
+		self.assertEqual(get_cached_credits(), 97)
+
+		# Without a cached balance there is nothing to deduct from
+		clear_cached_credits()
+		deduct_cached_credits(1)
+		self.assertIsNone(get_cached_credits())
+
+	def test_settings_snapshot_defaults_max_retries(self):
+		settings = frappe.get_doc("Invoice2Erpnext Settings")
+
+		# Sites upgraded from before Max Retries existed have no value stored for it
+		settings.max_retries = None
+		self.assertEqual(SettingsSnapshot.from_doc(settings).max_retries, client.DEFAULT_MAX_RETRIES)
+
+		settings.max_retries = 1
+		self.assertEqual(SettingsSnapshot.from_doc(settings).max_retries, 1)
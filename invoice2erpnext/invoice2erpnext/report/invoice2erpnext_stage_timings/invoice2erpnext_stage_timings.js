@@ -0,0 +1,33 @@
+// Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["Invoice2Erpnext Stage Timings"] = {
+    filters: [
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.add_days(frappe.datetime.get_today(), -30),
+            reqd: 1
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.get_today(),
+            reqd: 1
+        },
+        {
+            fieldname: "status",
+            label: __("Status"),
+            fieldtype: "Select",
+            options: "\nSuccess\nError\nDuplicate"
+        },
+        {
+            fieldname: "mode",
+            label: __("Mode"),
+            fieldtype: "Select",
+            options: "\nAuto\nManual"
+        }
+    ]
+};
@@ -0,0 +1,114 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import math
+
+import frappe
+from frappe import _
+from frappe.utils import add_days, flt
+
+# Timing fields of Invoice2Erpnext Log, in processing order
+STAGES = [
+    ("upload_time", "Upload"),
+    ("remote_time", "Remote Extraction"),
+    ("parse_time", "Parse"),
+    ("transform_time", "Transform"),
+    ("master_data_time", "Supplier and Item Inserts"),
+    ("invoice_insert_time", "Purchase Invoice Insert"),
+    ("file_link_time", "File Relink"),
+    ("total_time", "Total"),
+]
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def execute(filters=None):
+    """Latency percentiles of each processing stage over the logs in the period"""
+    filters = filters or {}
+    logs = get_logs(filters)
+
+    data = []
+    total_seconds = sum(flt(log.total_time) for log in logs)
+    for fieldname, label in STAGES:
+        # Stages that didn't run for a log (e.g. no upload for a reused extraction) are left out
+        values = sorted(flt(log.get(fieldname)) for log in logs if flt(log.get(fieldname)) > 0)
+        if not values:
+            continue
+
+        row = {
+            "stage": _(label),
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "max": values[-1],
+            "share": sum(values) / total_seconds * 100 if total_seconds and fieldname != "total_time" else None
+        }
+        for percentile in PERCENTILES:
+            row[f"p{percentile}"] = get_percentile(values, percentile)
+        data.append(row)
+
+    return get_columns(), data, None, get_chart(data)
+
+
+def get_logs(filters):
+    """Timings of the processed logs created in the period"""
+    conditions = {
+        "creation": ["between", [filters.get("from_date"), add_days(filters.get("to_date"), 1)]],
+        "total_time": [">", 0]
+    }
+    if filters.get("status"):
+        conditions["status"] = filters.get("status")
+    if filters.get("mode"):
+        conditions["manual_mode"] = 1 if filters.get("mode") == "Manual" else 0
+
+    return frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters=conditions,
+        fields=[fieldname for fieldname, label in STAGES]
+    )
+
+
+def get_percentile(values, percentile):
+    """Percentile of sorted values, interpolating between the closest ranks"""
+    rank = (len(values) - 1) * percentile / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def get_columns():
+    columns = [
+        {"fieldname": "stage", "label": _("Stage"), "fieldtype": "Data", "width": 200},
+        {"fieldname": "count", "label": _("Logs"), "fieldtype": "Int", "width": 80},
+        {"fieldname": "mean", "label": _("Mean (s)"), "fieldtype": "Float", "precision": 3, "width": 100},
+    ]
+    for percentile in PERCENTILES:
+        columns.append({
+            "fieldname": f"p{percentile}",
+            "label": _("P{0} (s)").format(percentile),
+            "fieldtype": "Float",
+            "precision": 3,
+            "width": 100
+        })
+    columns += [
+        {"fieldname": "max", "label": _("Max (s)"), "fieldtype": "Float", "precision": 3, "width": 100},
+        {"fieldname": "share", "label": _("Share of Total"), "fieldtype": "Percent", "width": 120},
+    ]
+    return columns
+
+
+def get_chart(data):
+    """Bar chart of the median and p95 of each stage"""
+    stages = [row for row in data if row["share"] is not None]
+    if not stages:
+        return None
+
+    return {
+        "data": {
+            "labels": [row["stage"] for row in stages],
+            "datasets": [
+                {"name": _("P50 (s)"), "values": [row["p50"] for row in stages]},
+                {"name": _("P95 (s)"), "values": [row["p95"] for row in stages]},
+            ]
+        },
+        "type": "bar"
+    }
@@ -0,0 +1,55 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice2erpnext.invoice2erpnext.report.invoice2erpnext_stage_timings import invoice2erpnext_stage_timings
+from invoice2erpnext.invoice2erpnext.report.invoice2erpnext_stage_timings.invoice2erpnext_stage_timings import (
+	execute,
+	get_percentile,
+)
+
+
+class TestInvoice2ErpnextStageTimings(FrappeTestCase):
+	def test_get_percentile(self):
+		values = [1, 2, 3, 4, 10]
+
+		self.assertEqual(get_percentile(values, 0), 1)
+		self.assertEqual(get_percentile(values, 50), 3)
+		self.assertEqual(get_percentile(values, 100), 10)
+		# Between the closest ranks, interpolated: rank 3.6 is 60% of the way from 4 to 10
+		self.assertAlmostEqual(get_percentile(values, 90), 7.6)
+		self.assertAlmostEqual(get_percentile(values, 99), 9.76)
+		self.assertEqual(get_percentile([2.5], 95), 2.5)
+
+	def test_execute(self):
+		logs = [
+			frappe._dict(upload_time=1, remote_time=3, total_time=4),
+			frappe._dict(upload_time=2, remote_time=5, parse_time=1, total_time=8),
+			# A reused extraction has no upload
+			frappe._dict(remote_time=2, total_time=2),
+		]
+		with patch.object(invoice2erpnext_stage_timings, "get_logs", return_value=logs):
+			columns, data, message, chart = execute({"from_date": "2025-01-01", "to_date": "2025-01-31"})
+
+		self.assertEqual(
+			[column["fieldname"] for column in columns],
+			["stage", "count", "mean", "p50", "p90", "p95", "p99", "max", "share"],
+		)
+
+		# Stages that never ran are left out
+		rows = {row["stage"]: row for row in data}
+		self.assertEqual(list(rows), ["Upload", "Remote Extraction", "Parse", "Total"])
+
+		upload = rows["Upload"]
+		self.assertEqual((upload["count"], upload["mean"], upload["p50"], upload["max"]), (2, 1.5, 1.5, 2))
+		self.assertAlmostEqual(upload["share"], 3 / 14 * 100)
+		self.assertEqual((rows["Remote Extraction"]["p50"], rows["Total"]["p50"]), (3, 4))
+		self.assertIsNone(rows["Total"]["share"])
+
+		# The chart compares the stages, without the total
+		self.assertEqual(chart["data"]["labels"], ["Upload", "Remote Extraction", "Parse"])
+		self.assertEqual(chart["data"]["datasets"][0]["values"], [1.5, 3, 1])
@@ -0,0 +1,180 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Operational metrics of invoice processing in the Prometheus text format
+
+Counters and histograms are kept in Redis hashes, so the web and background
+workers of a site all add to the same values. The queue depth is read from
+the database when the metrics are scraped from:
+
+    /api/method/invoice2erpnext.metrics.get_metrics
+"""
+
+import frappe
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+METRICS = {
+    "invoice2erpnext_files_processed_total": ("counter", "Files processed, by final log status"),
+    "invoice2erpnext_api_requests_total": ("counter", "Extraction API requests, by HTTP status code"),
+    "invoice2erpnext_api_retries_total": ("counter", "Extraction API requests retried after a connection error or 429/5xx"),
+    "invoice2erpnext_credits_spent_total": ("counter", "Credits charged by the extraction API"),
+    "invoice2erpnext_api_request_seconds": ("histogram", "Extraction API request duration, upload included"),
+    "invoice2erpnext_processing_seconds": ("histogram", "Time to process a file from upload to Purchase Invoice"),
+}
+
+QUEUE_DEPTH_METRIC = "invoice2erpnext_queue_depth"
+
+
+def _key(name):
+    return frappe.cache().make_key(f"invoice2erpnext:metrics:{name}")
+
+
+def _labels(labels):
+    """Format labels as in the exposition format, e.g. status="Success" """
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def inc(name, value=1, **labels):
+    """
+    Increase a counter
+
+    Args:
+        name: Counter name from METRICS
+        value: Amount to add
+        **labels: Labels of the series
+    """
+    if not value:
+        return
+
+    try:
+        frappe.cache().hincrbyfloat(_key(name), _labels(labels), value)
+    except Exception:
+        pass  # Metrics must never interrupt invoice processing
+
+
+def observe(name, value, **labels):
+    """
+    Record a value in a histogram, in a single round trip to Redis
+
+    Args:
+        name: Histogram name from METRICS
+        value: Observed value in seconds
+        **labels: Labels of the series
+    """
+    if value is None:
+        return
+
+    label_text = _labels(labels)
+    key = _key(name)
+    try:
+        pipeline = frappe.cache().pipeline()
+        for bound in LATENCY_BUCKETS:
+            if value <= bound:
+                pipeline.hincrby(key, f"bucket|{bound}|{label_text}", 1)
+        pipeline.hincrby(key, f"bucket|+Inf|{label_text}", 1)
+        pipeline.hincrbyfloat(key, f"sum|{label_text}", value)
+        pipeline.hincrby(key, f"count|{label_text}", 1)
+        pipeline.execute()
+    except Exception:
+        pass  # Metrics must never interrupt invoice processing
+
+
+def get_retries(response):
+    """Number of retries urllib3 made before the final response"""
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(getattr(retries, "history", None) or ())
+
+
+def render():
+    """
+    Render all metrics in the Prometheus text exposition format
+
+    Returns:
+        str: The metrics, one sample per line
+    """
+    # Read the raw hashes in one round trip; RedisWrapper.hgetall would unpickle them
+    pipeline = frappe.cache().pipeline()
+    for name in METRICS:
+        pipeline.hgetall(_key(name))
+    stored = dict(zip(METRICS, pipeline.execute()))
+
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        values = {
+            field.decode(): float(value)
+            for field, value in (stored[name] or {}).items()
+        }
+
+        if metric_type == "counter":
+            for label_text, value in sorted(values.items()):
+                lines.append(_sample(name, label_text, value))
+            continue
+
+        # Buckets no value fell into are never stored, but each series exposes all of them
+        for field in list(values):
+            kind, _, label_text = field.partition("|")
+            if kind == "count":
+                for bound in LATENCY_BUCKETS:
+                    values.setdefault(f"bucket|{bound}|{label_text}", 0)
+
+        for field, value in sorted(values.items(), key=lambda item: _bucket_order(item[0])):
+            kind, _, rest = field.partition("|")
+            if kind == "bucket":
+                bound, _, label_text = rest.partition("|")
+                le = f'le="{bound}"'
+                lines.append(_sample(f"{name}_bucket", f"{label_text},{le}" if label_text else le, value))
+            else:
+                lines.append(_sample(f"{name}_{kind}", rest, value))
+
+    lines.append(f"# HELP {QUEUE_DEPTH_METRIC} Logs waiting for or being processed, by status")
+    lines.append(f"# TYPE {QUEUE_DEPTH_METRIC} gauge")
+    counts = dict.fromkeys(("Queued", "Pending"), 0)
+    counts.update(frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters={"status": ["in", list(counts)]},
+        fields=["status", "count(name) as count"],
+        group_by="status",
+        as_list=True
+    ))
+    for status, count in counts.items():
+        lines.append(_sample(QUEUE_DEPTH_METRIC, _labels({"status": status}), count))
+
+    return "\n".join(lines) + "\n"
+
+
+def _bucket_order(field):
+    """Sort histogram fields by series, then as buckets (by bound), sum and count"""
+    kind, _, rest = field.partition("|")
+    if kind != "bucket":
+        return (rest, 1 if kind == "sum" else 2, 0)
+    bound, _, label_text = rest.partition("|")
+    return (label_text, 0, float("inf") if bound == "+Inf" else float(bound))
+
+
+def _sample(name, label_text, value):
+    value = int(value) if float(value).is_integer() else value
+    return f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}"
+
+
+def clear():
+    """Reset all counters and histograms"""
+    for name in METRICS:
+        frappe.cache().delete(_key(name))
+
+
+@frappe.whitelist()
+def get_metrics():
+    """Prometheus scrape endpoint, for System Managers (e.g. an API key user)"""
+    from werkzeug.wrappers import Response
+
+    frappe.only_for("System Manager")
+    return Response(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,136 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Money arithmetic on Decimal
+
+Amounts are rounded to cents half to even on their decimal value, as Frappe's
+default banker's rounding does, so 2.675 becomes 2.68 here and in ERPNext
+(round(2.675, 2) gives 2.67, as the float is slightly below 2.675).
+
+When line amounts are rounded to cents they rarely add up to their total. The
+difference is spread one cent at a time by largest remainder: the lines that
+lost the most to rounding get a cent back first.
+"""
+
+import heapq
+from contextlib import contextmanager
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation, localcontext
+from fractions import Fraction
+
+ZERO = Decimal(0)
+CENT = Decimal("0.01")
+
+# Significant digits under exact_context, enough for products of amounts to be exact
+EXACT_PRECISION = 60
+
+
+def to_decimal(value) -> Decimal:
+    """
+    Convert an amount to Decimal
+
+    Floats are converted through their shortest repr, so 0.1 becomes
+    Decimal("0.1") rather than its binary expansion. Missing, invalid and
+    infinite values become zero.
+    """
+    if isinstance(value, Decimal):
+        return value if value.is_finite() else ZERO
+    if value is None or isinstance(value, bool):
+        return ZERO
+    try:
+        value = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError, TypeError):
+        return ZERO
+    return value if value.is_finite() else ZERO
+
+
+def round_money(value) -> Decimal:
+    """Round an amount to cents, half to even"""
+    return to_decimal(value).quantize(CENT, rounding=ROUND_HALF_EVEN)
+
+
+def to_cents(value) -> int:
+    """Amount in whole cents, rounded half to even"""
+    return int(round_money(value).scaleb(2))
+
+
+def from_cents(cents) -> float:
+    """Amount of a number of cents"""
+    return cents / 100
+
+
+@contextmanager
+def exact_context():
+    """
+    Decimal context in which products of amounts are exact
+
+    The default 28 digits can round the product of a rate and a subtotal with
+    many digits. Quotients are still rounded, far below a cent.
+    """
+    with localcontext() as context:
+        context.prec = EXACT_PRECISION
+        context.rounding = ROUND_HALF_EVEN
+        yield context
+
+
+def distribute_residual(indexes, shortfalls, residual):
+    """
+    Spread residual cents over lines by largest remainder
+
+    Every line first gets the whole cents of residual / lines, then one more
+    cent goes to each of the lines with the largest shortfall (or, for a
+    negative residual, the largest excess). Selecting those lines is a partial
+    sort, O(n log n) at most.
+
+    Args:
+        indexes: Lines that can take cents
+        shortfalls: Function giving how far a line was rounded below its exact value
+        residual: Cents to add (or remove, if negative) in total
+
+    Returns:
+        list: (index, cents) of the lines that change
+    """
+    step = 1 if residual > 0 else -1
+    whole, remaining = divmod(abs(residual), len(indexes))
+
+    key = shortfalls if step > 0 else (lambda index: -shortfalls(index))
+    extra = set(heapq.nlargest(remaining, indexes, key=key))
+
+    return [
+        (index, step * (whole + (index in extra)))
+        for index in (indexes if whole else extra)
+    ]
+
+
+def settle_residual(residual, quantities, rate_cents, amount_cents, shortfalls, unit=1):
+    """
+    Settle the cents rounded line amounts are off from their total
+
+    The cents go to the single quantity lines by largest remainder, so each of
+    their rates stays equal to its amount and qty * rate, which ERPNext
+    recomputes on insert, still adds up. Without such lines the largest line
+    takes the difference.
+
+    Args:
+        residual: Cents to add (or remove, if negative) in total
+        quantities: Quantity of each line, in units of 1 / unit
+        rate_cents: Rate of each line in cents, updated in place
+        amount_cents: Amount of each line in cents, updated in place
+        shortfalls: Function giving how far a line's rate was rounded below its exact value
+        unit: Number of quantity units in a quantity of one
+    """
+    if not residual:
+        return
+
+    single_lines = [index for index, quantity in enumerate(quantities) if quantity == unit]
+    if single_lines:
+        for index, cents in distribute_residual(single_lines, shortfalls, residual):
+            amount_cents[index] += cents
+            rate_cents[index] = amount_cents[index]
+        return
+
+    # Find the largest item to absorb the difference
+    index = max(range(len(amount_cents)), key=lambda index: abs(amount_cents[index]))
+    amount_cents[index] += residual
+    if quantities[index]:
+        rate_cents[index] = round(Fraction(amount_cents[index] * unit) / Fraction(quantities[index]))
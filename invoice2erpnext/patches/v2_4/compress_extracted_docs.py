@@ -0,0 +1,48 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+import frappe
+import json
+from invoice2erpnext.utils import compress_text
+
+def execute():
+    """Move extracted documents out of the log response into the compressed extracted_doc_gz field"""
+    log_names = frappe.get_all(
+        "Invoice2Erpnext Log",
+        filters={
+            "response": ["like", '%"extracted_doc"%'],
+            "extracted_doc_gz": ["is", "not set"]
+        },
+        pluck="name"
+    )
+    
+    # Work in chunks so large log tables are never loaded at once
+    for start in range(0, len(log_names), 500):
+        logs = frappe.get_all(
+            "Invoice2Erpnext Log",
+            filters={"name": ["in", log_names[start:start + 500]]},
+            fields=["name", "response"]
+        )
+        
+        for log in logs:
+            try:
+                response_data = json.loads(log.response)
+            except ValueError:
+                continue
+            
+            message = response_data.get("message") if isinstance(response_data, dict) else None
+            if not isinstance(message, dict) or not message.get("extracted_doc"):
+                continue
+            
+            extracted_doc_gz = compress_text(message.pop("extracted_doc"))
+            frappe.db.set_value(
+                "Invoice2Erpnext Log",
+                log.name,
+                {
+                    "response": json.dumps(response_data),
+                    "extracted_doc_gz": extracted_doc_gz
+                },
+                update_modified=False
+            )
+        
+        frappe.db.commit()
@@ -46,68 +46,7 @@ function create_purchase_invoice_from_files(file_docs, listview, mode) {
     }
     
     // Continue with automatic processing for 'auto' mode
-    const total = file_docs.length;
-    let processed = 0;
-    
-    // Show progress dialog
-    const dialog = new frappe.ui.Dialog({
-        title: __('Creating Documents'),
-        fields: [
-            {
-                fieldtype: 'HTML',
-                fieldname: 'progress_area',
-                options: `<div class="progress">
-                    <div class="progress-bar" style="width: 0%"></div>
-                </div>
-                <p class="text-muted" style="margin-top: 10px">
-                    <span class="processed">0</span> ${__('of')} ${total} ${__('documents created')}
-                </p>`
-            }
-        ]
-    });
-    
-    dialog.show();
-    
-    // Process files one by one to create doc2sys_items
-    function process_next_file(index) {
-        if (index >= file_docs.length) {
-            // All files processed
-            setTimeout(() => {
-                dialog.hide();
-                frappe.show_alert({
-                    message: __(`Created ${processed} documents successfully`),
-                    indicator: 'green'
-                });
-                listview.refresh();
-            }, 1000);
-            return;
-        }
-        
-        const file_doc = file_docs[index];
-        
-        // Create doc2sys_item from file
-        frappe.call({
-            method: 'invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log.invoice2erpnext_log.create_purchase_invoice_from_file',
-            args: {
-                file_doc_name: file_doc.name,
-                mode: mode
-            },
-            callback: function(r) {
-                processed++;
-                
-                // Update progress
-                const percent = (processed / total) * 100;
-                dialog.$wrapper.find('.progress-bar').css('width', percent + '%');
-                dialog.$wrapper.find('.processed').text(processed);
-                
-                // Process next file
-                process_next_file(index + 1);
-            }
-        });
-    }
-    
-    // Start processing files
-    process_next_file(0);
+    process_files(file_docs, listview, 'auto');
 }
 
 // Function to show dialog for supplier and item selection
@@ -162,10 +101,11 @@ function show_supplier_item_dialog(file_docs, listview) {
 
 // Function to process files with manual supplier and item selection
 function process_manual_files(file_docs, listview, supplier, item) {
-    const total = file_docs.length;
-    let processed = 0;
-    
-    // Show progress dialog
+    process_files(file_docs, listview, 'manual', supplier, item);
+}
+
+// Function to show the progress dialog of an upload
+function show_progress_dialog(total) {
     const progress_dialog = new frappe.ui.Dialog({
         title: __('Creating Documents'),
         fields: [
@@ -176,54 +116,116 @@ function process_manual_files(file_docs, listview, supplier, item) {
                     <div class="progress-bar" style="width: 0%"></div>
                 </div>
                 <p class="text-muted" style="margin-top: 10px">
-                    <span class="processed">0</span> ${__('of')} ${total} ${__('documents created')}
+                    <span class="processed">0</span> ${__('of')} ${total} ${__('files processed')}
                 </p>`
             }
         ]
     });
     
     progress_dialog.show();
+    return progress_dialog;
+}
+
+// Function to show how many of the files were processed
+function update_progress(progress_dialog, processed, total) {
+    const percent = total ? (processed / total) * 100 : 0;
+    progress_dialog.$wrapper.find('.progress-bar').css('width', percent + '%');
+    progress_dialog.$wrapper.find('.processed').text(processed);
+}
+
+// Function to send all files in one server call and poll the batch progress;
+// the server processes the batch in the background if enabled in settings, otherwise during the call
+function process_files(file_docs, listview, mode, supplier, item) {
+    const progress_dialog = show_progress_dialog(file_docs.length);
     
-    // Process files one by one to create doc2sys_items
-    function process_next_file(index) {
-        if (index >= file_docs.length) {
+    frappe.call({
+        method: 'invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log.invoice2erpnext_log.create_purchase_invoices_from_files',
+        args: {
+            file_doc_names: file_docs.map(file_doc => file_doc.name),
+            mode: mode,
+            supplier: supplier,
+            item: item
+        },
+        callback: function(r) {
+            if (r.message) {
+                poll_batch_progress(r.message, progress_dialog, listview, Date.now());
+            } else {
+                progress_dialog.hide();
+            }
+        },
+        error: function() {
+            progress_dialog.hide();
+        }
+    });
+}
+
+// Stop polling a batch after this long; its files keep being processed in the background
+const BATCH_POLL_TIMEOUT = 30 * 60 * 1000;
+
+// Function to poll the server until all files of a batch are processed
+function poll_batch_progress(batch_id, progress_dialog, listview, started_at) {
+    frappe.call({
+        method: 'invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log.invoice2erpnext_log.get_batch_progress',
+        args: {
+            batch_id: batch_id
+        },
+        callback: function(r) {
+            const progress = r.message || {};
+            const total = progress.total || 0;
+            const processed = progress.processed || 0;
+            
+            update_progress(progress_dialog, processed, total);
+            
+            if (!progress.done) {
+                if (Date.now() - started_at > BATCH_POLL_TIMEOUT) {
+                    stop_batch_progress(progress_dialog, listview);
+                    return;
+                }
+                
+                // Check again in a moment
+                setTimeout(() => poll_batch_progress(batch_id, progress_dialog, listview, started_at), 2000);
+                return;
+            }
+            
             // All files processed
             setTimeout(() => {
                 progress_dialog.hide();
-                frappe.show_alert({
-                    message: __(`Created ${processed} documents successfully`),
-                    indicator: 'green'
-                });
+                show_batch_result(progress.statuses || {}, total);
                 listview.refresh();
             }, 1000);
-            return;
+        },
+        error: function() {
+            stop_batch_progress(progress_dialog, listview);
         }
-        
-        const file_doc = file_docs[index];
-        
-        // Create doc2sys_item from file with manual selections
-        frappe.call({
-            method: 'invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_log.invoice2erpnext_log.create_purchase_invoice_from_file',
-            args: {
-                file_doc_name: file_doc.name,
-                mode: 'manual',
-                supplier: supplier,
-                item: item
-            },
-            callback: function(r) {
-                processed++;
-                
-                // Update progress
-                const percent = (processed / total) * 100;
-                progress_dialog.$wrapper.find('.progress-bar').css('width', percent + '%');
-                progress_dialog.$wrapper.find('.processed').text(processed);
-                
-                // Process next file
-                process_next_file(index + 1);
-            }
-        });
+    });
+}
+
+// Function to report how many invoices were created, and how many files were duplicates or failed
+function show_batch_result(statuses, total) {
+    const succeeded = statuses['Success'] || 0;
+    const duplicates = statuses['Duplicate'] || 0;
+    const failed = statuses['Error'] || 0;
+    
+    let message = __('Created {0} of {1} documents', [succeeded, total]);
+    if (duplicates) {
+        message += ', ' + __('{0} already existed', [duplicates]);
+    }
+    if (failed) {
+        message += ', ' + __('{0} failed, see Invoice2Erpnext Log', [failed]);
     }
     
-    // Start processing files
-    process_next_file(0);
-}
\ No newline at end of file
+    frappe.show_alert({
+        message: message,
+        indicator: succeeded === total ? 'green' : (failed ? 'red' : 'orange')
+    });
+}
+
+// Function to close the progress dialog of a batch that is still being processed
+function stop_batch_progress(progress_dialog, listview) {
+    progress_dialog.hide();
+    frappe.show_alert({
+        message: __('The documents are still being created in the background, see Invoice2Erpnext Log for their status'),
+        indicator: 'orange'
+    });
+    listview.refresh();
+}
@@ -0,0 +1,152 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Integer-backed price adjustment for invoices with many lines
+
+Utility and telecom invoices can have thousands of lines. Instead of walking
+the item dicts once per step, quantities and rates are copied once into lists
+of exact integers (the decimal value in units of 10^-scale) and every step
+(scaling, rounding, line totals) runs as a chain of built-in iterators over
+them, without Python code per element. Integer arithmetic keeps the results
+exact, so they are the same as the Decimal per-item logic to the cent. The item
+dicts are only touched again to write the results back.
+transform.adjust_item_prices switches to this path from ARRAY_MIN_ITEMS lines
+on; smaller invoices keep the per-item logic.
+"""
+
+from fractions import Fraction
+from itertools import compress, count, repeat
+from operator import add, eq, floordiv, itemgetter, mod, mul, not_, truediv
+from typing import Any, Dict, List
+
+from invoice2erpnext import money
+
+# Invoices with at least this many lines are adjusted on integer lists
+ARRAY_MIN_ITEMS = 200
+
+# Decimal places tried, in turn, to write values as integers without Decimal
+SCALES = (2, 4, 6)
+
+# Integers below this many units have at most 15 digits, so floats round trip them
+MAX_EXACT_UNITS = 10 ** 15
+
+
+def to_units(values):
+    """
+    Write values as integers in units of 10^-scale, exactly
+
+    Values are taken as their shortest repr, like money.to_decimal. The first of
+    SCALES at which every value round trips through a float is used; that check
+    runs on built-in iterators. Values that need more places (or aren't floats)
+    are converted through Decimal.
+
+    Args:
+        values: Quantities or rates
+
+    Returns:
+        tuple: (list of integers, scale)
+    """
+    for scale in SCALES:
+        unit = 10 ** scale
+        try:
+            units = list(map(round, map(mul, values, repeat(unit))))
+        except (TypeError, ValueError, OverflowError):
+            break
+        if (
+            all(map(eq, map(truediv, units, repeat(unit)), values))
+            and max(map(abs, units), default=0) < MAX_EXACT_UNITS
+        ):
+            return units, scale
+
+    decimals = list(map(money.to_decimal, values))
+    scale = max([0, *(-value.as_tuple().exponent for value in decimals)])
+    return [int(value.scaleb(scale)) for value in decimals], scale
+
+
+def divide_half_even(numerators, denominator):
+    """
+    Divide integers by a positive integer, rounding half to even
+
+    Args:
+        numerators: Integers to divide
+        denominator: Positive integer divisor
+
+    Returns:
+        list: The rounded quotients
+    """
+    doubled = list(map(add, map(mul, numerators, repeat(2)), repeat(denominator)))
+    quotients = list(map(floordiv, doubled, repeat(2 * denominator)))
+    # Exact halves were rounded up; odd results of those go back down to even
+    for index in compress(count(), map(not_, map(mod, doubled, repeat(2 * denominator)))):
+        quotients[index] -= quotients[index] & 1
+    return quotients
+
+
+def cents_to_amounts(cents):
+    """Convert whole cents back to amounts"""
+    return map(truediv, cents, repeat(100))
+
+
+def adjust_item_prices(invoice_items: List[Dict[str, Any]], subtotal, calculated_line_total, tolerance):
+    """
+    Adjust item prices to match the extracted subtotal
+
+    Rates are scaled by subtotal / line total and rounded to whole cents, half
+    to even on the exact value. The cents the line amounts are still off from
+    the subtotal are spread one by one over the single quantity lines whose
+    rates were rounded the most in the other direction (largest remainder, see
+    money.settle_residual), as in the per-item logic.
+
+    Args:
+        invoice_items: Invoice items with qty and rate, updated in place
+        subtotal: Extracted subtotal the line amounts should add up to
+        calculated_line_total: Sum of qty * rate over the items
+        tolerance: Differences up to this amount are left alone
+
+    Returns:
+        list: The adjusted invoice items
+    """
+    adjusted_items = invoice_items.copy()
+    quantities, quantity_scale = to_units(list(map(itemgetter("qty"), adjusted_items)))
+    rates, rate_scale = to_units(list(map(itemgetter("rate"), adjusted_items)))
+    quantity_unit = 10 ** quantity_scale
+    subtotal = money.to_decimal(subtotal)
+    exact_subtotal = Fraction(subtotal)
+    line_total = Fraction(money.to_decimal(calculated_line_total))
+    # Rates in cents, once they have been changed
+    rate_cents = None
+
+    # Check if there's a huge disparity (likely decimal point issues)
+    if line_total > exact_subtotal * 10:
+        rate_cents = divide_half_even(rates, 10 ** rate_scale)  # rate / 100, in cents
+        line_total = Fraction(divide_half_even([sum(map(mul, quantities, rate_cents))], quantity_unit)[0], 100)
+
+    residual = 0
+    if abs(line_total - exact_subtotal) > Fraction(money.to_decimal(tolerance)) and line_total:
+        # Exact rates in cents are numerators / denominator
+        factor = exact_subtotal / line_total
+        if rate_cents is None:
+            numerators = list(map(mul, rates, repeat(factor.numerator * 100)))
+            denominator = factor.denominator * 10 ** rate_scale
+        else:
+            numerators = list(map(mul, rate_cents, repeat(factor.numerator)))
+            denominator = factor.denominator
+        rate_cents = divide_half_even(numerators, denominator)
+        amount_cents = divide_half_even(list(map(mul, quantities, rate_cents)), quantity_unit)
+        residual = money.to_cents(subtotal) - sum(amount_cents)
+    elif rate_cents is not None:
+        amount_cents = divide_half_even(list(map(mul, quantities, rate_cents)), quantity_unit)
+    else:
+        return adjusted_items
+
+    # How far each rounded rate fell short of its exact share, times the denominator
+    money.settle_residual(residual, quantities, rate_cents, amount_cents,
+                          lambda index: numerators[index] - rate_cents[index] * denominator,
+                          quantity_unit)
+
+    for item, rate, amount in zip(adjusted_items, cents_to_amounts(rate_cents), cents_to_amounts(amount_cents)):
+        item["rate"] = rate
+        item["amount"] = amount
+
+    return adjusted_items
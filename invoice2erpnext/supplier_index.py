@@ -0,0 +1,185 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Index of suppliers by tax ID and normalized name, kept in Redis
+
+Extracted vendor names vary in case, punctuation and legal form ("ACME Ltd."
+and "ACME LTD"), so matching them against supplier names exactly creates
+duplicates. The index maps the normalized tax ID and the normalized name of
+every enabled supplier to its name, in two Redis hashes shared by all workers.
+It is built on first use and kept current by the Supplier doc events in hooks.py.
+"""
+
+import pickle
+import re
+import unicodedata
+
+import frappe
+
+TAX_ID_INDEX = "invoice2erpnext:supplier_index:tax_id"
+NAME_INDEX = "invoice2erpnext:supplier_index:name"
+BUILT_KEY = "invoice2erpnext:supplier_index:built"
+
+# Legal forms dropped from the end of names, written without dots
+LEGAL_SUFFIXES = {
+    "ab", "ae", "ag", "aps", "as", "bv", "co", "company", "corp", "corporation", "gmbh", "inc",
+    "incorporated", "kg", "limited", "llc", "llp", "lp", "ltd", "nv", "oe", "oy", "plc", "pty",
+    "sa", "sarl", "sas", "spa", "srl",
+}
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]|_")
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[\W_]")
+
+
+def normalize_supplier_name(name):
+    """
+    Key of a supplier name, ignoring case, accents, punctuation and legal form
+
+    "ACME Ltd.", "Acme LTD" and "ACME, Limited" all give "acme", and
+    "Müller GmbH & Co. KG" gives "muller".
+    """
+    if not name:
+        return ""
+
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    # Join abbreviations such as S.A. or L.T.D. before splitting on punctuation
+    name = PUNCTUATION_PATTERN.sub(" ", name.replace(".", "").replace("&", " and "))
+
+    words = name.split()
+    while len(words) > 1 and words[-1] in LEGAL_SUFFIXES:
+        words.pop()
+        # "& Co." and "and Company" go with the legal form that follows them
+        if len(words) > 1 and words[-1] == "and":
+            words.pop()
+    return " ".join(words)
+
+
+def normalize_tax_id(tax_id):
+    """Key of a tax ID, ignoring case, spaces and separators"""
+    return NON_ALPHANUMERIC_PATTERN.sub("", tax_id or "").upper()
+
+
+def get_keys(tax_id, supplier_name):
+    """(index, key) pairs to look a supplier up by, tax ID first"""
+    keys = ((TAX_ID_INDEX, normalize_tax_id(tax_id)), (NAME_INDEX, normalize_supplier_name(supplier_name)))
+    return [(index, key) for index, key in keys if key]
+
+
+def find_supplier(tax_id=None, supplier_name=None):
+    """
+    Find the existing supplier with the same tax ID or normalized name
+
+    Args:
+        tax_id: Tax ID as extracted
+        supplier_name: Supplier name as extracted
+
+    Returns:
+        str: Name of the Supplier, or None
+    """
+    ensure_index()
+
+    cache = frappe.cache()
+    for index, key in get_keys(tax_id, supplier_name):
+        supplier = cache.hget(index, key)
+        if not supplier:
+            continue
+        # Entries of suppliers created in a transaction that was rolled back are dropped
+        if frappe.db.exists("Supplier", supplier):
+            return supplier
+        cache.hdel(index, key)
+
+    return None
+
+
+def ensure_index():
+    """Build the index unless it is already in Redis"""
+    if not frappe.cache().get_value(BUILT_KEY):
+        build_index()
+
+
+def build_index():
+    """Index all enabled suppliers, the oldest one winning when keys collide"""
+    suppliers = frappe.get_all(
+        "Supplier",
+        filters={"disabled": 0},
+        fields=["name", "supplier_name", "tax_id"],
+        order_by="creation desc"
+    )
+
+    entries = {TAX_ID_INDEX: {}, NAME_INDEX: {}}
+    for supplier in suppliers:
+        for index, key in get_keys(supplier.tax_id, supplier.supplier_name):
+            entries[index][key] = pickle.dumps(supplier.name)
+
+    # Write the hashes in one round trip, pickled like RedisWrapper.hset stores values
+    cache = frappe.cache()
+    pipeline = cache.pipeline()
+    for index, mapping in entries.items():
+        pipeline.delete(cache.make_key(index))
+        if mapping:
+            pipeline.hset(cache.make_key(index), mapping=mapping)
+    pipeline.execute()
+
+    clear_local_cache()
+    cache.set_value(BUILT_KEY, 1)
+
+
+def clear_index():
+    """Drop the index, it is built again on next use"""
+    frappe.cache().delete_value([BUILT_KEY, TAX_ID_INDEX, NAME_INDEX])
+
+
+def clear_local_cache():
+    """Forget index entries RedisWrapper.hget cached for this request"""
+    for index in (TAX_ID_INDEX, NAME_INDEX):
+        frappe.local.cache.pop(frappe.cache().make_key(index), None)
+
+
+def add_supplier(name, tax_id, supplier_name):
+    """Index a supplier under keys that no other supplier holds"""
+    cache = frappe.cache()
+    for index, key in get_keys(tax_id, supplier_name):
+        current = cache.hget(index, key)
+        if not current or current == name or not frappe.db.exists("Supplier", current):
+            cache.hset(index, key, name)
+
+
+def remove_supplier(name, tax_id, supplier_name):
+    """Drop the entries of a supplier"""
+    cache = frappe.cache()
+    for index, key in get_keys(tax_id, supplier_name):
+        if cache.hget(index, key) == name:
+            cache.hdel(index, key)
+
+
+def on_supplier_update(doc, method=None):
+    """Keep the index current when a Supplier is saved"""
+    if not frappe.cache().get_value(BUILT_KEY):
+        return  # Built from the database on first use
+
+    previous = doc.get_doc_before_save()
+    if previous:
+        remove_supplier(doc.name, previous.tax_id, previous.supplier_name)
+
+    if doc.disabled:
+        remove_supplier(doc.name, doc.tax_id, doc.supplier_name)
+    else:
+        add_supplier(doc.name, doc.tax_id, doc.supplier_name)
+
+
+def on_supplier_rename(doc, method=None, old=None, new=None, merge=False):
+    """Point the entries of a renamed (or merged) Supplier to its new name"""
+    if not frappe.cache().get_value(BUILT_KEY):
+        return
+
+    remove_supplier(old, doc.tax_id, doc.supplier_name)
+    if not doc.disabled:
+        add_supplier(new, doc.tax_id, doc.supplier_name)
+
+
+def on_supplier_trash(doc, method=None):
+    """Drop the entries of a deleted Supplier"""
+    if frappe.cache().get_value(BUILT_KEY):
+        remove_supplier(doc.name, doc.tax_id, doc.supplier_name)
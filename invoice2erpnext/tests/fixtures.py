@@ -0,0 +1,171 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Synthetic doc2sys responses for tests and benchmarks
+
+make_extracted_doc builds an extracted document with any number of line items
+in one of the RECONCILIATION_CASES, i.e. the ways the extracted amounts can
+disagree with each other. Documents are deterministic for a given seed.
+"""
+
+import json
+import random
+from datetime import date
+
+# Line item counts the benchmarks run with
+ITEM_COUNTS = (1, 10, 100, 1000)
+
+RECONCILIATION_CASES = (
+    "consistent",  # Lines, subtotal, tax and total all agree
+    "total_mismatch",  # The invoice total is off and has the lowest confidence
+    "tax_mismatch",  # The tax is off and has the lowest confidence
+    "subtotal_drift",  # Lines add up to a few percent more than the subtotal
+    "decimal_shift",  # Line prices were read without their decimal point
+    "discount",  # A total discount is applied on top of the lines
+    "credit",  # Some lines are negative (credits or refunds)
+)
+
+VAT_RATE = 0.19
+
+
+def _field(value, confidence=0.95, key="valueString"):
+    return {key: value, "confidence": confidence}
+
+
+def _currency(amount, confidence=0.95, currency_code="EUR"):
+    return {
+        "valueCurrency": {"amount": round(amount, 2), "currencyCode": currency_code},
+        "confidence": confidence
+    }
+
+
+def make_line_items(item_count, case="consistent", rng=None, distinct_items=None):
+    """
+    Build extracted line items
+
+    Args:
+        item_count: Number of line items
+        case: One of RECONCILIATION_CASES
+        rng: Random generator for the amounts
+        distinct_items: Lines cycle through this many products, as on utility invoices;
+            by default every line is a different product
+
+    Returns:
+        tuple: (items, line_total) with the items in doc2sys format and the sum of their amounts
+    """
+    rng = rng or random.Random(0)
+    items = []
+    line_total = 0
+
+    for idx in range(item_count):
+        quantity = rng.randint(1, 5)
+        unit_price = round(rng.uniform(1, 250), 2)
+        if case == "credit" and idx % 4 == 3:
+            unit_price = -unit_price
+        amount = round(unit_price * quantity, 2)
+        line_total += amount
+
+        extracted_price = unit_price * 100 if case == "decimal_shift" else unit_price
+        product = idx % distinct_items if distinct_items else idx
+        description = f"Service {product + 1}\nPeriod {rng.randint(1, 12)}/2025"
+        items.append({
+            "valueObject": {
+                "Description": _field(f"Service {product + 1}" if distinct_items else description),
+                "ProductCode": _field(f"SRV-{product % 250:04d}") if idx % 3 else {},
+                "Quantity": _field(quantity, key="valueNumber"),
+                "UnitPrice": _currency(extracted_price),
+                "Amount": _currency(amount * 100 if case == "decimal_shift" else amount)
+            }
+        })
+
+    return items, round(line_total, 2)
+
+
+def make_extracted_doc(item_count=10, case="consistent", seed=0, invoice_id=None, vendor_name="Benchmark Supplies Ltd",
+                       distinct_items=None):
+    """
+    Build an extracted document as returned by doc2sys
+
+    Args:
+        item_count: Number of line items
+        case: One of RECONCILIATION_CASES
+        seed: Seed for the random amounts
+        invoice_id: Bill number, defaults to one derived from the other arguments
+        vendor_name: Supplier name on the invoice
+        distinct_items: Number of products the lines cycle through, see make_line_items
+
+    Returns:
+        dict: The extracted document
+    """
+    if case not in RECONCILIATION_CASES:
+        raise ValueError(f"Unknown reconciliation case {case}")
+
+    rng = random.Random(f"{seed}-{item_count}-{case}")
+    items, line_total = make_line_items(item_count, case, rng, distinct_items)
+
+    subtotal = line_total
+    if case == "subtotal_drift":
+        subtotal = round(line_total * 0.97, 2)
+
+    discount = round(subtotal * 0.05, 2) if case == "discount" else 0
+    tax = round((subtotal - discount) * VAT_RATE, 2)
+    total = round(subtotal + tax - discount, 2)
+
+    total_confidence = tax_confidence = 0.95
+    if case == "total_mismatch":
+        total, total_confidence = round(total + 10, 2), 0.4
+    elif case == "tax_mismatch":
+        tax, tax_confidence = round(tax + 10, 2), 0.4
+
+    extracted_doc = {
+        "InvoiceId": _field(invoice_id or f"BENCH-{seed}-{item_count}-{case}"),
+        "InvoiceDate": _field("2025-03-14", key="valueDate"),
+        "VendorName": _field(vendor_name),
+        "VendorAddress": {
+            "valueAddress": {
+                "streetAddress": "1 Makariou Avenue",
+                "city": "Nicosia",
+                "postalCode": "1065",
+                "countryRegion": "Cyprus"
+            },
+            "confidence": 0.9
+        },
+        "VendorTaxId": _field("CY10000000X"),
+        "SubTotal": _currency(subtotal),
+        "TotalTax": _currency(tax, tax_confidence),
+        "InvoiceTotal": _currency(total, total_confidence),
+        "TotalDiscount": _currency(discount),
+        "Items": {"valueArray": items}
+    }
+
+    return extracted_doc
+
+
+def make_date_strings(count, seed=0):
+    """
+    Build invoice dates written in the shapes seen in extractions
+
+    Numeric day/month dates are written day first.
+    """
+    rng = random.Random(seed)
+    shapes = ("%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%Y/%m/%d", "%d %b %Y", "%B %d %Y")
+    date_strings = []
+    for _ in range(count):
+        value = date(rng.randint(2020, 2026), rng.randint(1, 12), rng.randint(1, 28))
+        date_strings.append(value.strftime(rng.choice(shapes)))
+    return date_strings
+
+
+def make_response(extracted_doc, cost=1, success=True):
+    """Wrap an extracted document in an upload_and_create_item API response"""
+    if not success:
+        return {"message": {"success": False, "message": "Extraction failed"}}
+
+    return {
+        "message": {
+            "success": True,
+            "cost": cost,
+            "extracted_doc": json.dumps(extracted_doc)
+        }
+    }
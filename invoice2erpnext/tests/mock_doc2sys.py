@@ -0,0 +1,238 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Local stand-in for the doc2sys extraction API
+
+Serves the upload_and_create_item and get_user_credits endpoints with
+configurable latency and error rates, so uploads, retries, timeouts and
+concurrency can be load tested without spending credits:
+
+    python -m invoice2erpnext.tests.mock_doc2sys --port 8765 --latency 0.5 --error-rate 0.1
+
+Then set API Base URL in Invoice2Erpnext Settings to http://127.0.0.1:8765.
+Responses carry synthetic documents from invoice2erpnext.tests.fixtures, or the
+extracted documents found as .json files in --payload-dir, in turn.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from invoice2erpnext.tests.fixtures import RECONCILIATION_CASES, make_extracted_doc, make_response
+
+UPLOAD_PATH = "/api/method/doc2sys.doc2sys.doctype.doc2sys_item.doc2sys_item.upload_and_create_item"
+CREDITS_PATH = "/api/method/doc2sys.doc2sys.doctype.doc2sys_user_settings.doc2sys_user_settings.get_user_credits"
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class MockDoc2sysServer(ThreadingHTTPServer):
+    """
+    HTTP server answering like doc2sys
+
+    Args:
+        address: (host, port) to listen on, port 0 picks a free one
+        latency: Seconds to wait before answering each request
+        jitter: Up to this many extra seconds are added to the latency at random
+        error_rate: Fraction of requests answered with error_status
+        error_status: HTTP status of the failed requests, 503 Service Unavailable by default
+        api_error_rate: Fraction of uploads answered with an unsuccessful extraction
+        item_count: Line items in the synthetic documents
+        case: Reconciliation case of the synthetic documents
+        payload_dir: Directory of extracted document .json files served instead
+        credits: Starting credits balance
+        cost: Credits charged per extraction
+        seed: Seed for the random latency and errors
+        verbose: Log every request to stderr
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0, jitter=0, error_rate=0, api_error_rate=0, item_count=10,
+                 case="consistent", payload_dir=None, credits=1000, cost=1, seed=None, verbose=False,
+                 error_status=503):
+        super().__init__(address, MockDoc2sysHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.api_error_rate = api_error_rate
+        self.item_count = item_count
+        self.case = case
+        self.payloads = load_payloads(payload_dir) if payload_dir else []
+        self.credits = credits
+        self.cost = cost
+        self.verbose = verbose
+        self.requests = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a daemon thread and return the base URL"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def roll(self, rate):
+        """Return True with the given probability"""
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def get_delay(self):
+        with self._lock:
+            return self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def next_request(self):
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+    def charge(self):
+        """Deduct the cost of an extraction, returning False if the balance is too low"""
+        with self._lock:
+            if self.credits < self.cost:
+                return False
+            self.credits -= self.cost
+            return True
+
+    def get_extracted_doc(self, request_number, content_hash):
+        """Canned payload for an upload, with a bill number derived from the file content"""
+        if self.payloads:
+            return self.payloads[(request_number - 1) % len(self.payloads)]
+
+        return make_extracted_doc(
+            self.item_count,
+            self.case,
+            seed=content_hash,
+            invoice_id=f"MOCK-{content_hash[:10]}"
+        )
+
+
+class MockDoc2sysHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive like the real API
+
+    def do_POST(self):
+        request_number = self.server.next_request()
+        content_hash = self.read_body()
+
+        delay = self.server.get_delay()
+        if delay:
+            time.sleep(delay)
+
+        if self.path not in (UPLOAD_PATH, CREDITS_PATH):
+            return self.send_json(404, {"exc_type": "DoesNotExistError"})
+
+        if not self.headers.get("Authorization", "").startswith("token "):
+            return self.send_json(401, {"exc_type": "AuthenticationError"})
+
+        if self.server.roll(self.server.error_rate):
+            return self.send_json(self.server.error_status, {"exc_type": "ServiceUnavailable"})
+
+        if self.path == CREDITS_PATH:
+            return self.send_json(200, {"message": {"success": True, "credits": self.server.credits}})
+
+        if self.server.roll(self.server.api_error_rate):
+            return self.send_json(200, make_response(None, success=False))
+
+        if not self.server.charge():
+            return self.send_json(200, {"message": {"success": False, "message": "Insufficient credits"}})
+
+        extracted_doc = self.server.get_extracted_doc(request_number, content_hash)
+        self.send_json(200, make_response(extracted_doc, cost=self.server.cost))
+
+    do_GET = do_POST
+
+    def read_body(self):
+        """Consume the request body in chunks, returning the SHA-256 of its content"""
+        sha256 = hashlib.sha256()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        while remaining > 0:
+            chunk = self.rfile.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            sha256.update(chunk)
+            remaining -= len(chunk)
+        return sha256.hexdigest()
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def load_payloads(payload_dir):
+    """Load the extracted documents stored as .json files in a directory"""
+    payloads = []
+    for file_name in sorted(os.listdir(payload_dir)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(payload_dir, file_name)) as f:
+                payloads.append(json.load(f))
+
+    if not payloads:
+        raise ValueError(f"No .json payloads found in {payload_dir}")
+    return payloads
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the doc2sys extraction API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="seconds to wait before each response")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of those errors")
+    parser.add_argument("--api-error-rate", type=float, default=0, help="fraction of uploads failing extraction")
+    parser.add_argument("--items", type=int, default=10, help="line items per synthetic document")
+    parser.add_argument("--case", default="consistent", choices=RECONCILIATION_CASES)
+    parser.add_argument("--payload-dir", help="directory of extracted document .json files to serve instead")
+    parser.add_argument("--credits", type=float, default=1000)
+    parser.add_argument("--cost", type=float, default=1)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(args)
+
+    server = MockDoc2sysServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        api_error_rate=args.api_error_rate,
+        item_count=args.items,
+        case=args.case,
+        payload_dir=args.payload_dir,
+        credits=args.credits,
+        cost=args.cost,
+        seed=args.seed,
+        verbose=args.verbose
+    )
+
+    print(f"Mock doc2sys listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from invoice2erpnext import client
+from invoice2erpnext.invoice2erpnext.doctype.invoice2erpnext_settings.invoice2erpnext_settings import (
+	SettingsSnapshot,
+)
+from invoice2erpnext.tests.mock_doc2sys import CREDITS_PATH, UPLOAD_PATH, MockDoc2sysServer
+
+
+class TestClient(unittest.TestCase):
+	def test_get_session_per_retry_policy(self):
+		credits_session = client.get_session(2, 10)
+		upload_session = client.get_session(2, 10, client.UPLOAD_RETRY_STATUS_CODES)
+
+		self.assertIs(client.get_session(2, 10, list(client.RETRY_STATUS_CODES)), credits_session)
+		self.assertIsNot(upload_session, credits_session)
+		self.assertIsNot(client.get_session(3, 10), credits_session)
+
+		for session, status_codes in ((credits_session, client.RETRY_STATUS_CODES), (upload_session, (429, 503))):
+			retry = session.get_adapter("https://kainotomo.com").max_retries
+			self.assertEqual(tuple(retry.status_forcelist), status_codes)
+			self.assertEqual((retry.total, retry.connect, retry.status), (2, 2, 2))
+			# A request that reached the server is never sent again after a read error
+			self.assertEqual(retry.read, 0)
+			self.assertIn("POST", retry.allowed_methods)
+			self.assertTrue(retry.respect_retry_after_header)
+
+	def test_post_defaults_to_max_retries(self):
+		server = self._start_server()
+
+		# Settings saved before Max Retries existed have it unset
+		for max_retries, expected in ((0, client.DEFAULT_MAX_RETRIES), (None, client.DEFAULT_MAX_RETRIES), (1, 1)):
+			settings = SettingsSnapshot(base_url=server.base_url, api_key="test", api_secret="test", max_retries=max_retries)
+			with patch.object(client, "get_session", wraps=client.get_session) as get_session:
+				client.post(settings, CREDITS_PATH, json={})
+			self.assertEqual(get_session.call_args.args[0], expected)
+
+	def test_post_retries_uploads_only_when_not_extracted(self):
+		server = self._start_server()
+		server.error_rate = 1
+		settings = SettingsSnapshot(base_url=server.base_url, api_key="test", api_secret="test", max_retries=1)
+
+		# (status, retry status codes, requests the server receives)
+		cases = (
+			(500, client.RETRY_STATUS_CODES, 2),
+			(503, client.RETRY_STATUS_CODES, 2),
+			(500, client.UPLOAD_RETRY_STATUS_CODES, 1),
+			(502, client.UPLOAD_RETRY_STATUS_CODES, 1),
+			(504, client.UPLOAD_RETRY_STATUS_CODES, 1),
+			(503, client.UPLOAD_RETRY_STATUS_CODES, 2),
+			(429, client.UPLOAD_RETRY_STATUS_CODES, 2),
+		)
+		for status, retry_status_codes, requests in cases:
+			server.error_status = status
+			server.requests = 0
+			path = CREDITS_PATH if retry_status_codes == client.RETRY_STATUS_CODES else UPLOAD_PATH
+
+			response = client.post(settings, path, retry_status_codes=retry_status_codes, data=b"%PDF-1.4")
+
+			self.assertEqual(response.status_code, status)
+			self.assertEqual(server.requests, requests, f"{status} to {path}")
+
+	def test_multipart_file_stream(self):
+		content = os.urandom(3 * client.UPLOAD_CHUNK_SIZE + 17)
+		with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+			file.write(content)
+		self.addCleanup(os.remove, file.name)
+
+		with client.MultipartFileStream(file.name, 'in"voice.pdf', "application/pdf", fields={"is_private": "1"}) as body:
+			self.assertIsNone(body.finished_at)
+			data = b"".join(body)
+
+			# The declared length is the length of the body actually sent
+			self.assertEqual(len(body), len(data))
+			self.assertIn(content, data)
+			self.assertIn(b'filename="in%22voice.pdf"', data)
+			self.assertIn(b'name="is_private"\r\n\r\n1\r\n', data)
+			self.assertIsNotNone(body.finished_at)
+
+			# A retry rewinds a partly sent body and sends it again in full
+			for position in (5, len(data) - len(content) - 5, len(data) - 3):
+				body.seek(0)
+				self.assertEqual(body.read(position), data[:position])
+				self.assertIsNone(body.finished_at)
+				self.assertEqual(body.tell(), position)
+				body.seek(0)
+				self.assertEqual(body.read(), data)
+				self.assertIsNotNone(body.finished_at)
+
+			# Seeking within the file part keeps the file pointer in step
+			body.seek(len(data) - len(content) - 10)
+			self.assertEqual(body.read(100), data[-len(content) - 10:-len(content) + 90])
+			self.assertEqual(body.seek(-4, os.SEEK_END), len(data) - 4)
+			self.assertEqual(body.read(), data[-4:])
+
+	def _start_server(self):
+		server = MockDoc2sysServer(("127.0.0.1", 0))
+		server.start()
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		return server
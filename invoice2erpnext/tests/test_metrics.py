@@ -0,0 +1,58 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from invoice2erpnext import metrics
+
+
+class TestMetrics(FrappeTestCase):
+	def setUp(self):
+		metrics.clear()
+		self.addCleanup(metrics.clear)
+
+	def test_render_counters(self):
+		metrics.inc("invoice2erpnext_files_processed_total", status="Success")
+		metrics.inc("invoice2erpnext_files_processed_total", status="Success")
+		metrics.inc("invoice2erpnext_files_processed_total", status="Error")
+		metrics.inc("invoice2erpnext_credits_spent_total", 2.5)
+
+		lines = metrics.render().splitlines()
+
+		self.assertIn("# TYPE invoice2erpnext_files_processed_total counter", lines)
+		self.assertIn('invoice2erpnext_files_processed_total{status="Error"} 1', lines)
+		self.assertIn('invoice2erpnext_files_processed_total{status="Success"} 2', lines)
+		self.assertIn("invoice2erpnext_credits_spent_total 2.5", lines)
+		self.assertIn("# TYPE invoice2erpnext_queue_depth gauge", lines)
+		self.assertTrue(any(line.startswith('invoice2erpnext_queue_depth{status="Queued"} ') for line in lines))
+
+	def test_render_histograms(self):
+		for value in (0.7, 45, 400):
+			metrics.observe("invoice2erpnext_processing_seconds", value)
+		metrics.observe("invoice2erpnext_api_request_seconds", 3, status="200")
+
+		lines = metrics.render().splitlines()
+
+		# Cumulative buckets in order of their bounds, empty ones included, then the sum and count
+		self.assertIn("# TYPE invoice2erpnext_processing_seconds histogram", lines)
+		self.assertEqual([line for line in lines if line.startswith("invoice2erpnext_processing_seconds")], [
+			'invoice2erpnext_processing_seconds_bucket{le="0.5"} 0',
+			'invoice2erpnext_processing_seconds_bucket{le="1"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="2.5"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="5"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="10"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="20"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="30"} 1',
+			'invoice2erpnext_processing_seconds_bucket{le="60"} 2',
+			'invoice2erpnext_processing_seconds_bucket{le="120"} 2',
+			'invoice2erpnext_processing_seconds_bucket{le="300"} 2',
+			'invoice2erpnext_processing_seconds_bucket{le="+Inf"} 3',
+			"invoice2erpnext_processing_seconds_sum 445.7",
+			"invoice2erpnext_processing_seconds_count 3",
+		])
+
+		# Labels of the series come before the bound
+		self.assertIn('invoice2erpnext_api_request_seconds_bucket{status="200",le="2.5"} 0', lines)
+		self.assertIn('invoice2erpnext_api_request_seconds_bucket{status="200",le="5"} 1', lines)
+		self.assertIn('invoice2erpnext_api_request_seconds_bucket{status="200",le="+Inf"} 1', lines)
+		self.assertIn('invoice2erpnext_api_request_seconds_count{status="200"} 1', lines)
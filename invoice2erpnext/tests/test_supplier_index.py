@@ -0,0 +1,23 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+import unittest
+
+from invoice2erpnext import supplier_index
+
+
+class TestSupplierIndex(unittest.TestCase):
+	"""Checks of the supplier index keys, without a site"""
+
+	def test_normalize_supplier_name(self):
+		for name in ("ACME Ltd.", "Acme LTD", "ACME, Limited", "  acme  "):
+			self.assertEqual(supplier_index.normalize_supplier_name(name), "acme")
+		self.assertEqual(supplier_index.normalize_supplier_name("Müller GmbH & Co. KG"), "muller")
+		self.assertEqual(supplier_index.normalize_supplier_name("A.B.C. S.A."), "abc")
+		# A name made only of a legal form keeps it
+		self.assertEqual(supplier_index.normalize_supplier_name("Limited"), "limited")
+		self.assertEqual(supplier_index.normalize_supplier_name(None), "")
+
+	def test_normalize_tax_id(self):
+		self.assertEqual(supplier_index.normalize_tax_id("cy 1234-567 x"), "CY1234567X")
+		self.assertEqual(supplier_index.normalize_tax_id("CY.1234/567.X"), "CY1234567X")
@@ -0,0 +1,79 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+from invoice2erpnext import dates, reconcile, transform
+from invoice2erpnext.extraction import ExtractedInvoice, round_amount
+from invoice2erpnext.tests.fixtures import make_extracted_doc
+
+
+class TestTransform(unittest.TestCase):
+	"""Checks of the Frappe-free transformation, without a site"""
+
+	def test_process_multiple_items_repeated_codes(self):
+		# 80 lines cycling through 4 products; every third line has no product code
+		invoice = ExtractedInvoice.parse(make_extracted_doc(80, distinct_items=4))
+
+		result = transform.process_multiple_items(invoice.items, "All Item Groups")
+
+		# One Item per product code, plus one per description of the lines without a code
+		item_codes = [item_doc["item_code"] for item_doc in result["item_docs"]]
+		self.assertEqual(len(item_codes), 8)
+		self.assertEqual(len(set(item_codes)), len(item_codes))
+		# Every line still becomes an invoice row
+		self.assertEqual(len(result["invoice_items"]), 80)
+		self.assertEqual({item["item_code"] for item in result["invoice_items"]}, set(item_codes))
+
+	def test_adjust_item_prices_exact(self):
+		# 293.41 * 0.5 is 146.705, a tie rounded to even; on floats it came out as 146.71
+		items = [{"qty": 3, "rate": 293.41}, {"qty": 1, "rate": 10.01}]
+		# Each rate a third of a cent below its share; rounded quotients broke that tie differently
+		tied_items = [{"qty": 1, "rate": rate} for rate in (0.01, 9.01, 234.01)]
+
+		adjusted = []
+		for invoice_items, subtotal, line_total in ((items, 445.12, 890.24), (tied_items, 81.01, 243.03)):
+			with patch.object(reconcile, "ARRAY_MIN_ITEMS", len(invoice_items) + 1):
+				per_item = transform.adjust_item_prices([dict(item) for item in invoice_items], subtotal, line_total, "")
+			with patch.object(reconcile, "ARRAY_MIN_ITEMS", 1):
+				on_integers = transform.adjust_item_prices([dict(item) for item in invoice_items], subtotal, line_total, "")
+
+			self.assertEqual(on_integers, per_item)
+			self.assertAlmostEqual(sum(item["amount"] for item in per_item), subtotal, delta=0.001)
+			adjusted.append(per_item)
+
+		self.assertEqual(adjusted[0][0]["rate"], 146.7)
+
+	def test_round_amount(self):
+		# Half to even on the decimal value, like Frappe's banker's rounding
+		self.assertEqual([round_amount(value) for value in (2.675, 2.665, 1.005, -0.125)], [2.68, 2.66, 1.0, -0.12])
+		self.assertEqual([round_amount(value) for value in (None, "", "abc", "12.345")], [0, 0, 0, 12.34])
+
+	def test_validate_and_fix_date(self):
+		lookups = transform.Lookups()
+		date_strings = (
+			"2025-03-14", "2025/3/14", "14/03/2025", "03-14-2025", "14.3.2025",
+			"14 Mar 2025", "14 March, 2025", "March 14, 2025", " Mar. 14 2025 ",
+		)
+		for date_string in date_strings:
+			self.assertEqual(transform.validate_and_fix_date(date_string, lookups=lookups), "2025-03-14", date_string)
+
+		# Only reformatted dates are recorded, with the order they were read in
+		self.assertEqual(len(lookups.diagnostics), len(date_strings) - 1)
+		self.assertEqual(lookups.diagnostics[1]["code"], "date_fixed")
+		self.assertEqual(lookups.diagnostics[1]["order"], dates.DAY_FIRST)
+
+		# Dates that can't be read fall back to today
+		for date_string, code in (("31/02/2025", "date_unparsable"), ("", "date_missing"), ("next week", "date_unparsable")):
+			self.assertEqual(transform.validate_and_fix_date(date_string, lookups=lookups), lookups.today())
+			self.assertEqual(lookups.diagnostics[-1]["code"], code)
+
+	def test_validate_and_fix_date_supplier_order(self):
+		lookups = transform.Lookups()
+
+		# Ambiguous dates are read day first until the supplier shows its order
+		self.assertEqual(transform.validate_and_fix_date("03/04/2025", lookups=lookups, supplier="US Co"), "2025-04-03")
+		self.assertEqual(transform.validate_and_fix_date("12/31/2025", lookups=lookups, supplier="US Co"), "2025-12-31")
+		self.assertEqual(transform.validate_and_fix_date("03/04/2025", lookups=lookups, supplier="US Co"), "2025-03-04")
+		self.assertEqual(transform.validate_and_fix_date("03/04/2025", lookups=lookups, supplier="EU Co"), "2025-04-03")
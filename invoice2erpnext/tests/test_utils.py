@@ -0,0 +1,44 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and Contributors
+# See license.txt
+
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from invoice2erpnext.tests.fixtures import make_extracted_doc
+from invoice2erpnext.utils import compress_text, decompress_text, log_error_throttled
+
+
+class TestUtils(unittest.TestCase):
+	def test_compress_text(self):
+		extracted_doc = json.dumps(make_extracted_doc(50), ensure_ascii=False)
+
+		for text in ("", "Ελληνικά – Straße €", extracted_doc):
+			compressed = compress_text(text)
+			self.assertIsInstance(compressed, str)
+			self.assertEqual(decompress_text(compressed), text)
+
+		# The point of compressing: extractions shrink to a fraction of their size
+		self.assertLess(len(compress_text(extracted_doc)), len(extracted_doc) / 3)
+
+
+class TestLogErrorThrottled(FrappeTestCase):
+	def test_log_error_throttled(self):
+		keys = [f"test_{frappe.generate_hash(length=8)}" for _ in range(2)]
+		for key in keys:
+			self.addCleanup(frappe.cache().delete, frappe.cache().make_key(f"invoice2erpnext:error_log:{key}"))
+
+		with patch.object(frappe, "log_error") as log_error:
+			# One Error Log per kind of error within the interval
+			logged = [log_error_throttled(f"{key} failed {i}", key, interval=1) for key in keys for i in range(3)]
+			self.assertEqual(logged, [True, False, False] * 2)
+			self.assertEqual([call.args[0] for call in log_error.call_args_list], [f"{key} failed 0" for key in keys])
+
+			# And another one once the interval has passed
+			time.sleep(1.1)
+			self.assertTrue(log_error_throttled(f"{keys[0]} failed 3", keys[0], interval=1))
+			self.assertEqual(log_error.call_count, 3)
@@ -0,0 +1,632 @@
+# Copyright (c) 2025, KAINOTOMO PH LTD and contributors
+# For license information, please see license.txt
+
+"""
+Transformation of extracted invoices into ERPNext documents
+
+This module doesn't depend on Frappe. Everything the transformation needs from
+a site (whether a record exists, today's date, error logging and diagnostics)
+goes through a Lookups object, so stored extractions can be replayed in a plain
+Python process:
+
+    from types import SimpleNamespace
+    settings = SimpleNamespace(supplier_group="", item_group="", one_item_invoice=0, item=None, vat_account="")
+    result = transform_invoice(extracted_doc, settings)
+
+Settings can be any object with the supplier_group, item_group, one_item_invoice,
+item and vat_account attributes, such as the Invoice2Erpnext Settings snapshot.
+"""
+
+import hashlib
+from datetime import date
+from operator import mul
+from typing import Any, Dict, List
+
+from invoice2erpnext import dates, money, reconcile
+from invoice2erpnext.extraction import Address, ExtractedInvoice, round_amount
+
+# Differences up to this amount are treated as rounding, not as inconsistencies
+ROUNDING_TOLERANCE = 0.05
+
+
+
+class Lookups:
+    """
+    Site lookups used by the transformation
+
+    This default has no site behind it: no record exists, errors and
+    diagnostics are collected in errors and diagnostics, and today is the
+    local date. Invoice2Erpnext Log injects a subclass backed by the site
+    database.
+
+    Diagnostics are routine findings about a document (a fixed date, a low
+    score) that are kept with the document. Errors are unexpected failures.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.diagnostics = []
+        self.date_orders = {}
+
+    def exists(self, doctype, name) -> bool:
+        """Check whether a record exists"""
+        return False
+
+    def log_error(self, message):
+        """Record an unexpected failure while transforming"""
+        self.errors.append(message)
+
+    def add_diagnostic(self, code, message, **details):
+        """
+        Record a finding about the document being transformed
+
+        Args:
+            code: Stable identifier of the kind of finding, e.g. "date_fixed"
+            message: Human readable description
+            **details: Values behind the finding
+        """
+        self.diagnostics.append({"code": code, "message": message, **details})
+
+    def today(self) -> str:
+        """Today's date in YYYY-MM-DD format"""
+        return date.today().isoformat()
+
+    def find_supplier(self, tax_id, supplier_name):
+        """Name of the existing supplier with the same tax ID or normalized name, or None"""
+        return None
+
+    def get_date_order(self, supplier):
+        """Day/month order learned for a supplier (dates.DAY_FIRST or dates.MONTH_FIRST), or None"""
+        return self.date_orders.get(supplier)
+
+    def set_date_order(self, supplier, order):
+        """Remember the day/month order a supplier writes dates in"""
+        self.date_orders[supplier] = order
+
+
+def transform_invoice(invoice, settings, lookups=None) -> Dict[str, Any]:
+    """
+    Full transformation of an extracted document for automatic mode
+
+    Args:
+        invoice: ExtractedInvoice, or the extracted document as returned by doc2sys
+        settings: Settings providing groups, the single item mode and the VAT account
+        lookups: Lookups to use, defaults to one without a site
+
+    Returns:
+        dict: {"success": True, "erpnext_docs": [...]} with the Supplier, Item and
+            Purchase Invoice documents to create, or {"success": False, "error": ...}
+    """
+    lookups = lookups or Lookups()
+
+    # Initialize result structure
+    result = {
+        "success": True,
+        "erpnext_docs": []
+    }
+
+    try:
+        if not isinstance(invoice, ExtractedInvoice):
+            invoice = ExtractedInvoice.parse(invoice)
+
+        # Document quality score tracking
+        document_score = 0
+
+        # Extract basic invoice information
+        bill_no, document_score = extract_bill_number(invoice, document_score)
+
+        # Get vendor information
+        vendor_info = extract_vendor_info(invoice, document_score)
+        document_score = vendor_info.get('document_score', document_score)
+        vendor_name = vendor_info.get('vendor_name', '')
+
+        if not vendor_name:
+            raise ValueError("Vendor name not found in extracted document")
+
+        # 1. Create Supplier document, named after the existing supplier it matches
+        supplier_doc = create_supplier_doc(vendor_info, settings, lookups)
+        result["erpnext_docs"].append(supplier_doc)
+        supplier = supplier_doc["supplier_name"]
+
+        # 2. Process items
+        items_result = process_items(invoice, bill_no, document_score, settings, lookups)
+        document_score = items_result.get('document_score', document_score)
+        invoice_items = items_result.get('invoice_items', [])
+        result["erpnext_docs"].extend(items_result.get('item_docs', []))
+
+        # 3. Extract date and currency
+        date_currency = extract_date_currency(invoice, bill_no, document_score, lookups)
+        document_score = date_currency.get('document_score', document_score)
+        invoice_date = date_currency.get('invoice_date', '')
+        currency = date_currency.get('currency', 'EUR')
+
+        # 4. Extract payment terms
+        payment_terms = invoice.payment_term
+
+        # 5. Create Purchase Invoice structure
+        purchase_invoice = {
+            "doctype": "Purchase Invoice",
+            "title": supplier,
+            "supplier": supplier,
+            "bill_no": bill_no,
+            "bill_date": invoice_date,
+            "posting_date": invoice_date,
+            "currency": currency,
+            "conversion_rate": 1,
+            "set_posting_time": 1,
+            "items": invoice_items,
+            "payment_terms_template": payment_terms if lookups.exists("Payment Terms Template", payment_terms) else "",
+        }
+
+        # 6. Process amounts and adjust items if needed
+        amounts_result = process_amounts(invoice, invoice_items, bill_no)
+        purchase_invoice["discount_amount"] = amounts_result.get('total_discount', 0)
+
+        # Make sure to update the purchase_invoice with the final invoice_items list
+        purchase_invoice["items"] = amounts_result.get('adjusted_items', invoice_items)
+
+        # 7. Add taxes
+        total_tax = amounts_result.get('total_tax', 0)
+        if total_tax:
+            purchase_invoice["taxes"] = [{
+                "charge_type": "Actual",
+                "account_head": get_vat_account(settings),
+                "description": "VAT",
+                "tax_amount": total_tax,
+                "included_in_print_rate": 0  # Tax is NOT included (since we extracted it)
+            }]
+
+        result["erpnext_docs"].append(purchase_invoice)
+
+        # Log document quality score
+        if document_score < 80:
+            lookups.add_diagnostic(
+                "low_score",
+                f"Low-quality document extraction (score: {document_score}/100) for invoice {bill_no}",
+                score=document_score
+            )
+
+        return result
+
+    except Exception as e:
+        lookups.log_error(f"Error transforming extracted document: {str(e)}")
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+def extract_bill_number(invoice, document_score):
+    """Extract bill number from document"""
+    bill_no = invoice.invoice_id
+    if bill_no:
+        document_score += 20
+    return bill_no, document_score
+
+
+def extract_vendor_info(invoice, document_score):
+    """Extract vendor information from document"""
+    vendor_name = invoice.vendor_name
+    if vendor_name:
+        document_score += 20
+
+    return {
+        'vendor_name': vendor_name,
+        'vendor_address': invoice.vendor_address,
+        'vendor_tax_id': invoice.vendor_tax_id,
+        'document_score': document_score
+    }
+
+
+def create_supplier_doc(vendor_info, settings, lookups=None):
+    """
+    Create supplier document structure
+
+    If a supplier with the same tax ID or normalized name exists (e.g. "ACME LTD"
+    for "ACME Ltd."), the document carries its name, so no duplicate is created.
+    """
+    lookups = lookups or Lookups()
+
+    # Get supplier group from settings
+    supplier_group = settings.supplier_group or "All Supplier Groups"
+
+    vendor_name = vendor_info.get('vendor_name', '')
+    vendor_address = vendor_info.get('vendor_address') or Address()
+    vendor_tax_id = vendor_info.get('vendor_tax_id', '')
+
+    supplier_name = lookups.find_supplier(vendor_tax_id, vendor_name) or vendor_name
+    if supplier_name != vendor_name:
+        lookups.add_diagnostic(
+            "supplier_matched",
+            f"Vendor {vendor_name} matched existing supplier {supplier_name}",
+            vendor_name=vendor_name,
+            supplier=supplier_name
+        )
+
+    return {
+        "doctype": "Supplier",
+        "supplier_name": supplier_name,
+        "supplier_group": supplier_group,
+        "supplier_type": "Company",  # Default value
+        "country": "Cyprus" if vendor_address.country_region is None else vendor_address.country_region,
+        "address_line1": vendor_address.street_address or "",
+        "city": "Larnaka" if vendor_address.city is None else vendor_address.city,
+        "pincode": vendor_address.postal_code or "",
+        "tax_id": vendor_tax_id
+    }
+
+
+def extract_date_currency(invoice, bill_no, document_score, lookups=None):
+    """Extract date and currency information"""
+    invoice_date = validate_and_fix_date(invoice.invoice_date, bill_no, lookups, invoice.vendor_name)
+    if invoice_date:
+        document_score += 20
+
+    currency = invoice.currency
+
+    return {
+        'invoice_date': invoice_date,
+        'currency': currency,
+        'document_score': document_score
+    }
+
+
+def process_items(invoice, bill_no, document_score, settings, lookups=None):
+    """Process items from extracted document"""
+    lookups = lookups or Lookups()
+
+    # Get settings
+    one_item_invoice = settings.one_item_invoice or 0
+    settings_item = settings.item if one_item_invoice else None
+    item_group = settings.item_group or "All Item Groups"
+
+    items = invoice.items
+    if items:
+        document_score += 20
+
+    invoice_items = []
+    item_docs = []
+
+    # Check for currency consistency among items
+    invoice_currency = invoice.currency
+    item_currencies = {item.currency_code for item in items if item.currency_code}
+
+    if item_currencies and any(curr != invoice_currency for curr in item_currencies):
+        lookups.add_diagnostic(
+            "currency_mismatch",
+            f"Currency mismatch: Invoice is {invoice_currency} but items have {item_currencies} in invoice {bill_no}",
+            invoice_currency=invoice_currency,
+            item_currencies=sorted(item_currencies)
+        )
+
+    # Process items based on the one_item_invoice setting
+    if one_item_invoice and settings_item and lookups.exists("Item", settings_item):
+        # Single item mode
+        result = process_single_item(items, settings_item, bill_no)
+        invoice_items = result.get('invoice_items', [])
+    else:
+        # Multi-item mode
+        result = process_multiple_items(items, item_group)
+        invoice_items = result.get('invoice_items', [])
+        item_docs = result.get('item_docs', [])
+
+    return {
+        'invoice_items': invoice_items,
+        'item_docs': item_docs,
+        'document_score': document_score
+    }
+
+
+def process_single_item(items, settings_item, bill_no):
+    """Process all items as a single combined item"""
+    # Calculate the total amount for all items
+    total_amount = 0
+    combined_description = []
+
+    # Process each item to calculate totals but don't create separate items
+    for idx, item in enumerate(items):
+        if item.description:
+            combined_description.append(f"{idx+1}. {item.description}")
+
+        total_amount += item.amount
+
+    # Create a single invoice item with quantity=1 and rate=total_amount
+    invoice_item = {
+        "item_code": settings_item,
+        "qty": 1,  # Always use quantity of 1 for one_item_invoice
+        "rate": total_amount,  # Rate equals total amount since qty=1
+        "amount": total_amount,
+        "description": "\n".join(combined_description) if combined_description else f"Combined invoice items for {bill_no}",
+        "uom": "Nos"
+    }
+
+    return {
+        'invoice_items': [invoice_item]
+    }
+
+
+def process_multiple_items(items, item_group):
+    """Process multiple items individually"""
+    invoice_items = []
+    item_docs = []
+    item_codes = set()  # Lines sharing a code only need one Item document
+
+    for idx, item in enumerate(items):
+        description = item.description
+
+        # Get product code if available, otherwise generate one
+        product_code = item.product_code
+        if product_code:
+            item_code = f"{product_code}"
+        else:
+            # Generate item code based on description with hash for uniqueness
+            desc_hash = hashlib.md5(description.encode()).hexdigest()[:8] if description else ""
+            item_code = f"I2E-{desc_hash}"
+
+        # Get item details with standardized precision
+        amount = item.amount
+        unit_price = item.unit_price
+        quantity = item.quantity
+
+        # Create Item document once per item code
+        if item_code not in item_codes:
+            item_codes.add(item_code)
+            item_doc = {
+                "doctype": "Item",
+                "item_code": item_code,
+                "item_name": description.split("\n")[0][:140] if description else f"Item {idx+1}",
+                "description": description,
+                "item_group": item_group,
+                "stock_uom": "Nos",
+                "is_stock_item": 0,  # Assuming service item
+                "is_purchase_item": 1
+            }
+            item_docs.append(item_doc)
+
+        # Handle negative amounts (credits/refunds)
+        is_credit = amount < 0
+
+        # Create invoice item
+        invoice_item = create_invoice_item(item_code, quantity, unit_price, amount, description, is_credit)
+        invoice_items.append(invoice_item)
+
+    return {
+        'invoice_items': invoice_items,
+        'item_docs': item_docs
+    }
+
+
+def create_invoice_item(item_code, quantity, unit_price, amount, description, is_credit):
+    """Create an invoice item based on extracted data"""
+    if unit_price and quantity and amount:
+        calculated_amount = round_amount(unit_price * quantity)
+
+        # Handle both discount and markup scenarios
+        if abs(calculated_amount - amount) > ROUNDING_TOLERANCE:
+            # Use the final amount to determine the effective rate
+            return {
+                "item_code": item_code,
+                "qty": abs(quantity),  # Always positive quantity
+                "rate": amount / quantity if quantity else amount,  # Add division by zero protection
+                "amount": amount,
+                "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
+                "uom": "Nos"
+            }
+        else:
+            # No discount/markup - use unit price as is
+            return {
+                "item_code": item_code,
+                "qty": abs(quantity),  # Always positive quantity
+                "rate": unit_price * (-1 if is_credit else 1),
+                "amount": amount,
+                "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
+                "uom": "Nos"
+            }
+    elif unit_price and quantity:
+        # We have unit price and quantity but no amount
+        calculated_amount = round_amount(unit_price * quantity)
+        return {
+            "item_code": item_code,
+            "qty": abs(quantity),
+            "rate": unit_price * (-1 if is_credit else 1),
+            "amount": calculated_amount * (-1 if is_credit else 1),
+            "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
+            "uom": "Nos"
+        }
+    elif amount:
+        # We only have the amount
+        return {
+            "item_code": item_code,
+            "qty": abs(quantity),
+            "rate": amount / quantity if quantity else amount,  # Add division by zero protection
+            "amount": amount,
+            "description": f"CREDIT: {description}" if is_credit and not description.startswith("CREDIT:") else description,
+            "uom": "Nos"
+        }
+    else:
+        # Fallback if no pricing details at all
+        return {
+            "item_code": item_code,
+            "qty": abs(quantity),
+            "rate": 0,
+            "amount": 0,
+            "description": description,
+            "uom": "Nos"
+        }
+
+
+def process_amounts(invoice, invoice_items, bill_no):
+    """Process and reconcile amount fields"""
+    # Extract amount fields with confidence scores
+    subtotal = invoice.subtotal.amount
+    subtotal_confidence = invoice.subtotal.confidence
+
+    invoice_total = invoice.invoice_total.amount
+    invoice_total_confidence = invoice.invoice_total.confidence
+
+    total_tax = invoice.total_tax.amount
+    total_tax_confidence = invoice.total_tax.confidence
+
+    total_discount = invoice.total_discount.amount
+    total_discount_confidence = invoice.total_discount.confidence
+
+    # Calculate expected invoice total and validate against extracted total
+    expected_total = round_amount(subtotal + total_tax - total_discount)
+
+    # Reconcile inconsistencies in amount fields
+    if invoice_total > 0:
+        if abs(expected_total - invoice_total) > ROUNDING_TOLERANCE:
+            # Find the field with lowest confidence
+            confidences = {
+                "invoice_total": invoice_total_confidence,
+                "subtotal": subtotal_confidence,
+                "total_tax": total_tax_confidence,
+                "total_discount": total_discount_confidence
+            }
+
+            lowest_confidence_field = min(confidences, key=confidences.get)
+
+            # Calculate the field with lowest confidence using other values
+            if lowest_confidence_field == "invoice_total":
+                invoice_total = expected_total
+            elif lowest_confidence_field == "subtotal":
+                subtotal = round_amount(invoice_total - total_tax + total_discount)
+            elif lowest_confidence_field == "total_tax":
+                total_tax = round_amount(invoice_total - subtotal + total_discount)
+            else:  # total_discount has lowest confidence
+                total_discount = round_amount(subtotal + total_tax - invoice_total)
+    elif expected_total > 0:
+        # If no invoice total was extracted but we can calculate it
+        invoice_total = expected_total
+
+    # Adjust item prices if needed
+    calculated_line_total = round_amount(sum(item.get("qty", 0) * item.get("rate", 0) for item in invoice_items))
+    adjusted_items = invoice_items.copy()
+
+    if subtotal > 0 and abs(calculated_line_total - subtotal) > ROUNDING_TOLERANCE:
+        adjusted_items = adjust_item_prices(invoice_items, subtotal, calculated_line_total, bill_no)
+
+    return {
+        'subtotal': subtotal,
+        'invoice_total': invoice_total,
+        'total_tax': total_tax,
+        'total_discount': total_discount,
+        'adjusted_items': adjusted_items
+    }
+
+
+def adjust_item_prices(invoice_items: List[Dict[str, Any]], subtotal, calculated_line_total, bill_no):
+    """
+    Adjust item prices to match the extracted subtotal
+
+    Rates are scaled in Decimal and rounded to cents; the cents still missing
+    are spread by largest remainder (money.settle_residual), so the amounts add
+    up to the subtotal exactly.
+    """
+    if len(invoice_items) >= reconcile.ARRAY_MIN_ITEMS:
+        return reconcile.adjust_item_prices(invoice_items, subtotal, calculated_line_total, ROUNDING_TOLERANCE)
+
+    adjusted_items = invoice_items.copy()
+    quantities = [money.to_decimal(item.get("qty", 0)) for item in adjusted_items]
+    rates = [money.to_decimal(item.get("rate", 0)) for item in adjusted_items]
+    subtotal = money.to_decimal(subtotal)
+    calculated_line_total = money.to_decimal(calculated_line_total)
+    # Rates in cents, once they have been changed
+    rate_cents = None
+
+    # Check if there's a huge disparity (likely decimal point issues)
+    if calculated_line_total > subtotal * 10:
+        # Simply divide by 100 for suspected decimal point issues
+        rate_cents = [money.to_cents(rate / 100) for rate in rates]
+        calculated_line_total = money.round_money(sum(map(mul, quantities, rate_cents)) / 100)
+
+    # Apply proportional adjustment to any remaining discrepancy
+    residual = 0
+    if abs(calculated_line_total - subtotal) > money.to_decimal(ROUNDING_TOLERANCE) and calculated_line_total:
+        # Rates are multiplied out first, so the division by the line total is the only rounding
+        with money.exact_context():
+            if rate_cents is None:
+                scaled_rates = [rate * subtotal * 100 for rate in rates]
+            else:
+                scaled_rates = [cents * subtotal for cents in rate_cents]
+            rate_cents = [money.to_cents(rate / calculated_line_total / 100) for rate in scaled_rates]
+            # How far each rounded rate fell short of its exact share, times the size of the line total
+            direction = 1 if calculated_line_total > 0 else -1
+            shortfalls = [(rate - cents * calculated_line_total) * direction for rate, cents in zip(scaled_rates, rate_cents)]
+        amount_cents = [money.to_cents(quantity * cents / 100) for quantity, cents in zip(quantities, rate_cents)]
+        residual = money.to_cents(subtotal) - sum(amount_cents)
+    elif rate_cents is not None:
+        amount_cents = [money.to_cents(quantity * cents / 100) for quantity, cents in zip(quantities, rate_cents)]
+    else:
+        return adjusted_items
+
+    money.settle_residual(residual, quantities, rate_cents, amount_cents, lambda index: shortfalls[index])
+
+    for item, cents, amount in zip(adjusted_items, rate_cents, amount_cents):
+        item["rate"] = money.from_cents(cents)
+        item["amount"] = money.from_cents(amount)
+
+    return adjusted_items
+
+
+def get_vat_account(settings):
+    """Get VAT account from settings"""
+    return settings.vat_account or "VAT - TC"
+
+
+def validate_and_fix_date(date_string, reference_id="", lookups=None, supplier=None):
+    """
+    Validates and fixes a date string to YYYY-MM-DD format.
+    If validation fails, returns today's date.
+
+    Ambiguous numeric dates (e.g. 03/04/2025) are read day first, unless an
+    earlier unambiguous date of the same supplier was written month first.
+
+    Args:
+        date_string: The date string to validate/fix
+        reference_id: Optional reference ID for logging (e.g., invoice number)
+        lookups: Lookups used for diagnostics, today's date and the supplier's date order
+        supplier: Optional supplier name the date order is learned for
+
+    Returns:
+        string: YYYY-MM-DD formatted date
+    """
+    lookups = lookups or Lookups()
+
+    if not date_string:
+        lookups.add_diagnostic("date_missing", f"Date missing in document {reference_id}, using today's date")
+        return lookups.today()
+
+    supplier = (supplier or "").strip().lower()
+    parsed = dates.parse_date(date_string)
+
+    if parsed and parsed.ambiguous and supplier:
+        # Read the date the way this supplier writes dates
+        order = lookups.get_date_order(supplier)
+        if order and order != parsed.order:
+            parsed = dates.parse_date(date_string, order)
+    elif parsed and supplier and parsed.numeric and parsed.order != dates.YEAR_FIRST:
+        # Learn the order from a numeric date that can only be read one way
+        if lookups.get_date_order(supplier) != parsed.order:
+            lookups.set_date_order(supplier, parsed.order)
+
+    if not parsed:
+        # If we couldn't parse the date, use today's date as fallback
+        lookups.add_diagnostic(
+            "date_unparsable",
+            f"Couldn't parse date in document {reference_id}: {date_string}, using today's date instead",
+            original=date_string
+        )
+        return lookups.today()
+
+    fixed_date = parsed.date.isoformat()
+    if fixed_date != date_string:
+        lookups.add_diagnostic(
+            "date_fixed",
+            f"Fixed invalid date format in document {reference_id}: {date_string} → {fixed_date}",
+            original=date_string,
+            fixed=fixed_date,
+            order=parsed.order,
+            ambiguous=parsed.ambiguous
+        )
+    return fixed_date
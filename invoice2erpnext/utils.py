@@ -1,7 +1,153 @@
 # Copyright (c) 2025, KAINOTOMO PH LTD and contributors
 # For license information, please see license.txt
 
+import base64
+import gzip
 import frappe
+from frappe.utils import cint, get_number_format_info
+
+# Seconds during which repeated errors of the same kind share one Error Log
+ERROR_LOG_INTERVAL = 300
+
+# Cache key of the currency formatter built from System Settings
+CURRENCY_FORMATTER_CACHE_KEY = "invoice2erpnext:currency_formatter"
+
+def compress_text(text):
+    """
+    Compress text with gzip into a base64 string that fits a text column
+    
+    Args:
+        text: The text to compress
+        
+    Returns:
+        str: base64 encoded gzip data
+    """
+    return base64.b64encode(gzip.compress(text.encode("utf-8"))).decode("ascii")
+
+def decompress_text(data):
+    """
+    Restore text compressed with compress_text
+    
+    Args:
+        data: base64 encoded gzip data
+        
+    Returns:
+        str: The original text
+    """
+    return gzip.decompress(base64.b64decode(data)).decode("utf-8")
+
+def log_error_throttled(message, key, interval=ERROR_LOG_INTERVAL):
+    """
+    Write an Error Log, at most once per interval for errors of the same kind
+    
+    During bulk runs the same failure tends to repeat for many files. The first
+    one is logged; the rest within the interval are skipped, as each log
+    document already records its own error message.
+    
+    Args:
+        message: The error message
+        key: Identifies the kind of error, e.g. "auto_mode"
+        interval: Seconds before another error of this kind is logged
+        
+    Returns:
+        bool: True if the Error Log was written
+    """
+    try:
+        cache_key = frappe.cache().make_key(f"invoice2erpnext:error_log:{key}")
+        if not frappe.cache().set(cache_key, 1, ex=interval, nx=True):
+            return False
+    except Exception:
+        pass  # Without Redis, fall back to logging every error
+    
+    frappe.log_error(message)
+    return True
+
+class CurrencyFormatter:
+    """
+    Formats amounts in a Frappe number format with a fixed precision
+    
+    Separators and grouping are worked out once when the formatter is built,
+    so formatting many amounts costs no settings lookups.
+    
+    Args:
+        number_format: A Frappe number format, e.g. "#.###,##" or "#,##,###.##"
+        precision: Decimal places, defaults to those of the number format
+    """
+    
+    __slots__ = ("number_format", "precision", "decimal_separator", "group_separator", "indian_grouping",
+                 "_template", "_separators")
+    
+    def __init__(self, number_format="#,###.##", precision=None):
+        decimal_separator, group_separator, format_precision = get_number_format_info(number_format)
+        
+        self.number_format = number_format
+        self.precision = format_precision if precision is None else precision
+        # Formats without decimals (e.g. "#.###") still need a separator if a precision is set
+        self.decimal_separator = decimal_separator or ("," if group_separator == "." else ".")
+        self.group_separator = group_separator
+        self.indian_grouping = number_format == "#,##,###.##"
+        
+        # Python groups by thousands with ","; Indian grouping is applied separately
+        grouping = "," if group_separator and not self.indian_grouping else ""
+        self._template = f"{{:{grouping}.{self.precision}f}}"
+        self._separators = str.maketrans({",": group_separator, ".": self.decimal_separator})
+    
+    def format(self, value):
+        """
+        Format an amount
+        
+        Args:
+            value: The value to format (string or numeric)
+            
+        Returns:
+            str: The amount rounded to the precision, with the format's separators
+        """
+        amount = round(_parse_amount(value), self.precision)
+        text = self._template.format(abs(amount))
+        if self.indian_grouping:
+            text = _group_indian(text)
+        
+        sign = "-" if amount < 0 else ""
+        return sign + text.translate(self._separators)
+    
+    def format_many(self, values):
+        """Format a list of amounts, e.g. the rows of a report"""
+        return [self.format(value) for value in values]
+
+def _parse_amount(value):
+    """Read an amount given as a number or as a string with a decimal comma or period"""
+    if isinstance(value, str):
+        return float(value.replace(',', '.'))
+    return float(value)
+
+def _group_indian(text):
+    """Group the integer part of 1234567.89 as 12,34,567.89 (thousands, then hundreds)"""
+    integer, point, fraction = text.partition(".")
+    if len(integer) <= 3:
+        return text
+    
+    head, tail = integer[:-3], integer[-3:]
+    groups = [head[max(end - 2, 0):end] for end in range(len(head), 0, -2)]
+    return ",".join(reversed(groups)) + "," + tail + point + fraction
+
+def build_currency_formatter():
+    """Build the formatter for the system number format and currency precision"""
+    number_format = frappe.get_system_settings("number_format") or "#,###.##"
+    # Same rule as Frappe for Currency fields: the currency precision, else that of the number format
+    precision = cint(frappe.get_system_settings("currency_precision")) or None
+    return CurrencyFormatter(number_format, precision)
+
+def get_currency_formatter():
+    """
+    The site's currency formatter, built once and kept in the cache
+    
+    The cache entry is dropped when System Settings are saved.
+    """
+    return frappe.cache().get_value(CURRENCY_FORMATTER_CACHE_KEY, generator=build_currency_formatter)
+
+def clear_currency_formatter(doc=None, method=None):
+    """Drop the cached currency formatter, called when System Settings change"""
+    frappe.cache().delete_value(CURRENCY_FORMATTER_CACHE_KEY)
 
 def format_currency_value(value):
     """
@@ -13,43 +159,19 @@ def format_currency_value(value):
     Returns:
         str: Formatted value according to system number format and currency precision
     """
-    # First ensure we have a float value to work with
-    if isinstance(value, str):
-        # Handle if value is in string format with comma or period
-        value_float = float(value.replace(',', '.'))
-    else:
-        value_float = float(value)
+    return get_currency_formatter().format(value)
+
+def format_currency_values(values):
+    """
+    Format many currency values according to system settings
     
-    # Get currency precision from Frappe
-    try:
-        currency_precision = frappe.get_precision("Currency", "amount")
-        if currency_precision is None:
-            currency_precision = 2  # Default to 2 decimal places
-    except:
-        currency_precision = 2  # Default to 2 decimal places if anything goes wrong
-    
-    # Round the value to the specified precision
-    value_float = round(value_float, currency_precision)
-    
-    # Format with the exact number of decimal places
-    value_str = f"{{:.{currency_precision}f}}".format(value_float)
-    
-    # Get the number format from system settings
-    number_format = frappe.get_system_settings('number_format')
-    
-    # Format according to the system's number format
-    if number_format == "#.###,##":  # European format (1.234,56)
-        formatted_value = value_str.replace(".", ",")
-    elif number_format == "# ###.##":  # Format with space (1 234.56)
-        integer_part, decimal_part = value_str.split(".")
-        formatted_value = f"{integer_part} {decimal_part}"
-    elif number_format == "#,###.##":  # US format (1,234.56)
-        formatted_value = value_str
-    else:
-        # Default format if none of the above
-        formatted_value = value_str
-    
-    return formatted_value
+    Args:
+        values: The values to format (strings or numerics)
+        
+    Returns:
+        list: The formatted values, in order
+    """
+    return get_currency_formatter().format_many(values)
 
 @frappe.whitelist()
 def check_settings_enabled():